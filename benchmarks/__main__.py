@@ -0,0 +1,368 @@
+"""
+Offline benchmarks of the scrape, parse, dedup and notify stages of a schedule check.
+
+Usage:
+    python -m benchmarks [--rows 100 1000 10000] [--scraper gavella ...] [--fixtures DIR] [--output results.json]
+    python -m benchmarks --compare baseline.json results.json [--tolerance 0.2]
+    python -m benchmarks --imports [--import-budget 0.75]
+
+Every scraper parses synthetic pages with each number of --rows, plus the page saved as
+<scraper>.html in --fixtures if there is one, so no network access is needed. For every page the
+benchmark records parse time, entries per second and peak memory, how much of the parse time is spent
+turning the rows of an already built tree into entries, how long deduplicating the entries
+takes against a database already holding half of them, and the cost of formatting and sending their
+notifications through a stub Apprise backend. The cold import time of the entry point and a scraper
+is measured in fresh interpreters, --imports measures only that and exits with status 1 if importing
+the entry point takes longer than --import-budget seconds.
+
+Results are written as JSON. --compare reports the timings of the second result file that are more
+than --tolerance slower than in the first, and exits with status 1 if there are any.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable
+
+import httpx
+from apprise.apprise import Apprise
+from apprise.decorators import notify
+from bs4 import Tag
+from httpx import Response
+from loguru import logger
+
+from benchmarks.fixtures import SYNTHETIC_FIXTURES, load_recorded_fixture
+from benchmarks.import_time import IMPORT_TIME_BUDGET, benchmark_import_time
+from prospero.config import HTML_PARSER
+from prospero.db import KnownEntryIndex, ScheduleDatabase, ScheduleEntryRecord
+from prospero.notifications import format_new_entries, format_new_entry
+from prospero.schedule_scraper import SCHEDULE_SCRAPERS, load_schedule_scraper
+from prospero.schedule_scraper.base import BaseScheduleScraper
+
+DEFAULT_ROWS: list[int] = [100, 1000, 10000]
+STUB_APPRISE_SCHEMA: str = 'benchmark'
+
+
+@notify(on=STUB_APPRISE_SCHEMA)
+def _stub_apprise_backend(body: str, title: str, notify_type: str, *args, **kwargs) -> bool:
+    return True
+
+
+def get_git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(function: Callable[[], Any], repeat: int) -> dict[str, float]:
+    """
+    Returns:
+        Fastest and median wall time of repeat calls of function, in seconds
+    """
+    timings: list[float] = []
+    for _ in range(repeat):
+        started_at: float = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started_at)
+    return {'min': min(timings), 'median': statistics.median(timings)}
+
+
+def build_response(schedule_scraper: type[BaseScheduleScraper], content: bytes) -> Response:
+    schedule_request: dict[str, Any] = schedule_scraper._get_schedule_request()
+    response: Response = Response(
+        200,
+        content=content,
+        request=httpx.Request(schedule_request['method'], schedule_request['url'])
+    )
+    response.encoding = 'utf-8'
+    return response
+
+
+def parse(schedule_scraper: type[BaseScheduleScraper], response: Response) -> list[ScheduleEntryRecord]:
+    return list(schedule_scraper._parse_schedule_entries(schedule_scraper._parse_schedule_soup(response)))
+
+
+def benchmark_parse(
+        schedule_scraper: type[BaseScheduleScraper],
+        response: Response,
+        repeat: int
+) -> dict[str, Any]:
+    entries: list[ScheduleEntryRecord] = parse(schedule_scraper, response)
+    parse_seconds: dict[str, float] = measure(lambda: parse(schedule_scraper, response), repeat)
+    # Building the tree dominates parsing, the rows are timed on their own to compare scraper implementations
+    rows: list[Tag] = schedule_scraper._find_schedule_rows(schedule_scraper._parse_schedule_soup(response))
+    parse_rows_seconds: dict[str, float] = measure(
+        lambda: [schedule_scraper._parse_schedule_row(row) for row in rows], repeat
+    )
+
+    # Measured separately, tracing allocations slows parsing down considerably
+    tracemalloc.start()
+    parse(schedule_scraper, response)
+    _, peak_memory_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'entries': len(entries),
+        'parse_seconds': parse_seconds,
+        'parse_rows_seconds': parse_rows_seconds,
+        'entries_per_second': len(entries) / parse_seconds['min'] if parse_seconds['min'] > 0 else None,
+        'peak_memory_bytes': peak_memory_bytes,
+    }
+
+
+def benchmark_dedup(
+        schedule_scraper: type[BaseScheduleScraper],
+        response: Response,
+        repeat: int
+) -> dict[str, Any]:
+    """
+    Deduplicate the entries of response against a database that already holds every other one of them,
+    with plain SQL lookups and with a KnownEntryIndex.
+    """
+    with tempfile.TemporaryDirectory() as data_dir:
+        db_uri: str = f'sqlite:///{Path(data_dir) / "schedule.db"}'
+
+        with ScheduleDatabase(db_uri=db_uri) as db:
+            db.add_entries(parse(schedule_scraper, response)[::2])
+
+        # Entries are parsed up front so only the database work is timed
+        entries: list[ScheduleEntryRecord] = parse(schedule_scraper, response)
+        new_entries: list[ScheduleEntryRecord] = []
+
+        def filter_with_sql() -> None:
+            with db:
+                new_entries[:] = db.filter_new_entries(entries)
+
+        db = ScheduleDatabase(db_uri=db_uri)
+        filter_with_sql_seconds: dict[str, float] = measure(filter_with_sql, repeat)
+
+        db = ScheduleDatabase(db_uri=db_uri, known_entry_index=KnownEntryIndex())
+        # The first lookup loads the index from the database
+        load_index_seconds: dict[str, float] = measure(filter_with_sql, 1)
+        filter_with_index_seconds: dict[str, float] = measure(filter_with_sql, repeat)
+
+        # One session for every repeat, so only the insert and its rollback are timed
+        db = ScheduleDatabase(db_uri=db_uri)
+
+        def insert_new_entries() -> None:
+            db.add_entries(new_entries)
+            db.session.rollback()
+
+        with db:
+            insert_seconds: dict[str, float] = measure(insert_new_entries, repeat)
+
+    return {
+        'stored_entries': (len(entries) + 1) // 2,
+        'new_entries': len(new_entries),
+        'filter_with_sql_seconds': filter_with_sql_seconds,
+        'load_index_seconds': load_index_seconds,
+        'filter_with_index_seconds': filter_with_index_seconds,
+        'insert_seconds': insert_seconds,
+    }
+
+
+def benchmark_notify(
+        schedule_scraper: type[BaseScheduleScraper],
+        response: Response,
+        repeat: int
+) -> dict[str, Any]:
+    """
+    Format the entries as notifications, one message per entry and as sent (digests above the
+    threshold), and send the latter through a stub Apprise backend that accepts everything.
+    """
+    entries: list[ScheduleEntryRecord] = parse(schedule_scraper, response)
+    messages: list[str] = format_new_entries(entries)
+    apprise: Apprise = Apprise(servers=[f'{STUB_APPRISE_SCHEMA}://'])
+
+    async def send_messages() -> None:
+        for message in messages:
+            await apprise.async_notify(body=message)
+
+    return {
+        'messages': len(messages),
+        'format_each_seconds': measure(lambda: [format_new_entry(entry) for entry in entries], repeat),
+        'format_seconds': measure(lambda: format_new_entries(entries), repeat),
+        'send_seconds': measure(lambda: asyncio.run(send_messages()), repeat),
+    }
+
+
+def get_metadata(repeat: int) -> dict[str, Any]:
+    return {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'git_revision': get_git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'html_parser': HTML_PARSER,
+        'repeat': repeat,
+    }
+
+
+def run_benchmarks(
+        scraper_names: list[str],
+        rows: list[int],
+        repeat: int,
+        fixture_dir: Path | None
+) -> dict[str, Any]:
+    results: list[dict[str, Any]] = []
+    for scraper_name in scraper_names:
+        schedule_scraper: type[BaseScheduleScraper] = load_schedule_scraper(scraper_name)
+
+        pages: list[tuple[str, bytes]] = [
+            (f'synthetic-{row_count}', SYNTHETIC_FIXTURES[scraper_name](row_count).encode())
+            for row_count
+            in rows
+        ]
+        if fixture_dir is not None:
+            recorded_page: bytes | None = load_recorded_fixture(fixture_dir, scraper_name)
+            if recorded_page is not None:
+                pages.append(('recorded', recorded_page))
+
+        for fixture, content in pages:
+            print(f'{scraper_name} {fixture}...', file=sys.stderr)
+            response: Response = build_response(schedule_scraper, content)
+            results.append({
+                'scraper': scraper_name,
+                'fixture': fixture,
+                'page_bytes': len(content),
+                **benchmark_parse(schedule_scraper, response, repeat),
+                'dedup': benchmark_dedup(schedule_scraper, response, repeat),
+                'notify': benchmark_notify(schedule_scraper, response, repeat),
+            })
+
+    return {
+        'metadata': get_metadata(repeat),
+        'import_time': benchmark_import_time(repeat),
+        'results': results,
+    }
+
+
+def flatten_timings(result: dict[str, Any], prefix: str = '') -> dict[str, float]:
+    """
+    Returns:
+        Fastest time of every *_seconds measurement in result, by dotted path
+    """
+    timings: dict[str, float] = {}
+    for key, value in result.items():
+        if not isinstance(value, dict):
+            continue
+        if key.endswith('_seconds'):
+            timings[f'{prefix}{key}'] = value['min']
+        else:
+            timings.update(flatten_timings(value, f'{prefix}{key}.'))
+    return timings
+
+
+def compare_results(baseline: dict[str, Any], candidate: dict[str, Any], tolerance: float) -> list[str]:
+    """
+    Returns:
+        Descriptions of the timings of candidate that are more than tolerance slower than in baseline
+    """
+    baseline_results: dict[tuple[str, str], dict[str, Any]] = {
+        (result['scraper'], result['fixture']): result
+        for result
+        in baseline['results']
+    }
+
+    # Import times are compared like the timings of a result, under their module's name
+    baseline_results.update(
+        (('import', module), result) for module, result in baseline.get('import_time', {}).items()
+    )
+    candidate_results: list[dict[str, Any]] = candidate['results'] + [
+        {'scraper': 'import', 'fixture': module, **result}
+        for module, result
+        in candidate.get('import_time', {}).items()
+    ]
+
+    regressions: list[str] = []
+    for result in candidate_results:
+        baseline_result: dict[str, Any] | None = baseline_results.get((result['scraper'], result['fixture']))
+        if baseline_result is None:
+            continue
+
+        baseline_timings: dict[str, float] = flatten_timings(baseline_result)
+        for name, seconds in flatten_timings(result).items():
+            baseline_seconds: float | None = baseline_timings.get(name)
+            if baseline_seconds is None or baseline_seconds <= 0:
+                continue
+
+            ratio: float = seconds / baseline_seconds
+            line: str = (
+                f'{result["scraper"]} {result["fixture"]} {name}: '
+                f'{baseline_seconds * 1000:.2f} ms -> {seconds * 1000:.2f} ms ({ratio:.2f}x)'
+            )
+            print(line)
+            if ratio > 1 + tolerance:
+                regressions.append(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scraper', nargs='+', choices=sorted(SCHEDULE_SCRAPERS), default=sorted(SCHEDULE_SCRAPERS))
+    parser.add_argument('--rows', nargs='+', type=int, default=DEFAULT_ROWS, help='Rows of the synthetic pages')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of every timed step, the fastest one counts')
+    parser.add_argument('--fixtures', type=Path, default=None, help='Directory of recorded <scraper>.html pages')
+    parser.add_argument('--output', type=Path, default=None, help='Write the results here instead of stdout')
+    parser.add_argument('--compare', nargs=2, type=Path, metavar=('BASELINE', 'CANDIDATE'))
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Slowdown reported as a regression by --compare')
+    parser.add_argument('--imports', action='store_true', help='Only measure the cold import times')
+    parser.add_argument('--import-budget', type=float, default=IMPORT_TIME_BUDGET, help='Seconds, with --imports')
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        baseline, candidate = (json.loads(path.read_text()) for path in args.compare)
+        regressions: list[str] = compare_results(baseline, candidate, args.tolerance)
+        if regressions:
+            print(f'{len(regressions)} timings regressed by more than {args.tolerance:.0%}:')
+            for regression in regressions:
+                print(f'  {regression}')
+            sys.exit(1)
+        return
+
+    # Keep the per-entry debug logging of the database out of the measurements
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+    if args.imports:
+        results: dict[str, Any] = {
+            'metadata': get_metadata(args.repeat),
+            'import_time': benchmark_import_time(args.repeat),
+            'results': [],
+        }
+    else:
+        results = run_benchmarks(args.scraper, args.rows, args.repeat, args.fixtures)
+
+    output: str = json.dumps(results, indent=2)
+    if args.output is not None:
+        args.output.write_text(output)
+    else:
+        print(output)
+
+    if args.imports:
+        entry_point_seconds: float = results['import_time']['prospero.__main__']['import_seconds']['min']
+        if entry_point_seconds > args.import_budget:
+            print(
+                f'Importing prospero.__main__ takes {entry_point_seconds:.3f} seconds, '
+                f'over the budget of {args.import_budget:.3f}',
+                file=sys.stderr
+            )
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
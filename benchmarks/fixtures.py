@@ -0,0 +1,120 @@
+"""
+Synthetic schedule pages in the markup of each venue, with any number of rows.
+
+The pages only contain what the scrapers read plus some navigation and footer noise, every row is
+a different performance (start time, title and location make a unique key).
+"""
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Generator
+
+CROATIAN_MONTHS: list[str] = [
+    'siječanj', 'veljača', 'ožujak', 'travanj', 'svibanj', 'lipanj', 'srpanj', 'kolovoz', 'rujan',
+    'listopad', 'studeni', 'prosinac'
+]
+
+
+def _performances(rows: int) -> Generator[tuple[int, datetime], None, None]:
+    # Three performances a day within the next 300 days, the year is assigned by the scrapers
+    start: datetime = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    for i in range(rows):
+        yield i, start + timedelta(days=i // 3 % 300, hours=17 + i % 3, minutes=30 * (i % 2))
+
+
+def _title(i: int) -> str:
+    # 40 shows repeated over the 900 slots of _performances, then the next 40 shows
+    return f'Predstava {i % 40 + 40 * (i // 900)}'
+
+
+def _page(body: str) -> str:
+    navigation: str = ''.join(f'<li><a href="/p{i}">Link {i}</a></li>' for i in range(50))
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><title>Raspored</title></head><body>'
+        f'<nav><ul>{navigation}</ul></nav>{body}<footer><p>Footer</p></footer></body></html>'
+    )
+
+
+def kerempuh(rows: int) -> str:
+    return _page(''.join(
+        '<div class="timetable-rows col span_12">'
+        f'<div class="event-date"><b>{d:%d.%m.}</b> {d:%a}</div>'
+        f'<div class="event-time"><span>{d:%H:%M}</span></div>'
+        f'<div class="event-title"><div><a href="/p/{i}">{_title(i)}</a>'
+        + (f'<div>Napomena {i}</div>' if i % 5 == 0 else '') +
+        '</div></div>'
+        f'<div class="event-location"><span>{90 + i % 30} min {"s pauzom" if i % 2 else "bez pauze"}</span></div>'
+        + (f'<div class="event-buy-ticket"><a href="https://tickets.example/{i}">Kupi</a></div>' if i % 3 else '') +
+        '</div>'
+        for i, d in _performances(rows)
+    ))
+
+
+def komedija(rows: int) -> str:
+    return _page('<table><thead><tr><th>Datum</th></tr></thead><tbody>' + ''.join(
+        f'<tr><td>{d:%d.%m.}, {d:%a}<br>{d:%H:%M} - {(d + timedelta(minutes=120)):%H:%M}</td>'
+        f'<td><a href="/p/{i}">{_title(i)}</a>'
+        + (f'<img src="/x.png" alt="Scena {i % 2}">' if i % 4 == 0 else '') +
+        f'</td><td>{"Premijera" if i % 7 == 0 else ""}</td>'
+        '<td>' + (f'<a href="https://tickets.example/{i}">Kupi</a>' if i % 3 else '') + '</td></tr>'
+        for i, d in _performances(rows)
+    ) + '</tbody></table>')
+
+
+def gavella(rows: int) -> str:
+    return _page(
+        '<table class="table"><tbody><tr><th>Datum</th><th>Vrijeme</th><th>Scena</th><th>Naslov</th></tr>' + ''.join(
+            f'<tr><td><div class="date">srijeda, {d:%d.%m.%Y.}</div></td>'
+            f'<td><div class="time">{d:%H:%M}</div></td>'
+            f'<td><div class="place">{"Velika scena" if i % 2 else "Mala Gavella"}</div></td>'
+            f'<td>{_title(i)}</td>'
+            '<td>' + (f'<div class="playcomment">Gostovanje {i}</div>' if i % 6 == 0 else '') +
+            (f'<a class="btn btn-small btn-primary" href="https://tickets.example/{i}">Kupi</a>' if i % 3 else '') +
+            '</td></tr>'
+            for i, d in _performances(rows)
+        ) + '</tbody></table>'
+    )
+
+
+def luda_kuca(rows: int) -> str:
+    return _page(''.join(
+        '<div class="kd-photobox"><img src="/i.png"><div class="phb-content">'
+        f'<h5>{d:%d.%m.} srijeda</h5><p>{_title(i)} {d:%H:%M}</p>'
+        + (f'<a href="https://tickets.example/{i}">Kupi</a>' if i % 3 else '') +
+        '</div></div>'
+        for i, d in _performances(rows)
+    ))
+
+
+def teatar_exit(rows: int) -> str:
+    return _page(''.join(
+        '<div class="event-post"><div class="date"><span>sri</span>'
+        f'<span>{d:%d}.</span><span>{CROATIAN_MONTHS[d.month - 1]}</span></div>'
+        f'<div class="event-data"><div class="schedule_main"><a href="/p/{i}">{_title(i)}</a>'
+        f'<div class="clock">{d:%H:%M}</div><div class="location">Teatar Exit</div>'
+        + (f'<div class="fee">{10 + i % 5} EUR</div>' if i % 2 else '') +
+        '</div><div class="bw-buttons">'
+        + (f'<a class="botton upcoming" href="https://tickets.example/{i}">Kupi</a>' if i % 3 else '') +
+        '</div></div></div>'
+        for i, d in _performances(rows)
+    ))
+
+
+# By scraper name, see prospero.schedule_scraper.SCHEDULE_SCRAPERS
+SYNTHETIC_FIXTURES: dict[str, Callable[[int], str]] = {
+    'kerempuh': kerempuh,
+    'komedija': komedija,
+    'gavella': gavella,
+    'luda_kuca': luda_kuca,
+    'teatar_exit': teatar_exit,
+}
+
+
+def load_recorded_fixture(fixture_dir: Path, scraper_name: str) -> bytes | None:
+    """
+    Returns:
+        Contents of <fixture_dir>/<scraper_name>.html, a schedule page saved from the venue's site, or None
+    """
+    path: Path = fixture_dir / f'{scraper_name}.html'
+    if not path.exists():
+        return None
+    return path.read_bytes()
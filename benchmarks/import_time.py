@@ -0,0 +1,71 @@
+import os
+import statistics
+import subprocess
+import sys
+from typing import Any
+
+# Modules whose cold import is timed: the entry point and what a one-shot check of a single scraper adds to it
+IMPORT_TARGETS: list[str] = [
+    'prospero.__main__',
+    'prospero.schedule_scraper.kerempuh',
+    'prospero.api',
+]
+# Seconds a cold import of the entry point may take before --import-budget fails the run
+IMPORT_TIME_BUDGET: float = 0.75
+# Modules with the highest self time reported per target
+SLOWEST_MODULE_COUNT: int = 10
+
+_TIMED_IMPORT: str = (
+    'import time\n'
+    'started_at = time.perf_counter()\n'
+    'import {module}\n'
+    'print(time.perf_counter() - started_at)\n'
+)
+
+
+def _run_python(code: str, *options: str) -> subprocess.CompletedProcess:
+    # Unset Telegram settings prove that importing does not need them
+    env: dict[str, str] = {
+        name: value for name, value in os.environ.items() if not name.startswith('TELEGRAM_')
+    }
+    return subprocess.run(
+        [sys.executable, *options, '-c', code],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=env
+    )
+
+
+def get_slowest_modules(module: str) -> list[dict[str, Any]]:
+    """
+    Returns:
+        Modules imported by importing module with the highest self time, as reported by -X importtime
+    """
+    stderr: str = _run_python(f'import {module}', '-X', 'importtime').stderr
+    modules: list[dict[str, Any]] = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix('import time:').split('|')
+        modules.append({'module': name.strip(), 'self_seconds': int(self_us) / 1e6})
+    modules.sort(key=lambda imported_module: imported_module['self_seconds'], reverse=True)
+    return modules[:SLOWEST_MODULE_COUNT]
+
+
+def benchmark_import_time(repeat: int) -> dict[str, Any]:
+    """
+    Time a cold import of every IMPORT_TARGETS module, each in a fresh interpreter.
+    """
+    results: dict[str, Any] = {}
+    for module in IMPORT_TARGETS:
+        timings: list[float] = [
+            float(_run_python(_TIMED_IMPORT.format(module=module)).stdout)
+            for _ in range(repeat)
+        ]
+        results[module] = {
+            'import_seconds': {'min': min(timings), 'median': statistics.median(timings)},
+            # A list, so --compare leaves it out
+            'slowest_modules': get_slowest_modules(module),
+        }
+    return results
@@ -0,0 +1,263 @@
+"""
+Stress test of replica coordination: several processes share one database and check synthetic schedules
+that gain rows every few seconds.
+
+Usage:
+    python -m benchmarks.replicas [--replicas 3] [--duration 30] [--crash-after 10] [--db-uri URI]
+
+Every replica runs the real check and dispatcher code with short leases and claims, checking whatever
+scrapers it leases as often as it can and sending through a stub Apprise backend that logs every
+notification. The first replica is killed after --crash-after seconds without releasing anything, so
+its scrapers and notifications are taken over once their leases and claims expire.
+
+Afterwards the remaining notifications are sent and the test exits with status 1 unless every change
+was queued once and every notification was sent once. A notification the killed replica may have sent
+right before it was killed is allowed to be sent again, and reported. The database is a SQLite file in
+a temporary directory unless --db-uri points elsewhere, e.g. at a local PostgreSQL.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any
+
+import httpx
+from apprise.apprise import Apprise
+from apprise.decorators import notify
+from loguru import logger
+
+from benchmarks.fixtures import SYNTHETIC_FIXTURES
+
+# Chats every notification is queued for
+CHAT_IDS: list[str] = ['1001', '1002']
+# Rows of the first version of every synthetic page, and rows every later version adds
+INITIAL_ROWS: int = 20
+ROWS_PER_VERSION: int = 2
+# Seconds between versions of the pages
+VERSION_SECONDS: float = 2.0
+# Seconds between the checks of a replica
+CHECK_SECONDS: float = 0.25
+# Short enough for the takeover of the killed replica's work to happen within a run
+LEASE_SECONDS: float = 3.0
+CLAIM_SECONDS: float = 4.0
+STUB_APPRISE_SCHEMA: str = 'replicas'
+
+# Where the stub backend logs the notifications of this process
+_send_log_path: Path | None = None
+
+
+@notify(on=STUB_APPRISE_SCHEMA)
+def _stub_apprise_backend(body: str, title: str, notify_type: str, *args, meta: dict[str, Any], **kwargs) -> bool:
+    with _send_log_path.open('a') as send_log:
+        send_log.write(json.dumps({'chat_id': meta['host'], 'body': body}) + '\n')
+    return True
+
+
+def _create_dispatcher(db: Any, replica_id: str, poll_interval: float | None = None) -> Any:
+    # prospero reads its settings when imported, it is only imported once main() has set up the environment
+    from prospero.dispatcher import NotificationDispatcher
+
+    class StubDispatcher(NotificationDispatcher):
+        @staticmethod
+        def _get_apprise(chat_id: str) -> Apprise:
+            return Apprise(servers=[f'{STUB_APPRISE_SCHEMA}://{chat_id}'])
+
+    return StubDispatcher(db, CHAT_IDS, replica_id, CLAIM_SECONDS, poll_interval)
+
+
+def _make_transport(started_at: float) -> httpx.MockTransport:
+    from prospero.schedule_scraper import load_schedule_scraper
+
+    fixtures_by_host: dict[str, Any] = {
+        httpx.URL(load_schedule_scraper(name)._get_schedule_request()['url']).host: fixture
+        for name, fixture
+        in SYNTHETIC_FIXTURES.items()
+    }
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        version: int = int((time.time() - started_at) / VERSION_SECONDS)
+        content: bytes = fixtures_by_host[request.url.host](INITIAL_ROWS + version * ROWS_PER_VERSION).encode()
+        return httpx.Response(200, content=content, headers={'Content-Type': 'text/html; charset=utf-8'})
+
+    return httpx.MockTransport(handle)
+
+
+async def _run_replica(replica_id: str, db_uri: str, data_dir: Path, started_at: float, duration: float) -> None:
+    from prospero.__main__ import acquire_scraper_leases, schedule_check
+    from prospero.circuit_breaker import CircuitBreaker
+    from prospero.coordination import LeaseLostError, LeaseManager
+    from prospero.db import KnownEntryIndex, ScheduleDatabase
+    from prospero.dispatcher import NotificationDispatcher
+    from prospero.http_client import AsyncHttpClient
+    from prospero.response_cache import ResponseCache
+    from prospero.schedule_scraper import load_schedule_scrapers
+
+    db: ScheduleDatabase = ScheduleDatabase(
+        db_uri, known_entry_index=KnownEntryIndex(), sqlite_performance_profile=True
+    )
+    lease_manager: LeaseManager = LeaseManager(db, replica_id, LEASE_SECONDS)
+    dispatcher: NotificationDispatcher = _create_dispatcher(db, replica_id, poll_interval=CHECK_SECONDS)
+    response_cache: ResponseCache = ResponseCache(data_dir / f'response_cache.{replica_id}.json')
+    circuit_breaker: CircuitBreaker = CircuitBreaker(db)
+    dispatcher_task: asyncio.Task = asyncio.create_task(dispatcher.run())
+
+    schedule_scrapers = load_schedule_scrapers(None)
+    summary: Counter = Counter()
+    async with AsyncHttpClient(transport=_make_transport(started_at)) as client:
+        while time.monotonic() < duration:
+            lease_manager.renew(len(schedule_scrapers))
+            leased_scrapers = acquire_scraper_leases(
+                lease_manager, schedule_scrapers, response_cache, circuit_breaker, lease_manager.share
+            )
+            if len(leased_scrapers) > 0:
+                try:
+                    await schedule_check(client, response_cache, db, leased_scrapers, lease_manager=lease_manager)
+                    summary['checks'] += 1
+                except LeaseLostError:
+                    summary['fenced_checks'] += 1
+                dispatcher.wake()
+            summary['max_leases'] = max(summary['max_leases'], len(lease_manager.held))
+            (data_dir / f'summary.{replica_id}.json').write_text(json.dumps(summary))
+            await asyncio.sleep(CHECK_SECONDS)
+
+    # Give the dispatcher a moment for what the last check queued
+    await asyncio.sleep(CHECK_SECONDS * 4)
+    dispatcher_task.cancel()
+    lease_manager.release_all()
+
+
+def run_replica(replica_id: str, db_uri: str, data_dir: Path, started_at: float, duration: float) -> None:
+    global _send_log_path
+    _send_log_path = data_dir / f'sends.{replica_id}.jsonl'
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING', format=f'{replica_id} | {{level}} | {{message}}')
+    # time.monotonic() is only comparable within a process, the deadline is passed as a duration
+    asyncio.run(_run_replica(replica_id, db_uri, data_dir, started_at, time.monotonic() + duration))
+
+
+def drain(db_uri: str, data_dir: Path) -> None:
+    """
+    Send what the replicas left in the outbox, once the claims of the killed replica expired.
+    """
+    global _send_log_path
+    from prospero.db import ScheduleDatabase
+
+    _send_log_path = data_dir / 'sends.drain.jsonl'
+    time.sleep(CLAIM_SECONDS)
+    asyncio.run(_create_dispatcher(ScheduleDatabase(db_uri), 'drain').send_due())
+
+
+def verify(db_uri: str, data_dir: Path, crashed_replica_id: str | None) -> list[str]:
+    """
+    Returns:
+        Descriptions of the violations found, empty if coordination held
+    """
+    from sqlalchemy import func, select
+
+    from prospero.db import OutboxNotification, ScheduleDatabase, ScheduleEntry
+
+    db: ScheduleDatabase = ScheduleDatabase(db_uri)
+    with db.Session() as session:
+        outbox: list[tuple[str, str, Any]] = [
+            tuple(row)
+            for row
+            in session.execute(select(
+                OutboxNotification.chat_id,
+                OutboxNotification.body,
+                OutboxNotification.sent_at
+            ))
+        ]
+        entry_count: int = session.scalar(select(func.count()).select_from(ScheduleEntry))
+
+    sends_by_replica: dict[str, Counter] = {}
+    for send_log_path in data_dir.glob('sends.*.jsonl'):
+        replica_id: str = send_log_path.name.split('.')[1]
+        sends_by_replica[replica_id] = Counter(
+            (send['chat_id'], send['body'])
+            for send
+            in map(json.loads, send_log_path.read_text().splitlines())
+        )
+    sends: Counter = sum(sends_by_replica.values(), Counter())
+
+    violations: list[str] = []
+    queued: Counter = Counter((chat_id, body) for chat_id, body, _ in outbox)
+    violations.extend(
+        f'Queued {count} times for {chat_id}: {body!r}' for (chat_id, body), count in queued.items() if count > 1
+    )
+    violations.extend(f'Never sent to {chat_id}: {body!r}' for chat_id, body, sent_at in outbox if sent_at is None)
+
+    resent: int = 0
+    for notification, count in sends.items():
+        if count == 1:
+            continue
+        sent_by_crashed_replica: bool = notification in sends_by_replica.get(crashed_replica_id, {})
+        if count == 2 and sent_by_crashed_replica:
+            resent += 1
+            continue
+        violations.append(f'Sent {count} times to {notification[0]}: {notification[1]!r}')
+
+    print(f'{entry_count} entries, {len(outbox)} notifications queued, {sum(sends.values())} sent')
+    for replica_id, replica_sends in sorted(sends_by_replica.items()):
+        summary_path: Path = data_dir / f'summary.{replica_id}.json'
+        summary: dict[str, int] = json.loads(summary_path.read_text()) if summary_path.exists() else {}
+        print(f'  {replica_id}: {sum(replica_sends.values())} sent, {summary}')
+    if resent > 0:
+        print(f'{resent} notifications sent by {crashed_replica_id} right before it was killed were sent again')
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--replicas', type=int, default=3)
+    parser.add_argument('--duration', type=float, default=30, help='Seconds the replicas run')
+    parser.add_argument('--crash-after', type=float, default=10, help='Seconds until the first replica is killed')
+    parser.add_argument('--no-crash', action='store_true', help='Keep every replica running')
+    parser.add_argument('--db-uri', help='Shared database, a new SQLite file by default')
+    args = parser.parse_args()
+
+    # Every replica sends as fast as it can, the rate limits would only slow the test down
+    os.environ['NOTIFICATION_RATE'] = '10000'
+    os.environ['NOTIFICATION_BURST'] = '10000'
+    os.environ['NOTIFICATION_DIGEST_ENABLED'] = 'false'
+    os.environ['TELEGRAM_CHAT_IDS'] = ','.join(CHAT_IDS)
+    os.environ['TELEGRAM_BOT_TOKEN'] = 'unused'
+
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        data_dir: Path = Path(temporary_dir)
+        db_uri: str = args.db_uri or f'sqlite:///{data_dir / "schedule.db"}'
+        started_at: float = time.time()
+
+        context = multiprocessing.get_context('spawn')
+        processes: list[multiprocessing.Process] = [
+            context.Process(target=run_replica, args=(f'replica{i}', db_uri, data_dir, started_at, args.duration))
+            for i in range(args.replicas)
+        ]
+        for process in processes:
+            process.start()
+
+        crashed_replica_id: str | None = None
+        if not args.no_crash:
+            processes[0].join(args.crash_after)
+            processes[0].kill()
+            crashed_replica_id = 'replica0'
+            print(f'Killed {crashed_replica_id} after {args.crash_after} seconds')
+        for process in processes:
+            process.join()
+
+        drain(db_uri, data_dir)
+        violations: list[str] = verify(db_uri, data_dir, crashed_replica_id)
+
+    for violation in violations:
+        print(violation)
+    print(f'{len(violations)} violations')
+    sys.exit(1 if len(violations) > 0 else 0)
+
+
+if __name__ == '__main__':
+    main()
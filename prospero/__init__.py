@@ -1,3 +1,11 @@
-from .__main__ import main
+from typing import Any
 
 __all__ = ['main']
+
+
+def __getattr__(name: str) -> Any:
+    # Importing a submodule (e.g. prospero.db) should not import the whole daemon
+    if name == 'main':
+        from prospero.__main__ import main
+        return main
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
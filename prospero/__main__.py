@@ -1,65 +1,394 @@
-import itertools
+import argparse
+import asyncio
+import os
+import sys
 import time
+from typing import TYPE_CHECKING
 
-import schedule
-from apprise.apprise import Apprise
 from loguru import logger
 
-from prospero.config import TELEGRAM_BOT_TOKEN, SCHEDULE_CHECK_INTERVAL, TELEGRAM_CHAT_IDS
-from prospero.db import ScheduleDatabase
-from prospero.schedule_scraper.base import BaseScheduleScraper
-from prospero.schedule_scraper.gavella import GavellaScheduleScraper
-from prospero.schedule_scraper.kerempuh import KerempuhScheduleScraper
-from prospero.schedule_scraper.komedija import KomedijaScheduleScraper
-from prospero.schedule_scraper.luda_kuca import LudaKucaScheduleScraper
-from prospero.schedule_scraper.teatar_exit import TeatarExitScheduleScraper
-
-ALL_SCHEDULE_SCRAPERS: list[type[BaseScheduleScraper]] = [
-    KerempuhScheduleScraper,
-    KomedijaScheduleScraper,
-    GavellaScheduleScraper,
-    LudaKucaScheduleScraper,
-    TeatarExitScheduleScraper
-    # Add new scrapers here
-]
-
-
-def schedule_check():
-    apprise: Apprise = Apprise(
-        servers=[
-            f'tgram://{TELEGRAM_BOT_TOKEN}/{telegram_chat_id}/?format=markdown'
-            for telegram_chat_id
-            in TELEGRAM_CHAT_IDS
-        ]
+from prospero.config import (
+    get_telegram_chat_ids, SCRAPER_WORKERS, SCRAPER_TIMEOUT, REPLICA_COORDINATION, REPLICA_ID,
+    REPLICA_POLL_INTERVAL
+)
+# The rest is imported where it is used, so that --help and argument errors load neither the scrapers nor
+# SQLAlchemy and prometheus_client
+from prospero.schedule_scraper import SCHEDULE_SCRAPERS, load_schedule_scrapers
+
+if TYPE_CHECKING:
+    from prospero.circuit_breaker import CircuitBreaker
+    from prospero.coordination import LeaseManager
+    from prospero.db import ScheduleDatabase, ScheduleEntryRecord
+    from prospero.feeds import FeedCache
+    from prospero.http_client import AsyncHttpClient
+    from prospero.response_cache import ResponseCache
+    from prospero.scheduler import CheckOutcome
+    from prospero.schedule_scraper.base import BaseScheduleScraper
+
+
+async def fetch_schedule_entries(
+        client: 'AsyncHttpClient',
+        response_cache: 'ResponseCache',
+        schedule_scrapers: list[type['BaseScheduleScraper']],
+        circuit_breaker: 'CircuitBreaker | None' = None
+) -> dict[type['BaseScheduleScraper'], list['ScheduleEntryRecord'] | None]:
+    """
+    Run the scrapers concurrently.
+
+    At most SCRAPER_WORKERS scrapers run at once, and a scraper that does not finish within
+    SCRAPER_TIMEOUT seconds is cancelled. Failures are recorded in circuit_breaker, a scraper that
+    keeps failing only logs its traceback the first time. Successes are left to the caller, a scraper
+    has only succeeded once its entries are stored.
+
+    Returns:
+        Entries of every scraper that succeeded, None for scrapers whose schedule has not changed since
+        it was last processed. Scrapers that failed or timed out are left out.
+    """
+    from prospero.schedule_scraper.base import ScheduleNotModified
+
+    workers: asyncio.Semaphore = asyncio.Semaphore(SCRAPER_WORKERS)
+    scraper_entries: dict[type[BaseScheduleScraper], list[ScheduleEntryRecord] | None] = {}
+
+    async def record_failure(schedule_scraper: type['BaseScheduleScraper'], error: str) -> int:
+        if circuit_breaker is None:
+            return 1
+        # Saving the circuit commits, keep it off the event loop the other scrapers run on
+        return await asyncio.to_thread(circuit_breaker.record_failure, schedule_scraper.__name__, error)
+
+    async def run_scraper(schedule_scraper: type['BaseScheduleScraper']) -> None:
+        async with workers:
+            try:
+                scraper_entries[schedule_scraper] = await asyncio.wait_for(
+                    schedule_scraper.get_active_schedule_entries_async(client, response_cache),
+                    timeout=SCRAPER_TIMEOUT
+                )
+            except ScheduleNotModified:
+                logger.debug(f'Schedule of {schedule_scraper.__name__} not modified, skipping')
+                scraper_entries[schedule_scraper] = None
+            except asyncio.TimeoutError:
+                await record_failure(schedule_scraper, f'timed out after {SCRAPER_TIMEOUT} seconds')
+                logger.error(f'{schedule_scraper.__name__} did not finish within {SCRAPER_TIMEOUT} seconds, skipping')
+            except Exception as e:
+                failure_count: int = await record_failure(schedule_scraper, repr(e))
+                if failure_count == 1:
+                    logger.exception(f'Exception occurred while running {schedule_scraper}', e)
+                else:
+                    logger.error(f'{schedule_scraper.__name__} failed again ({failure_count} times in a row): {e!r}')
+
+    await asyncio.gather(*(run_scraper(schedule_scraper) for schedule_scraper in schedule_scrapers))
+    return scraper_entries
+
+
+def acquire_scraper_leases(
+        lease_manager: 'LeaseManager',
+        schedule_scrapers: list[type['BaseScheduleScraper']],
+        response_cache: 'ResponseCache',
+        circuit_breaker: 'CircuitBreaker | None' = None,
+        limit: int | None = None
+) -> list[type['BaseScheduleScraper']]:
+    """
+    Take the leases on schedule_scrapers this replica does not hold yet, up to limit held leases. The
+    validators, circuit and known entries of a newly leased scraper are reloaded, another replica may have
+    checked it.
+
+    Returns:
+        The scrapers of schedule_scrapers this replica holds the lease on
+    """
+    from prospero.coordination import get_scraper_lease_name
+
+    scrapers_by_lease: dict[str, type[BaseScheduleScraper]] = {
+        get_scraper_lease_name(schedule_scraper.__name__): schedule_scraper
+        for schedule_scraper
+        in schedule_scrapers
+    }
+    for lease_name in lease_manager.acquire(scrapers_by_lease, limit):
+        response_cache.forget(scrapers_by_lease[lease_name].__name__)
+        if circuit_breaker is not None:
+            circuit_breaker.reload(scrapers_by_lease[lease_name].__name__)
+        if lease_manager.db.known_entry_index is not None:
+            lease_manager.db.known_entry_index.invalidate()
+    return [
+        schedule_scraper
+        for lease_name, schedule_scraper
+        in scrapers_by_lease.items()
+        if lease_name in lease_manager.held
+    ]
+
+
+async def schedule_check(
+        client: 'AsyncHttpClient',
+        response_cache: 'ResponseCache',
+        db: 'ScheduleDatabase',
+        schedule_scrapers: list[type['BaseScheduleScraper']],
+        circuit_breaker: 'CircuitBreaker | None' = None,
+        feed_cache: 'FeedCache | None' = None,
+        lease_manager: 'LeaseManager | None' = None
+) -> dict[type['BaseScheduleScraper'], 'CheckOutcome']:
+    """
+    Scrape, store the changes and queue their notifications in the outbox for the chats subscribed to
+    them, in one transaction. Sending is left to the NotificationDispatcher, the cached feeds of changed
+    locations are dropped. Scrapers whose entries were stored are recorded as successes in
+    circuit_breaker. With a lease_manager nothing is stored unless this replica still holds the
+    leases of the scrapers.
+
+    Returns:
+        Outcome of the check of every scraper
+
+    Raises:
+        LeaseLostError: If another replica took over one of the scrapers during the check
+        Exception: If storing the check failed, nothing of it was stored
+    """
+    from prospero.coordination import get_scraper_lease_name
+    from prospero.diff import ScheduleChanges, apply_scraped_entries
+    from prospero.metrics import CHECK_SECONDS, SCHEDULE_CHANGES, SCRAPER_CHECKS
+    from prospero.notifications import format_schedule_changes
+    from prospero.scheduler import CheckOutcome
+    from prospero.subscriptions import SubscriptionIndex
+
+    started_at: float = time.monotonic()
+    try:
+        with db:
+            scraper_entries: dict[type[BaseScheduleScraper], list[ScheduleEntryRecord] | None] = (
+                await fetch_schedule_entries(client, response_cache, schedule_scrapers, circuit_breaker)
+            )
+            check_outcomes: dict[type[BaseScheduleScraper], CheckOutcome] = {}
+            changes_by_scraper: dict[type[BaseScheduleScraper], ScheduleChanges] = {}
+            schedule_changes: ScheduleChanges = ScheduleChanges()
+            for schedule_scraper in schedule_scrapers:
+                if schedule_scraper not in scraper_entries:
+                    check_outcomes[schedule_scraper] = CheckOutcome.FAILED
+                    continue
+
+                entries: list[ScheduleEntryRecord] | None = scraper_entries[schedule_scraper]
+                if entries is None:
+                    check_outcomes[schedule_scraper] = CheckOutcome.UNCHANGED
+                    continue
+
+                scraper_changes: ScheduleChanges = apply_scraped_entries(db, schedule_scraper.__name__, entries)
+                check_outcomes[schedule_scraper] = (
+                    CheckOutcome.CHANGED if len(scraper_changes) > 0 else CheckOutcome.UNCHANGED
+                )
+                changes_by_scraper[schedule_scraper] = scraper_changes
+                schedule_changes.extend(scraper_changes)
+            logger.debug(
+                f'{len(schedule_changes.new)} new, {len(schedule_changes.changed)} changed and '
+                f'{len(schedule_changes.cancelled)} cancelled entries'
+            )
+
+            if len(schedule_changes) > 0:
+                subscription_index: SubscriptionIndex = SubscriptionIndex.load(db, get_telegram_chat_ids())
+                for chat_ids, chat_changes in subscription_index.route_changes(schedule_changes):
+                    db.enqueue_notifications(chat_ids, format_schedule_changes(chat_changes))
+
+            if lease_manager is not None:
+                lease_manager.fence(db.session, [
+                    get_scraper_lease_name(schedule_scraper.__name__)
+                    for schedule_scraper, entries
+                    in scraper_entries.items()
+                    if entries is not None
+                ])
+
+            # Read while the changed entries are still attached to the session
+            changed_locations: set[str] = (
+                set(entry.location for entry in schedule_changes.new) |
+                set(entry.location for entry, _ in schedule_changes.changed) |
+                set(entry.location for entry in schedule_changes.cancelled)
+            )
+    except BaseException:
+        response_cache.rollback()
+        raise
+
+    # Only remember the processed responses and close the circuits once their entries are stored
+    response_cache.commit()
+    if circuit_breaker is not None:
+        for schedule_scraper in scraper_entries:
+            await asyncio.to_thread(circuit_breaker.record_success, schedule_scraper.__name__)
+    if feed_cache is not None:
+        feed_cache.invalidate(changed_locations)
+    logger.debug(
+        f'Response cache: {response_cache.hits} hits '
+        f'({response_cache.not_modified_hits} not modified, {response_cache.content_hash_hits} same content), '
+        f'{response_cache.misses} misses'
     )
 
-    with ScheduleDatabase() as db:
-        for entry in sorted(
-                itertools.chain.from_iterable(
-                    schedule_scraper.try_get_active_schedule_entries()
-                    for schedule_scraper
-                    in ALL_SCHEDULE_SCRAPERS
-                ),
-                key=lambda e: e.start_datetime
-        ):
-            if not db.contains_entry(entry):
-                db.add_entry(entry)
-                logger.debug(f'Added new entry: {entry}')
-                logger.debug(f'Notifying users...')
-
-                apprise.notify(body=entry.to_markdown())
-                time.sleep(0.5)
-            else:
-                logger.debug(f'Entry already exists: {entry}')
+    for schedule_scraper, scraper_changes in changes_by_scraper.items():
+        SCHEDULE_CHANGES.labels(schedule_scraper.__name__, 'new').inc(len(scraper_changes.new))
+        SCHEDULE_CHANGES.labels(schedule_scraper.__name__, 'changed').inc(len(scraper_changes.changed))
+        SCHEDULE_CHANGES.labels(schedule_scraper.__name__, 'cancelled').inc(len(scraper_changes.cancelled))
+    for schedule_scraper, check_outcome in check_outcomes.items():
+        SCRAPER_CHECKS.labels(schedule_scraper.__name__, check_outcome.value).inc()
+    CHECK_SECONDS.observe(time.monotonic() - started_at)
+    return check_outcomes
+
+
+async def run(schedule_scrapers: list[type['BaseScheduleScraper']]):
+    # Only the resident daemon serves the API
+    from prospero.api import start_api_server
+    from prospero.circuit_breaker import CircuitBreaker
+    from prospero.coordination import LeaseLostError, LeaseManager
+    from prospero.db import KnownEntryIndex, ScheduleDatabase
+    from prospero.dispatcher import NotificationDispatcher
+    from prospero.feeds import FeedCache
+    from prospero.http_client import AsyncHttpClient
+    from prospero.metrics import start_metrics_server
+    from prospero.response_cache import ResponseCache
+    from prospero.scheduler import CheckOutcome, CheckScheduler
+
+    start_metrics_server()
+    response_cache: ResponseCache = ResponseCache()
+    db: ScheduleDatabase = ScheduleDatabase(known_entry_index=KnownEntryIndex())
+    # Replicas split the scrapers between them, and pick up the notifications queued by the others
+    lease_manager: LeaseManager | None = LeaseManager(db) if REPLICA_COORDINATION else None
+    dispatcher: NotificationDispatcher = NotificationDispatcher(
+        db,
+        get_telegram_chat_ids(),
+        poll_interval=REPLICA_POLL_INTERVAL if REPLICA_COORDINATION else None
+    )
+    # Keep a reference, the event loop only holds tasks weakly
+    dispatcher_task: asyncio.Task = asyncio.create_task(dispatcher.run())
+
+    check_scheduler: CheckScheduler = CheckScheduler(schedule_scrapers)
+    circuit_breaker: CircuitBreaker = CircuitBreaker(db)
+    feed_cache: FeedCache = FeedCache(db, max_age=REPLICA_POLL_INTERVAL if REPLICA_COORDINATION else None)
+    start_api_server(feed_cache)
+
+    try:
+        async with AsyncHttpClient() as client:
+            while True:
+                due_scrapers: list[type[BaseScheduleScraper]] = check_scheduler.get_due_scrapers()
+                if lease_manager is not None:
+                    lease_manager.renew(len(schedule_scrapers))
+                    leased_scrapers: list[type[BaseScheduleScraper]] = acquire_scraper_leases(
+                        lease_manager, due_scrapers, response_cache, circuit_breaker, lease_manager.share
+                    )
+                    for schedule_scraper in due_scrapers:
+                        if schedule_scraper not in leased_scrapers:
+                            # Checked by another replica, try again in case that one goes away
+                            check_scheduler.postpone(schedule_scraper, lease_manager.renew_interval)
+                    due_scrapers = leased_scrapers
+
+                allowed_scrapers: list[type[BaseScheduleScraper]] = []
+                for schedule_scraper in due_scrapers:
+                    if circuit_breaker.allows(schedule_scraper.__name__):
+                        allowed_scrapers.append(schedule_scraper)
+                    else:
+                        check_scheduler.postpone(
+                            schedule_scraper,
+                            circuit_breaker.get_seconds_until_probe(schedule_scraper.__name__)
+                        )
+
+                if len(allowed_scrapers) > 0:
+                    try:
+                        check_outcomes: dict[type[BaseScheduleScraper], CheckOutcome] = await schedule_check(
+                            client, response_cache, db, allowed_scrapers, circuit_breaker, feed_cache, lease_manager
+                        )
+                    except LeaseLostError as e:
+                        # Nothing was stored, the next iteration checks the scrapers that are still leased again
+                        logger.warning(f'Discarded the schedule check: {e}')
+                        check_outcomes = {}
+                    except Exception as e:
+                        logger.exception('Exception occurred while storing the schedule check', e)
+                        check_outcomes = {
+                            schedule_scraper: CheckOutcome.FAILED for schedule_scraper in allowed_scrapers
+                        }
+                    for schedule_scraper, check_outcome in check_outcomes.items():
+                        check_scheduler.record(schedule_scraper, check_outcome)
+                    dispatcher.wake()
+
+                sleep_seconds: float = check_scheduler.get_seconds_until_next_check()
+                if lease_manager is not None:
+                    sleep_seconds = min(sleep_seconds, lease_manager.renew_interval)
+                await asyncio.sleep(sleep_seconds)
+    finally:
+        if lease_manager is not None:
+            # Let the other replicas take over right away instead of once the leases expire
+            lease_manager.release_all()
+
+
+async def run_once(schedule_scrapers: list[type['BaseScheduleScraper']], send: bool = True) -> int:
+    """
+    Check every scraper whose circuit allows it once, then send the due notifications. With
+    REPLICA_COORDINATION, scrapers leased by a running replica are left to it.
+
+    Returns:
+        Exit status, 1 if a scraper failed and 0 otherwise
+    """
+    from prospero.circuit_breaker import CircuitBreaker
+    from prospero.coordination import LeaseLostError, LeaseManager
+    from prospero.db import ScheduleDatabase
+    from prospero.dispatcher import NotificationDispatcher
+    from prospero.http_client import AsyncHttpClient
+    from prospero.response_cache import ResponseCache
+    from prospero.scheduler import CheckOutcome
+
+    response_cache: ResponseCache = ResponseCache()
+    # Loading a KnownEntryIndex only pays off over many checks
+    db: ScheduleDatabase = ScheduleDatabase()
+    circuit_breaker: CircuitBreaker = CircuitBreaker(db)
+    # An identity of its own, so a run next to a replica on the same host never takes over that replica's leases
+    replica_id: str = f'{REPLICA_ID}-once-{os.getpid()}'
+    lease_manager: LeaseManager | None = LeaseManager(db, replica_id) if REPLICA_COORDINATION else None
+
+    if lease_manager is not None:
+        leased_scrapers: list[type[BaseScheduleScraper]] = acquire_scraper_leases(
+            lease_manager, schedule_scrapers, response_cache, circuit_breaker
+        )
+        for schedule_scraper in schedule_scrapers:
+            if schedule_scraper not in leased_scrapers:
+                logger.info(f'{schedule_scraper.__name__} is leased by another replica, skipping')
+        schedule_scrapers = leased_scrapers
+
+    due_scrapers: list[type[BaseScheduleScraper]] = []
+    for schedule_scraper in schedule_scrapers:
+        if circuit_breaker.allows(schedule_scraper.__name__):
+            due_scrapers.append(schedule_scraper)
+        else:
+            logger.info(f'Circuit of {schedule_scraper.__name__} is open, skipping')
+
+    try:
+        async with AsyncHttpClient() as client:
+            check_outcomes: dict[type[BaseScheduleScraper], CheckOutcome] = await schedule_check(
+                client, response_cache, db, due_scrapers, circuit_breaker, lease_manager=lease_manager
+            )
+    except LeaseLostError as e:
+        logger.error(f'Discarded the schedule check: {e}')
+        return 1
+    finally:
+        if lease_manager is not None:
+            lease_manager.release_all()
+    for schedule_scraper, check_outcome in check_outcomes.items():
+        logger.info(f'{schedule_scraper.__name__}: {check_outcome.value}')
+
+    if send:
+        await NotificationDispatcher(db, get_telegram_chat_ids(), replica_id).send_due()
+    return 1 if CheckOutcome.FAILED in check_outcomes.values() else 0
 
 
 def main():
-    schedule_check()
-    schedule.every(SCHEDULE_CHECK_INTERVAL).seconds.do(schedule_check)
+    parser = argparse.ArgumentParser(prog='prospero', description='Notify Telegram chats of new theatre performances')
+    parser.add_argument(
+        '--once',
+        action='store_true',
+        help='Run a single check and exit, with status 1 if a scraper failed'
+    )
+    parser.add_argument(
+        '--only',
+        type=lambda value: value.split(','),
+        default=None,
+        metavar='SCRAPER[,SCRAPER...]',
+        help=f'Only run these scrapers: {", ".join(SCHEDULE_SCRAPERS)}'
+    )
+    parser.add_argument('--no-send', action='store_true', help='With --once, leave the notifications in the outbox')
+    args = parser.parse_args()
+
+    unknown_scrapers: list[str] = [name for name in args.only or [] if name not in SCHEDULE_SCRAPERS]
+    if unknown_scrapers:
+        parser.error(f'Unknown scrapers: {", ".join(unknown_scrapers)}')
+    schedule_scrapers: list[type[BaseScheduleScraper]] = load_schedule_scrapers(args.only)
 
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    if args.once:
+        sys.exit(asyncio.run(run_once(schedule_scrapers, send=not args.no_send)))
+    asyncio.run(run(schedule_scrapers))
 
 
 if __name__ == '__main__':
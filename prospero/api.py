@@ -0,0 +1,164 @@
+import json
+import threading
+from datetime import date
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from loguru import logger
+
+from prospero.config import API_PORT, API_ADDRESS
+from prospero.feeds import FeedCache, FeedFilter, RenderedFeed
+from prospero.search import SEARCH_PAGE_SIZE, SearchPage, SearchQuery, search
+
+# Path of the feed in every format
+FEED_PATHS: dict[str, str] = {
+    '/feeds/schedule.ics': 'ics',
+    '/feeds/schedule.json': 'json',
+}
+SEARCH_PATH: str = '/search'
+
+
+class ApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address: tuple[str, int], feed_cache: FeedCache):
+        super().__init__(server_address, ApiRequestHandler)
+        self.feed_cache: FeedCache = feed_cache
+
+
+class ApiRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves the feeds of upcoming entries and searches the schedule history:
+
+        GET /feeds/schedule.ics?location=Gavella&from=2024-10-01&to=2024-10-31
+        GET /feeds/schedule.json?location=...
+        GET /search?q=hamlet&location=...&from=...&to=...&limit=20&cursor=...
+
+    Every query parameter is optional, from and to are inclusive ISO dates. A search page has the
+    cursor of the next one, see prospero.search.
+    """
+    server: ApiServer
+
+    def _send_error(self, status: HTTPStatus, message: str) -> None:
+        body: bytes = f'{message}\n'.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @staticmethod
+    def _get_param(query: dict[str, list[str]], name: str) -> str | None:
+        return query.get(name, [None])[-1] or None
+
+    @classmethod
+    def _get_date_param(cls, query: dict[str, list[str]], name: str) -> date | None:
+        value: str | None = cls._get_param(query, name)
+        return date.fromisoformat(value) if value else None
+
+    def _get_feed_filter(self, feed_format: str, query: dict[str, list[str]]) -> FeedFilter:
+        return FeedFilter(
+            format=feed_format,
+            location=self._get_param(query, 'location'),
+            start_date=self._get_date_param(query, 'from'),
+            end_date=self._get_date_param(query, 'to')
+        )
+
+    def _get_search_query(self, query: dict[str, list[str]]) -> SearchQuery:
+        return SearchQuery(
+            text=self._get_param(query, 'q'),
+            location=self._get_param(query, 'location'),
+            start_date=self._get_date_param(query, 'from'),
+            end_date=self._get_date_param(query, 'to'),
+            limit=int(self._get_param(query, 'limit') or SEARCH_PAGE_SIZE),
+            cursor=self._get_param(query, 'cursor')
+        )
+
+    def _send_feed(self, feed: RenderedFeed, include_body: bool) -> None:
+        if_none_match: str | None = self.headers.get('If-None-Match')
+        if if_none_match is not None and (
+                if_none_match.strip() == '*' or
+                feed.etag in (etag.strip().removeprefix('W/') for etag in if_none_match.split(','))
+        ):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header('ETag', feed.etag)
+            self.end_headers()
+            return
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', feed.content_type)
+        self.send_header('Content-Length', str(len(feed.body)))
+        self.send_header('ETag', feed.etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if include_body:
+            self.wfile.write(feed.body)
+
+    def _send_search(self, query: dict[str, list[str]], include_body: bool) -> None:
+        try:
+            search_query: SearchQuery = self._get_search_query(query)
+        except ValueError as e:
+            self._send_error(HTTPStatus.BAD_REQUEST, str(e))
+            return
+
+        try:
+            page: SearchPage = search(self.server.feed_cache.db, search_query)
+        except Exception as e:
+            logger.exception(f'Exception occurred while searching for {search_query}', e)
+            self._send_error(HTTPStatus.INTERNAL_SERVER_ERROR, 'Could not search the schedule')
+            return
+
+        body: bytes = json.dumps(page.to_json(), ensure_ascii=False).encode('utf-8')
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if include_body:
+            self.wfile.write(body)
+
+    def _handle(self, include_body: bool) -> None:
+        url = urlsplit(self.path)
+        if url.path == SEARCH_PATH:
+            self._send_search(parse_qs(url.query), include_body)
+            return
+
+        feed_format: str | None = FEED_PATHS.get(url.path)
+        if feed_format is None:
+            self._send_error(HTTPStatus.NOT_FOUND, f'No such path: {url.path}')
+            return
+
+        try:
+            feed_filter: FeedFilter = self._get_feed_filter(feed_format, parse_qs(url.query))
+        except ValueError as e:
+            self._send_error(HTTPStatus.BAD_REQUEST, str(e))
+            return
+
+        try:
+            feed: RenderedFeed = self.server.feed_cache.get(feed_filter)
+        except Exception as e:
+            logger.exception(f'Exception occurred while rendering the feed of {feed_filter}', e)
+            self._send_error(HTTPStatus.INTERNAL_SERVER_ERROR, 'Could not render the feed')
+            return
+        self._send_feed(feed, include_body)
+
+    def do_GET(self):
+        self._handle(include_body=True)
+
+    def do_HEAD(self):
+        self._handle(include_body=False)
+
+    def log_message(self, format, *args):
+        logger.debug(f'{self.address_string()} {format % args}')
+
+
+def start_api_server(feed_cache: FeedCache) -> ApiServer | None:
+    """
+    Serve the API on API_ADDRESS:API_PORT from a background thread, unless API_PORT is empty.
+    """
+    if API_PORT is None:
+        return None
+    api_server: ApiServer = ApiServer((API_ADDRESS, API_PORT), feed_cache)
+    threading.Thread(target=api_server.serve_forever, name='api-server', daemon=True).start()
+    logger.info(f'Serving feeds on http://{API_ADDRESS}:{API_PORT}/feeds/schedule.ics and search on {SEARCH_PATH}')
+    return api_server
@@ -0,0 +1,144 @@
+from datetime import datetime, timedelta
+from enum import Enum
+
+from loguru import logger
+from sqlalchemy import select
+
+from prospero.config import CIRCUIT_BREAKER_FAILURE_THRESHOLD, CIRCUIT_BREAKER_COOLDOWN
+from prospero.db import ScheduleDatabase, ScraperCircuit
+from prospero.metrics import CIRCUIT_OPEN
+
+
+class CircuitState(Enum):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+
+# Value of the prospero_circuit_open gauge in every state
+CIRCUIT_OPEN_VALUES: dict[str, float] = {
+    CircuitState.CLOSED.value: 0.0,
+    CircuitState.OPEN.value: 1.0,
+    CircuitState.HALF_OPEN.value: 0.5,
+}
+
+
+class CircuitBreaker:
+    """
+    Skips scrapers that keep failing, e.g. because their venue changed the page layout.
+
+    A scraper's circuit opens after failure_threshold consecutive failed checks, and the scraper is
+    not checked at all for cooldown seconds. After that the circuit is half open and the next check is
+    a probe: success closes the circuit, failure opens it for another cooldown.
+
+    The state of every circuit is kept in the scraper_circuits table so it survives restarts. Only
+    state changes are written, a healthy scraper costs nothing. Circuits are read once, a replica
+    that takes over a scraper from another one reloads its circuit first.
+    """
+
+    def __init__(
+            self,
+            db: ScheduleDatabase,
+            failure_threshold: int = CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+            cooldown: float = CIRCUIT_BREAKER_COOLDOWN
+    ):
+        self.db: ScheduleDatabase = db
+        self.failure_threshold: int = failure_threshold
+        self.cooldown: timedelta = timedelta(seconds=cooldown)
+
+        with self.db.Session() as session:
+            self.circuits: dict[str, ScraperCircuit] = {
+                circuit.scraper: circuit
+                for circuit
+                in session.scalars(select(ScraperCircuit))
+            }
+
+        for circuit in self.circuits.values():
+            CIRCUIT_OPEN.labels(circuit.scraper).set(CIRCUIT_OPEN_VALUES[circuit.state])
+            if circuit.state != CircuitState.CLOSED.value:
+                logger.warning(f'Circuit of {circuit.scraper} is {circuit.state}, last error: {circuit.last_error}')
+
+    def _get_circuit(self, scraper: str) -> ScraperCircuit:
+        circuit: ScraperCircuit | None = self.circuits.get(scraper)
+        if circuit is None:
+            circuit = ScraperCircuit(scraper=scraper, state=CircuitState.CLOSED.value, failure_count=0)
+            self.circuits[scraper] = circuit
+        return circuit
+
+    def _save(self, circuit: ScraperCircuit) -> None:
+        with self.db.Session() as session, session.begin():
+            session.merge(circuit)
+        CIRCUIT_OPEN.labels(circuit.scraper).set(CIRCUIT_OPEN_VALUES[circuit.state])
+
+    def _open(self, circuit: ScraperCircuit) -> None:
+        circuit.state = CircuitState.OPEN.value
+        circuit.opened_at = datetime.now()
+
+    def reload(self, scraper: str) -> None:
+        """
+        Read the circuit of scraper from the database again, e.g. after another replica checked it.
+        """
+        with self.db.Session() as session:
+            circuit: ScraperCircuit | None = session.get(ScraperCircuit, scraper)
+        if circuit is None:
+            self.circuits.pop(scraper, None)
+            CIRCUIT_OPEN.labels(scraper).set(CIRCUIT_OPEN_VALUES[CircuitState.CLOSED.value])
+            return
+        self.circuits[scraper] = circuit
+        CIRCUIT_OPEN.labels(scraper).set(CIRCUIT_OPEN_VALUES[circuit.state])
+
+    def get_seconds_until_probe(self, scraper: str) -> float:
+        circuit: ScraperCircuit = self._get_circuit(scraper)
+        if circuit.state != CircuitState.OPEN.value:
+            return 0.0
+        return max(0.0, (circuit.opened_at + self.cooldown - datetime.now()).total_seconds())
+
+    def allows(self, scraper: str) -> bool:
+        """
+        Check whether scraper may be checked now, moving an open circuit whose cooldown is over to half open.
+        """
+        circuit: ScraperCircuit = self._get_circuit(scraper)
+        if circuit.state != CircuitState.OPEN.value:
+            return True
+
+        if self.get_seconds_until_probe(scraper) > 0:
+            return False
+
+        circuit.state = CircuitState.HALF_OPEN.value
+        self._save(circuit)
+        logger.info(f'Circuit of {scraper} is half open, probing')
+        return True
+
+    def record_success(self, scraper: str) -> None:
+        circuit: ScraperCircuit = self._get_circuit(scraper)
+        if circuit.state == CircuitState.CLOSED.value and circuit.failure_count == 0:
+            return
+
+        if circuit.state != CircuitState.CLOSED.value:
+            logger.info(f'{scraper} recovered, closing its circuit')
+        circuit.state = CircuitState.CLOSED.value
+        circuit.failure_count = 0
+        circuit.opened_at = None
+        self._save(circuit)
+
+    def record_failure(self, scraper: str, error: str) -> int:
+        """
+        Returns:
+            Number of consecutive failures of scraper, including this one
+        """
+        circuit: ScraperCircuit = self._get_circuit(scraper)
+        circuit.failure_count += 1
+        circuit.last_error = error
+
+        if circuit.state == CircuitState.HALF_OPEN.value:
+            self._open(circuit)
+            logger.warning(f'Probe of {scraper} failed ({error}), opening its circuit for another {self.cooldown}')
+        elif circuit.state == CircuitState.CLOSED.value and circuit.failure_count >= self.failure_threshold:
+            self._open(circuit)
+            logger.error(
+                f'{scraper} failed {circuit.failure_count} times in a row ({error}), '
+                f'opening its circuit for {self.cooldown}'
+            )
+
+        self._save(circuit)
+        return circuit.failure_count
@@ -1,7 +1,113 @@
 import os
-from typing import List
+import socket
+from functools import cache
+from pathlib import Path
+from typing import Any, List
+
+
+# The Telegram settings are only read when notifications are queued or sent, so tools that don't
+# notify (and importing prospero) work without them
+@cache
+def get_telegram_bot_token() -> str:
+    return os.environ['TELEGRAM_BOT_TOKEN']
+
+
+@cache
+def get_telegram_chat_ids() -> List[str]:
+    telegram_chat_ids: List[str] = [chat_id for chat_id in os.environ['TELEGRAM_CHAT_IDS'].split(',') if chat_id]
+    assert len(telegram_chat_ids) > 0, 'TELEGRAM_CHAT_IDS must contain at least one chat ID'
+    return telegram_chat_ids
+
+
+def __getattr__(name: str) -> Any:
+    if name == 'TELEGRAM_BOT_TOKEN':
+        return get_telegram_bot_token()
+    if name == 'TELEGRAM_CHAT_IDS':
+        return get_telegram_chat_ids()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
 
-TELEGRAM_BOT_TOKEN: str = os.environ['TELEGRAM_BOT_TOKEN']
-TELEGRAM_CHAT_IDS: List[str] = os.environ['TELEGRAM_CHAT_IDS'].split(',')
-assert len(TELEGRAM_CHAT_IDS) > 0, 'TELEGRAM_CHAT_IDS must contain at least one chat ID'
 SCHEDULE_CHECK_INTERVAL: int = int(os.environ.get('SCHEDULE_CHECK_INTERVAL', 60 * 5))
+SCRAPER_WORKERS: int = int(os.environ.get('SCRAPER_WORKERS', 5))
+SCRAPER_TIMEOUT: float = float(os.environ.get('SCRAPER_TIMEOUT', 30))
+HTTP_MAX_CONNECTIONS: int = int(os.environ.get('HTTP_MAX_CONNECTIONS', 10))
+HTTP_MAX_CONNECTIONS_PER_HOST: int = int(os.environ.get('HTTP_MAX_CONNECTIONS_PER_HOST', 2))
+# Idle connections must outlive the check interval, otherwise every check pays for a new handshake
+HTTP_KEEPALIVE_EXPIRY: float = float(os.environ.get('HTTP_KEEPALIVE_EXPIRY', SCHEDULE_CHECK_INTERVAL + 60))
+# Directory holding the database and other state that has to survive restarts
+DATA_DIR: Path = Path(os.environ.get('DATA_DIR', '.'))
+# Replicas sharing one database split the scrapers between them and claim notifications before sending
+# them, see prospero.coordination. REPLICA_ID has to be unique among the replicas, and stable across
+# restarts so a restarted replica takes its leases straight back
+REPLICA_COORDINATION: bool = os.environ.get('REPLICA_COORDINATION', 'false').lower() in ('1', 'true', 'yes')
+REPLICA_ID: str = os.environ.get('REPLICA_ID') or socket.gethostname()
+# Every replica keeps a response cache of its own, their data directory may be shared
+RESPONSE_CACHE_PATH: Path = DATA_DIR / (
+    f'response_cache.{REPLICA_ID}.json' if REPLICA_COORDINATION else 'response_cache.json'
+)
+DB_URI: str = os.environ.get('DB_URI', f'sqlite:///{DATA_DIR / "schedule.db"}')
+# Opt-in SQLite tuning: WAL journal (readers don't block the writer), synchronous=NORMAL, mmap and page cache
+SQLITE_PERFORMANCE_PROFILE: bool = os.environ.get('SQLITE_PERFORMANCE_PROFILE', 'false').lower() in ('1', 'true', 'yes')
+SQLITE_MMAP_SIZE: int = int(os.environ.get('SQLITE_MMAP_SIZE', 64 * 1024 * 1024))
+# Negative values are KiB, positive values are pages
+SQLITE_CACHE_SIZE: int = int(os.environ.get('SQLITE_CACHE_SIZE', -16 * 1024))
+# BeautifulSoup tree builder used by scrapers that don't pick one themselves (lxml, html.parser or html5lib)
+HTML_PARSER: str = os.environ.get('HTML_PARSER', 'lxml')
+# Notification dispatcher, rates are per Telegram chat
+NOTIFICATION_RATE: float = float(os.environ.get('NOTIFICATION_RATE', 1.0))
+NOTIFICATION_BURST: int = int(os.environ.get('NOTIFICATION_BURST', 3))
+NOTIFICATION_MAX_ATTEMPTS: int = int(os.environ.get('NOTIFICATION_MAX_ATTEMPTS', 8))
+NOTIFICATION_RETRY_DELAY: float = float(os.environ.get('NOTIFICATION_RETRY_DELAY', 30))
+NOTIFICATION_MAX_RETRY_DELAY: float = float(os.environ.get('NOTIFICATION_MAX_RETRY_DELAY', 60 * 60))
+# Days sent notifications are kept in the outbox before they are deleted
+NOTIFICATION_RETENTION_DAYS: float = float(os.environ.get('NOTIFICATION_RETENTION_DAYS', 30))
+# Above this many new entries in one check, new entries are sent as digests grouped by venue and title
+NOTIFICATION_DIGEST_ENABLED: bool = os.environ.get('NOTIFICATION_DIGEST_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+NOTIFICATION_DIGEST_THRESHOLD: int = int(os.environ.get('NOTIFICATION_DIGEST_THRESHOLD', 10))
+# Adaptive check scheduling, every scraper starts at SCHEDULE_CHECK_INTERVAL and moves within its bounds
+SCHEDULE_CHECK_MIN_INTERVAL: float = float(os.environ.get('SCHEDULE_CHECK_MIN_INTERVAL', 60))
+SCHEDULE_CHECK_MAX_INTERVAL: float = float(os.environ.get('SCHEDULE_CHECK_MAX_INTERVAL', 60 * 60 * 2))
+# Per-scraper bounds as Scraper=min:max pairs, e.g. GavellaScheduleScraper=600:14400,KerempuhScheduleScraper=60:1800
+SCHEDULE_CHECK_INTERVAL_BOUNDS: dict[str, tuple[float, float]] = {
+    scraper.strip(): (float(bounds.split(':')[0]), float(bounds.split(':')[1]))
+    for scraper, bounds
+    in (item.split('=') for item in os.environ.get('SCHEDULE_CHECK_INTERVAL_BOUNDS', '').split(',') if item.strip())
+}
+# Interval multipliers after a check that found changes and after one that didn't
+SCHEDULE_CHECK_SPEEDUP: float = float(os.environ.get('SCHEDULE_CHECK_SPEEDUP', 0.5))
+SCHEDULE_CHECK_SLOWDOWN: float = float(os.environ.get('SCHEDULE_CHECK_SLOWDOWN', 1.5))
+# Random spread applied to every delay, as a fraction of it, so scrapers don't stay in lockstep
+SCHEDULE_CHECK_JITTER: float = float(os.environ.get('SCHEDULE_CHECK_JITTER', 0.1))
+# First retry delay after a failed check, doubled with every further failure up to the scraper's max interval
+SCHEDULE_CHECK_RETRY_DELAY: float = float(os.environ.get('SCHEDULE_CHECK_RETRY_DELAY', 60))
+# Consecutive failed checks after which a scraper is skipped, and for how long before it is probed again
+CIRCUIT_BREAKER_FAILURE_THRESHOLD: int = int(os.environ.get('CIRCUIT_BREAKER_FAILURE_THRESHOLD', 5))
+CIRCUIT_BREAKER_COOLDOWN: float = float(os.environ.get('CIRCUIT_BREAKER_COOLDOWN', 60 * 60 * 6))
+# Save every new schedule response as a gzipped JSON archive under RECORD_DIR/<scraper>/
+RECORD_DIR: Path | None = Path(os.environ['RECORD_DIR']) if os.environ.get('RECORD_DIR') else None
+# Answer schedule requests from the archives under REPLAY_DIR instead of the venues' sites, in the order
+# they were recorded, either right away (fast) or after the time the recorded request took (recorded)
+REPLAY_DIR: Path | None = Path(os.environ['REPLAY_DIR']) if os.environ.get('REPLAY_DIR') else None
+REPLAY_TIMING: str = os.environ.get('REPLAY_TIMING', 'fast')
+# Prometheus /metrics endpoint, an empty METRICS_PORT disables it
+METRICS_PORT: int | None = int(os.environ.get('METRICS_PORT', 9464)) if os.environ.get('METRICS_PORT', '9464') else None
+METRICS_ADDRESS: str = os.environ.get('METRICS_ADDRESS', '127.0.0.1')
+# Worker processes parsing schedule pages, 0 parses in a thread of the daemon process instead
+PARSE_PROCESSES: int = int(os.environ.get('PARSE_PROCESSES', 0))
+# Local HTTP API serving the calendar feeds and search, an empty API_PORT disables it
+API_PORT: int | None = int(os.environ.get('API_PORT', 8080)) if os.environ.get('API_PORT', '8080') else None
+API_ADDRESS: str = os.environ.get('API_ADDRESS', '127.0.0.1')
+# Time zone the venues' schedules are in, feed times are local to it
+FEED_TIMEZONE: str = os.environ.get('FEED_TIMEZONE', 'Europe/Zagreb')
+# Rendered feeds kept in memory, one per distinct filter
+FEED_CACHE_SIZE: int = int(os.environ.get('FEED_CACHE_SIZE', 64))
+# Parse schedule pages while they download instead of after, for scrapers that support it
+STREAM_PARSING: bool = os.environ.get('STREAM_PARSING', 'false').lower() in ('1', 'true', 'yes')
+# Seconds a replica's lease on a scraper lasts unless renewed, it is renewed every third of that. A replica
+# that stops takes this long to have its scrapers taken over
+LEASE_SECONDS: float = float(os.environ.get('LEASE_SECONDS', 120))
+# Seconds a replica has to send the notifications it claimed before another replica may claim them
+NOTIFICATION_CLAIM_SECONDS: float = float(os.environ.get('NOTIFICATION_CLAIM_SECONDS', 60 * 5))
+# With REPLICA_COORDINATION, how often a replica looks for what the others stored: notifications they queued
+# and changes to the cached feeds
+REPLICA_POLL_INTERVAL: float = float(os.environ.get('REPLICA_POLL_INTERVAL', 60))
@@ -0,0 +1,178 @@
+import math
+from datetime import datetime, timedelta
+from typing import Collection, Iterable
+
+from loguru import logger
+from sqlalchemy import delete, func, or_, select, update
+from sqlalchemy.orm import Session
+
+from prospero.config import REPLICA_ID, LEASE_SECONDS
+from prospero.db import Lease, ScheduleDatabase
+from prospero.metrics import LEASES_HELD, LEASES_LOST
+
+# Prefixes of the lease names, a replica's heartbeat and the units of work
+REPLICA_LEASE_PREFIX: str = 'replica:'
+SCRAPER_LEASE_PREFIX: str = 'scraper:'
+
+
+def get_scraper_lease_name(scraper: str) -> str:
+    return f'{SCRAPER_LEASE_PREFIX}{scraper}'
+
+
+class LeaseLostError(Exception):
+    """Raised when work is about to be stored under a lease another replica has taken over"""
+    pass
+
+
+class LeaseManager:
+    """
+    Time-limited leases of one replica on named units of work, kept in the leases table of the database
+    the replicas share, so every unit is worked on by one replica at a time.
+
+    A lease lasts lease_seconds unless its holder renews it, a replica that stops has its leases taken
+    over once they expire. Every replica also holds a heartbeat lease, the live heartbeats decide each
+    replica's fair share of the work: renew() gives up the leases above it when replicas join, and
+    acquire() takes no more than it. Work done under a lease is stored in the same transaction as a
+    fence() that fails if the lease was taken over, so a replica that stalled never overwrites the
+    work of the one that took over.
+
+    Leases compare the clocks of the replicas, which have to be in sync to well within lease_seconds.
+    """
+
+    def __init__(self, db: ScheduleDatabase, replica_id: str = REPLICA_ID, lease_seconds: float = LEASE_SECONDS):
+        self.db: ScheduleDatabase = db
+        self.replica_id: str = replica_id
+        self.lease_duration: timedelta = timedelta(seconds=lease_seconds)
+        # Renewing three times per lease leaves room for a renewal or two to be late
+        self.renew_interval: float = lease_seconds / 3
+        self.heartbeat_name: str = f'{REPLICA_LEASE_PREFIX}{replica_id}'
+
+        self.held: set[str] = set()
+        # Most leases this replica takes, None until the first renew()
+        self.share: int | None = None
+
+    def _upsert(self, session: Session, name: str, now: datetime) -> bool:
+        """
+        Take or extend the lease on name, unless another replica holds it and it has not expired.
+
+        Returns:
+            Whether this replica holds the lease now
+        """
+        statement = self.db.insert(Lease).values(
+            name=name,
+            holder=self.replica_id,
+            expires_at=now + self.lease_duration
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=['name'],
+            set_={'holder': statement.excluded.holder, 'expires_at': statement.excluded.expires_at},
+            where=or_(Lease.holder == self.replica_id, Lease.expires_at < now)
+        ).returning(Lease.name)
+        return session.execute(statement).first() is not None
+
+    def _extend(self, session: Session, names: Collection[str], now: datetime) -> set[str]:
+        """
+        Returns:
+            Names of the leases that were extended, those of names this replica still holds
+        """
+        if len(names) == 0:
+            return set()
+        return set(session.scalars(
+            update(Lease).where(
+                Lease.name.in_(names),
+                Lease.holder == self.replica_id
+            ).values(
+                expires_at=now + self.lease_duration
+            ).returning(Lease.name).execution_options(synchronize_session=False)
+        ))
+
+    def get_replica_count(self, session: Session, now: datetime) -> int:
+        return session.scalar(
+            select(func.count()).select_from(Lease).where(
+                Lease.name.startswith(REPLICA_LEASE_PREFIX),
+                Lease.expires_at >= now
+            )
+        )
+
+    def renew(self, work_count: int) -> None:
+        """
+        Renew the heartbeat and the held leases, and give up the leases above this replica's fair share
+        of work_count units of work. Leases that were taken over in the meantime are dropped.
+        """
+        now: datetime = datetime.now()
+        with self.db.Session() as session, session.begin():
+            self._upsert(session, self.heartbeat_name, now)
+            held: set[str] = self._extend(session, self.held, now)
+            replica_count: int = max(1, self.get_replica_count(session, now))
+            # Rows of replicas that are gone, any lease expired this long ago is free anyway
+            session.execute(delete(Lease).where(Lease.expires_at < now - self.lease_duration))
+
+        for name in sorted(self.held - held):
+            logger.warning(f'Lease on {name} was taken over by another replica')
+            LEASES_LOST.inc()
+        self.held = held
+        self.share = math.ceil(work_count / replica_count)
+
+        excess: list[str] = sorted(self.held)[self.share:]
+        if len(excess) > 0:
+            logger.info(
+                f'{replica_count} replicas share {work_count} leases, releasing {", ".join(excess)} to the others'
+            )
+            self.release(excess)
+        LEASES_HELD.set(len(self.held))
+
+    def acquire(self, names: Iterable[str], limit: int | None = None) -> list[str]:
+        """
+        Take the leases on names that are free or expired, until this replica holds limit leases.
+
+        Returns:
+            Names of the leases this replica did not hold before, another replica may have worked
+            under them in the meantime
+        """
+        acquired: list[str] = []
+        now: datetime = datetime.now()
+        with self.db.Session() as session, session.begin():
+            for name in names:
+                if name in self.held:
+                    continue
+                if limit is not None and len(self.held) + len(acquired) >= limit:
+                    break
+                if self._upsert(session, name, now):
+                    acquired.append(name)
+
+        if len(acquired) > 0:
+            logger.info(f'Acquired leases on {", ".join(acquired)}')
+        self.held.update(acquired)
+        LEASES_HELD.set(len(self.held))
+        return acquired
+
+    def release(self, names: Collection[str]) -> None:
+        if len(names) == 0:
+            return
+        with self.db.Session() as session, session.begin():
+            session.execute(delete(Lease).where(Lease.name.in_(names), Lease.holder == self.replica_id))
+        self.held.difference_update(names)
+        LEASES_HELD.set(len(self.held))
+
+    def release_all(self) -> None:
+        """
+        Release the held leases and the heartbeat, so the other replicas take over without waiting for them to
+        expire.
+        """
+        self.release([*self.held, self.heartbeat_name])
+
+    def fence(self, session: Session, names: Collection[str]) -> None:
+        """
+        Check, in the transaction storing the work done under the leases on names, that this replica still
+        holds them, and extend them. A lease is taken over by updating its row, so once this returned no
+        other replica can take it before the transaction ends.
+
+        Raises:
+            LeaseLostError: If another replica took over one of the leases, the transaction has to be rolled back
+        """
+        names = set(names)
+        lost: set[str] = names - self._extend(session, names, datetime.now())
+        if len(lost) > 0:
+            self.held.difference_update(lost)
+            LEASES_LOST.inc(len(lost))
+            raise LeaseLostError(f'Leases on {", ".join(sorted(lost))} were taken over by another replica')
@@ -1,18 +1,88 @@
+import hashlib
+import random
+import time
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from pathlib import Path
+from typing import Any, Iterable
 
 from loguru import logger
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, PrimaryKeyConstraint
+from sqlalchemy import (
+    create_engine, delete, event, false, inspect, select, text, true, tuple_,
+    Column, Index, Integer, MetaData, String, DateTime, Boolean, PrimaryKeyConstraint, Table, UniqueConstraint
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import declarative_base
-from sqlalchemy.orm import sessionmaker
-import schedule
+from sqlalchemy.orm import sessionmaker, Session
+
+from prospero.config import DB_URI, SQLITE_PERFORMANCE_PROFILE, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE
+from prospero.metrics import DB_OPERATION_SECONDS, DB_TRANSACTIONS, NOTIFICATIONS_QUEUED
 
 Base = declarative_base()
 
+# (start_datetime, title, location), the unique key of a schedule entry
+ScheduleEntryKey = tuple[datetime, str, str]
+
+# Keys per lookup query, SQLite allows at most 32766 bound parameters per statement
+KEY_LOOKUP_BATCH_SIZE: int = 1000
+# Rows per multi-row INSERT, each row binds one parameter per column
+INSERT_BATCH_SIZE: int = 1000
+
+# Times creating the schema is tried, replicas starting together race to create the same tables
+SCHEMA_CREATE_ATTEMPTS: int = 5
+
+# SQLite FTS5 index over the text of schedule_entries, the rows are read from schedule_entries by id
+SEARCH_INDEX_TABLE: str = 'schedule_entries_fts'
+# Creates the search index and the triggers that keep it in sync with schedule_entries. Diacritics are
+# folded so "kuca" finds "Kuća", prefix indexes keep prefix queries of 2 and 3 letters fast
+SEARCH_INDEX_DDL: tuple[str, ...] = (
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_INDEX_TABLE} USING fts5(
+        title, note, location,
+        content='schedule_entries', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_INDEX_TABLE}_insert AFTER INSERT ON schedule_entries BEGIN
+        INSERT INTO {SEARCH_INDEX_TABLE}(rowid, title, note, location)
+        VALUES (new.id, new.title, new.note, new.location);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_INDEX_TABLE}_delete AFTER DELETE ON schedule_entries BEGIN
+        INSERT INTO {SEARCH_INDEX_TABLE}({SEARCH_INDEX_TABLE}, rowid, title, note, location)
+        VALUES ('delete', old.id, old.title, old.note, old.location);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {SEARCH_INDEX_TABLE}_update
+    AFTER UPDATE OF title, note, location ON schedule_entries BEGIN
+        INSERT INTO {SEARCH_INDEX_TABLE}({SEARCH_INDEX_TABLE}, rowid, title, note, location)
+        VALUES ('delete', old.id, old.title, old.note, old.location);
+        INSERT INTO {SEARCH_INDEX_TABLE}(rowid, title, note, location)
+        VALUES (new.id, new.title, new.note, new.location);
+    END
+    """,
+)
+# Fills the search index from schedule_entries
+SEARCH_INDEX_REBUILD: str = f"INSERT INTO {SEARCH_INDEX_TABLE}({SEARCH_INDEX_TABLE}) VALUES ('rebuild')"
+# Drops the search index and its triggers
+SEARCH_INDEX_DROP: tuple[str, ...] = (
+    *(f'DROP TRIGGER IF EXISTS {SEARCH_INDEX_TABLE}_{trigger}' for trigger in ('insert', 'delete', 'update')),
+    f'DROP TABLE IF EXISTS {SEARCH_INDEX_TABLE}',
+)
+
+# Where schedule_entries is moved while ids are added to it, see ScheduleDatabase._add_schedule_entry_ids
+UNKEYED_SCHEDULE_ENTRIES_TABLE: str = 'schedule_entries_without_ids'
+
 
 class ScheduleEntry(Base):
     __tablename__ = 'schedule_entries'
 
+    # Stable row id the search index refers to, unlike an implicit rowid it is never renumbered by VACUUM
+    id = Column(Integer, primary_key=True, autoincrement=True)
     start_datetime = Column(DateTime, nullable=False)
     title = Column(String, nullable=False)
     note = Column(String, nullable=True, default=None)
@@ -20,11 +90,17 @@ class ScheduleEntry(Base):
     duration = Column(Integer, nullable=True, default=None)
     includes_break = Column(Boolean, default=False)
     buy_tickets_url = Column(String, nullable=True, default=None)
+    cancelled = Column(Boolean, nullable=False, default=False, server_default=false())
 
     __table_args__ = (
-        PrimaryKeyConstraint('start_datetime', 'title', 'location', name='schedule_entry_pk'),
+        UniqueConstraint('start_datetime', 'title', 'location', name='schedule_entry_key'),
+        # The unique key already serves start_datetime ranges, this one serves a venue's entries in order
+        Index('schedule_entries_location_index', 'location', 'start_datetime'),
     )
 
+    # Fields that can change while the entry keeps its key
+    CONTENT_FIELDS: tuple[str, ...] = ('note', 'duration', 'includes_break', 'buy_tickets_url')
+
     def __repr__(self):
         return (f"ScheduleEntry("
                 f"start_datetime={self.start_datetime}, "
@@ -33,9 +109,27 @@ class ScheduleEntry(Base):
                 f"location={self.location}, "
                 f"duration={self.duration}, "
                 f"includes_break={self.includes_break}, "
-                f"buy_tickets_url={self.buy_tickets_url}"
+                f"buy_tickets_url={self.buy_tickets_url}, "
+                f"cancelled={self.cancelled}"
                 f")")
 
+    @property
+    def key(self) -> ScheduleEntryKey:
+        return self.start_datetime, self.title, self.location
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Short hash of the content fields, equal for two versions of an entry that don't differ.
+        """
+        return _get_fingerprint(self.to_values())
+
+    def to_values(self) -> dict[str, Any]:
+        """
+        Column values of this entry for a core INSERT, with column defaults applied to unset values.
+        """
+        return _get_column_values(self)
+
     def to_markdown(self):
         # Format the date and time
         date_str = self.start_datetime.strftime("%d. %B %Y (%A)")
@@ -68,44 +162,572 @@ class ScheduleEntry(Base):
 
         return md.strip()
 
+
+def _get_column_values(entry: Any) -> dict[str, Any]:
+    values: dict[str, Any] = {}
+    for column in ScheduleEntry.__table__.columns:
+        # The id is assigned by the database
+        if column.primary_key:
+            continue
+        value: Any = getattr(entry, column.key, None)
+        if value is None and column.default is not None and column.default.is_scalar:
+            value = column.default.arg
+        values[column.key] = value
+    return values
+
+
+def _get_fingerprint(values: dict[str, Any]) -> str:
+    return hashlib.blake2b(
+        repr(tuple(values[field] for field in ScheduleEntry.CONTENT_FIELDS)).encode(),
+        digest_size=8
+    ).hexdigest()
+
+
+@dataclass(frozen=True, slots=True, kw_only=True)
+class ScheduleEntryRecord:
+    """
+    Immutable, hashable schedule entry as yielded by the scrapers, with its key and fingerprint computed once.
+
+    Much cheaper to create, compare and send between processes than a ScheduleEntry, it is only
+    turned into one (to_entry) when an ORM object is really needed.
+    """
+    start_datetime: datetime
+    title: str
+    note: str | None = None
+    location: str
+    duration: int | None = None
+    includes_break: bool | None = None
+    buy_tickets_url: str | None = None
+    key: ScheduleEntryKey = field(init=False, repr=False, compare=False)
+    fingerprint: str = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, 'key', (self.start_datetime, self.title, self.location))
+        object.__setattr__(self, 'fingerprint', _get_fingerprint(self.to_values()))
+
+    @classmethod
+    def from_entry(cls, entry: ScheduleEntry) -> 'ScheduleEntryRecord':
+        return cls(
+            start_datetime=entry.start_datetime,
+            title=entry.title,
+            note=entry.note,
+            location=entry.location,
+            duration=entry.duration,
+            includes_break=entry.includes_break,
+            buy_tickets_url=entry.buy_tickets_url
+        )
+
+    def to_values(self) -> dict[str, Any]:
+        return _get_column_values(self)
+
+    def to_entry(self) -> ScheduleEntry:
+        return ScheduleEntry(
+            start_datetime=self.start_datetime,
+            title=self.title,
+            note=self.note,
+            location=self.location,
+            duration=self.duration,
+            includes_break=self.includes_break,
+            buy_tickets_url=self.buy_tickets_url
+        )
+
+    # Only reads the scraped fields, so the ORM formatting works as is
+    to_markdown = ScheduleEntry.to_markdown
+
+
+class ScraperSnapshotEntry(Base):
+    """
+    Key and content fingerprint of an entry as last seen by a scraper, used to diff its next scrape.
+    """
+    __tablename__ = 'scraper_snapshot_entries'
+
+    scraper = Column(String, nullable=False)
+    start_datetime = Column(DateTime, nullable=False)
+    title = Column(String, nullable=False)
+    location = Column(String, nullable=False)
+    fingerprint = Column(String, nullable=False)
+
+    __table_args__ = (
+        PrimaryKeyConstraint('scraper', 'start_datetime', 'title', 'location', name='scraper_snapshot_entry_pk'),
+    )
+
+
+class OutboxNotification(Base):
+    """
+    Notification waiting to be sent (or already sent) to a chat by the notification dispatcher.
+
+    A notification is due while sent_at is unset and next_attempt_at has passed, a notification that
+    ran out of attempts keeps its last error and has no next attempt. A due notification is only sent
+    by the replica that claimed it, see NotificationDispatcher._claim_due_notifications.
+    """
+    __tablename__ = 'notification_outbox'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    chat_id = Column(String, nullable=False)
+    body = Column(String, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=True)
+    sent_at = Column(DateTime, nullable=True, default=None)
+    last_error = Column(String, nullable=True, default=None)
+
+    # Replica that claimed the notification for sending, and until when no other replica may claim it
+    claimed_by = Column(String, nullable=True, default=None)
+    claimed_until = Column(DateTime, nullable=True, default=None)
+
+    __table_args__ = (
+        Index('notification_outbox_due_index', 'chat_id', 'sent_at', 'next_attempt_at'),
+    )
+
+
+class Lease(Base):
+    """
+    Time-limited hold of a replica on a named unit of work, see prospero.coordination.
+    """
+    __tablename__ = 'leases'
+
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<Lease(name={self.name}, holder={self.holder}, expires_at={self.expires_at})>'
+
+
+class TableVersion(Base):
+    """
+    Counter of the transactions that added rows to a table, so a process caching the table can tell
+    whether anyone else added to it, see KnownEntryIndex.
+    """
+    __tablename__ = 'table_versions'
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class ScraperCircuit(Base):
+    """
+    Circuit breaker state of a scraper, see prospero.circuit_breaker.
+    """
+    __tablename__ = 'scraper_circuits'
+
+    scraper = Column(String, primary_key=True)
+    state = Column(String, nullable=False, default='closed')
+    failure_count = Column(Integer, nullable=False, default=0)
+    last_error = Column(String, nullable=True, default=None)
+    opened_at = Column(DateTime, nullable=True, default=None)
+
+    def __repr__(self):
+        return (
+            f'<ScraperCircuit(scraper={self.scraper}, state={self.state}, failure_count={self.failure_count}, '
+            f'opened_at={self.opened_at})>'
+        )
+
+
+class SubscriptionRule(Base):
+    """
+    Filter rule of a chat's subscription, see prospero.subscriptions.
+
+    Every set condition must hold for an entry to match the rule, a chat receives the entries matching
+    any of its rules. A chat without rules receives every entry.
+    """
+    __tablename__ = 'subscription_rules'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    chat_id = Column(String, nullable=False)
+    # Exact location
+    location = Column(String, nullable=True, default=None)
+    # Words that must all appear in the title, case-insensitive
+    title_keyword = Column(String, nullable=True, default=None)
+    # Regular expression searched in the title, case-insensitive
+    title_pattern = Column(String, nullable=True, default=None)
+    # Comma separated weekdays the entry starts on, 0 is Monday
+    weekdays = Column(String, nullable=True, default=None)
+    # HH:MM window the entry starts in, wraps past midnight if earliest_start is later than latest_start
+    earliest_start = Column(String, nullable=True, default=None)
+    latest_start = Column(String, nullable=True, default=None)
+    # Duration bounds in minutes, entries of unknown duration only match rules without them
+    min_duration = Column(Integer, nullable=True, default=None)
+    max_duration = Column(Integer, nullable=True, default=None)
+    created_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('subscription_rules_chat_index', 'chat_id'),
+    )
+
+    def __repr__(self):
+        conditions: str = ', '.join(
+            f'{name}={getattr(self, name)!r}'
+            for name
+            in (
+                'location', 'title_keyword', 'title_pattern', 'weekdays',
+                'earliest_start', 'latest_start', 'min_duration', 'max_duration'
+            )
+            if getattr(self, name) is not None
+        )
+        return f'<SubscriptionRule(id={self.id}, chat_id={self.chat_id}, {conditions or "everything"})>'
+
+
+class KnownEntryIndex:
+    """
+    In-memory set of the keys of recent and upcoming entries stored in the database, so a
+    check whose entries are all known does not have to read the database at all.
+
+    Keys of entries that started more than `retention` ago are pruned every `prune_interval`, scraped
+    schedules only list upcoming performances so they are never looked up again. Every transaction
+    that adds entries bumps the version of schedule_entries in table_versions and the index follows its
+    own bumps in-process. The version is only read again once the index is invalidated, after a failed
+    write or when a lease change hands this process scrapers another replica checked, and the index
+    reloads itself if the version moved past what it has seen. An insert of its own whose bump skips a
+    version reloads it as well. A key missing from the index is never trusted to be new on its own, it
+    is confirmed by the conflict-ignoring insert.
+
+    The snapshots of the scrapers are kept next to the keys once read, and are followed in-process
+    through the updates of this process. They are dropped whenever the index is invalidated or reloaded.
+    """
+
+    def __init__(
+            self,
+            retention: timedelta = timedelta(days=1),
+            prune_interval: timedelta = timedelta(hours=1)
+    ):
+        self.retention: timedelta = retention
+        self.prune_interval: timedelta = prune_interval
+
+        self.keys: set[ScheduleEntryKey] = set()
+        self.staged_keys: set[ScheduleEntryKey] = set()
+        self.loaded: bool = False
+        self.pruned_at: datetime = datetime.min
+        # Version of schedule_entries the keys are current with, None if they have to be reloaded
+        self.entries_version: int | None = None
+        self.staged_version: int | None = None
+        # Whether entries_version is known to be current without reading table_versions
+        self.verified: bool = False
+        # Fingerprints by key of the snapshots of scrapers, as stored and as updated by the current transaction
+        self.snapshots: dict[str, dict[ScheduleEntryKey, str]] = {}
+        self.staged_snapshots: dict[str, dict[ScheduleEntryKey, str]] = {}
+
+    def __contains__(self, key: ScheduleEntryKey) -> bool:
+        return key in self.keys or key in self.staged_keys
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def is_stale(self, entries_version: int) -> bool:
+        return not self.loaded or self.entries_version != entries_version
+
+    def load(self, session: Session, entries_version: int) -> None:
+        cutoff: datetime = datetime.now() - self.retention
+        self.keys = set(
+            tuple(row)
+            for row
+            in session.execute(
+                select(
+                    ScheduleEntry.start_datetime,
+                    ScheduleEntry.title,
+                    ScheduleEntry.location
+                ).where(ScheduleEntry.start_datetime >= cutoff)
+            )
+        )
+        self.staged_keys.clear()
+        self.staged_version = None
+        self.snapshots.clear()
+        self.loaded = True
+        self.verified = True
+        self.pruned_at = datetime.now()
+        self.entries_version = entries_version
+        logger.debug(f'Loaded {len(self.keys)} known entry keys')
+
+    def prune(self) -> None:
+        now: datetime = datetime.now()
+        if now - self.pruned_at < self.prune_interval:
+            return
+
+        cutoff: datetime = now - self.retention
+        self.keys = set(key for key in self.keys if key[0] >= cutoff)
+        self.pruned_at = now
+
+    def stage(self, keys: Iterable[ScheduleEntryKey], entries_version: int | None = None) -> None:
+        """
+        Add keys inserted by the current transaction, they become permanent on commit(). entries_version
+        is the version the transaction bumped schedule_entries to, None if it inserted nothing.
+        """
+        self.staged_keys.update(keys)
+        if entries_version is None:
+            return
+
+        previous_version: int | None = self.entries_version
+        if self.staged_version is not None:
+            previous_version = self.staged_version
+        if previous_version is None or entries_version != previous_version + 1:
+            # Someone else added entries since the index was loaded, their keys are only found by a reload
+            self.entries_version = None
+            self.verified = False
+        self.staged_version = entries_version
+
+    def get_snapshot(self, scraper: str) -> dict[ScheduleEntryKey, str] | None:
+        """
+        Returns:
+            The snapshot of scraper, None if it has to be read from the database
+        """
+        if scraper in self.staged_snapshots:
+            return self.staged_snapshots[scraper]
+        return self.snapshots.get(scraper)
+
+    def stage_snapshot(self, scraper: str, snapshot: dict[ScheduleEntryKey, str]) -> None:
+        """Set the snapshot of scraper as written by the current transaction, it becomes permanent on commit()."""
+        self.staged_snapshots[scraper] = snapshot
+
+    def commit(self) -> None:
+        self.keys.update(self.staged_keys)
+        self.staged_keys.clear()
+        self.snapshots.update(self.staged_snapshots)
+        self.staged_snapshots.clear()
+        # Our own insert must not look like one of another process
+        if self.staged_version is not None and self.entries_version is not None:
+            self.entries_version = self.staged_version
+        self.staged_version = None
+
+    def rollback(self) -> None:
+        self.staged_keys.clear()
+        self.staged_version = None
+        self.staged_snapshots.clear()
+        # The write may have failed on an insert of another process
+        self.invalidate()
+
+    def invalidate(self) -> None:
+        """Read the version of schedule_entries again on the next lookup, reloading the keys if it moved."""
+        self.verified = False
+        self.snapshots.clear()
+
+
 class SessionNotActiveError(Exception):
     """Raised when attempting to use database methods outside of context manager"""
     pass
 
 
+def _apply_sqlite_performance_profile(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA mmap_size={SQLITE_MMAP_SIZE}')
+    cursor.execute(f'PRAGMA cache_size={SQLITE_CACHE_SIZE}')
+    cursor.close()
+
+
 class ScheduleDatabase:
-    def __init__(self, db_uri: str = 'sqlite:///schedule.db'):
+    """
+    Owns the engine and schema of the schedule database, meant to be created once per process.
+
+    Every `with` block opens a new session and commits it on exit, so the same instance is reused
+    for every check. A failed commit is rolled back and raised from the `with` block.
+    """
+
+    def __init__(
+            self,
+            db_uri: str = DB_URI,
+            known_entry_index: KnownEntryIndex | None = None,
+            sqlite_performance_profile: bool = SQLITE_PERFORMANCE_PROFILE
+    ):
         self.engine = create_engine(db_uri)
-        Base.metadata.create_all(self.engine)
+        if sqlite_performance_profile and self.engine.dialect.name == 'sqlite':
+            event.listen(self.engine, 'connect', _apply_sqlite_performance_profile)
+        self._create_schema()
         self.Session = sessionmaker(bind=self.engine)
         self.session = None
+        self.known_entry_index: KnownEntryIndex | None = known_entry_index
+
+    def _create_schema(self) -> None:
+        """
+        Create what is missing of the schema. When replicas race to create the same table or column, the
+        losers fail and try again, finding it created.
+        """
+        for attempt in range(1, SCHEMA_CREATE_ATTEMPTS + 1):
+            try:
+                self._add_schedule_entry_ids()
+                Base.metadata.create_all(self.engine)
+                self._add_missing_columns()
+                self._add_missing_indexes()
+                self._create_search_index()
+                return
+            except DBAPIError as e:
+                if attempt == SCHEMA_CREATE_ATTEMPTS:
+                    raise
+                logger.warning(f'Creating the schema failed ({e.orig}), trying again')
+                time.sleep(attempt * random.random())
+
+    def _add_schedule_entry_ids(self) -> None:
+        """
+        Move the entries of a schedule_entries table created without the id column into a new one, also
+        finishing a move that was interrupted. The search index referred to the implicit rowids, it is
+        dropped and created again.
+        """
+        inspector = inspect(self.engine)
+        table_names: list[str] = inspector.get_table_names()
+        if UNKEYED_SCHEDULE_ENTRIES_TABLE not in table_names:
+            if (
+                    ScheduleEntry.__tablename__ not in table_names
+                    or 'id' in set(column['name'] for column in inspector.get_columns(ScheduleEntry.__tablename__))
+            ):
+                return
+
+            logger.info(f'Adding ids to {ScheduleEntry.__tablename__}')
+            with self.engine.begin() as connection:
+                if self.has_search_index:
+                    for statement in SEARCH_INDEX_DROP:
+                        connection.execute(text(statement))
+                # Index names are unique per database (schema in PostgreSQL), the new table creates them again
+                for index in ScheduleEntry.__table__.indexes:
+                    index.drop(connection, checkfirst=True)
+                # Core has no construct for a rename, this statement is the same in SQLite and PostgreSQL
+                preparer = self.engine.dialect.identifier_preparer
+                connection.execute(text(
+                    f'ALTER TABLE {preparer.quote(ScheduleEntry.__tablename__)} '
+                    f'RENAME TO {preparer.quote(UNKEYED_SCHEDULE_ENTRIES_TABLE)}'
+                ))
+
+        with self.engine.begin() as connection:
+            unkeyed_table: Table = Table(UNKEYED_SCHEDULE_ENTRIES_TABLE, MetaData(), autoload_with=connection)
+            # Columns added since the table was created take their defaults
+            column_names: list[str] = [
+                column.name
+                for column
+                in ScheduleEntry.__table__.columns
+                if column.name in unkeyed_table.columns and not column.primary_key
+            ]
+            ScheduleEntry.__table__.create(connection, checkfirst=True)
+            row_count: int = connection.execute(
+                self.insert(ScheduleEntry).from_select(
+                    column_names,
+                    # The WHERE keeps SQLite from parsing ON CONFLICT as a join constraint
+                    select(*(unkeyed_table.c[name] for name in column_names)).where(true()).order_by(
+                        unkeyed_table.c.start_datetime,
+                        unkeyed_table.c.title,
+                        unkeyed_table.c.location
+                    )
+                ).on_conflict_do_nothing()
+            ).rowcount
+            unkeyed_table.drop(connection)
+        logger.info(f'Moved {row_count} entries to {ScheduleEntry.__tablename__} with ids')
+
+    def _add_missing_columns(self) -> None:
+        """
+        create_all only creates missing tables, add the columns introduced after a table was created.
+        """
+        inspector = inspect(self.engine)
+        with self.engine.begin() as connection:
+            for table in Base.metadata.sorted_tables:
+                existing_columns: set[str] = set(column['name'] for column in inspector.get_columns(table.name))
+                for column in table.columns:
+                    if column.name in existing_columns:
+                        continue
+
+                    column_type: str = column.type.compile(dialect=self.engine.dialect)
+                    column_default: str = ''
+                    if column.server_default is not None:
+                        column_default = f' DEFAULT {column.server_default.arg.compile(dialect=self.engine.dialect)}'
+                    logger.info(f'Adding column {column.name} to {table.name}')
+                    connection.execute(text(
+                        f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{column_default}'
+                    ))
+
+    def _add_missing_indexes(self) -> None:
+        """
+        create_all only creates the indexes of new tables, add the indexes introduced after a table was created.
+        """
+        with self.engine.begin() as connection:
+            for table in Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(connection, checkfirst=True)
+
+    @property
+    def has_search_index(self) -> bool:
+        return self.engine.dialect.name == 'sqlite'
+
+    def _create_search_index(self) -> None:
+        """
+        Create whatever is missing of the full-text search index of a SQLite database, and fill the index
+        if it is new.
+        """
+        if not self.has_search_index:
+            return
+        is_new: bool = not inspect(self.engine).has_table(SEARCH_INDEX_TABLE)
+        with self.engine.begin() as connection:
+            for statement in SEARCH_INDEX_DDL:
+                connection.execute(text(statement))
+        if is_new:
+            logger.info(f'Created the search index {SEARCH_INDEX_TABLE}')
+            self.rebuild_search_index()
+
+    def rebuild_search_index(self) -> None:
+        """
+        Rebuild the search index from schedule_entries, e.g. if it was damaged.
+        """
+        if not self.has_search_index:
+            return
+        with self.engine.begin() as connection:
+            connection.execute(text(SEARCH_INDEX_REBUILD))
+
+    def insert(self, table: Any) -> sqlite.Insert | postgresql.Insert:
+        """
+        INSERT statement of the database's dialect, for the ON CONFLICT clauses SQLite and PostgreSQL share.
+        """
+        if self.engine.dialect.name == 'postgresql':
+            return postgresql.insert(table)
+        return sqlite.insert(table)
 
     def __enter__(self) -> 'ScheduleDatabase':
-        logger.debug("Opening session...")
         self.session = self.Session()
-        logger.debug("Session opened!")
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if exc_type is not None:
             logger.exception("Exception occurred within ScheduleDatabase context, rolling back transaction...", exc_val)
             self.session.rollback()
-            logger.debug("Transaction rolled back successfully!")
+            if self.known_entry_index is not None:
+                self.known_entry_index.rollback()
+            DB_TRANSACTIONS.labels('rollback').inc()
         else:
             try:
-                logger.debug("Committing transaction (exiting ScheduleDatabase context)...")
-                self.session.commit()
-                logger.debug("Transaction committed successfully!")
+                with DB_OPERATION_SECONDS.labels('commit').time():
+                    self.session.commit()
+                if self.known_entry_index is not None:
+                    self.known_entry_index.commit()
+                DB_TRANSACTIONS.labels('commit').inc()
             except Exception as e:
                 logger.exception("Exception occurred committing transaction, rolling back...", e)
                 self.session.rollback()
-                logger.debug("Transaction rolled back successfully!")
+                if self.known_entry_index is not None:
+                    self.known_entry_index.rollback()
+                DB_TRANSACTIONS.labels('rollback').inc()
+                self.session.close()
+                self.session = None
+                # Nothing was stored, the caller must not go on as if it was
+                raise
 
-        logger.debug("Closing session...")
         self.session.close()
-        logger.debug("Session closed!")
         self.session = None
 
+    def get_table_version(self, name: str) -> int:
+        """
+        Raises:
+            SessionNotActiveError: If called outside of context manager
+        """
+        self._check_session()
+        return self.session.scalar(select(TableVersion.version).where(TableVersion.name == name)) or 0
+
+    def _bump_table_version(self, name: str) -> int:
+        """
+        Returns:
+            The new version of the table, bumped in the current transaction
+        """
+        statement = self.insert(TableVersion).values(name=name, version=1)
+        statement = statement.on_conflict_do_update(
+            index_elements=['name'],
+            set_={'version': TableVersion.version + 1}
+        ).returning(TableVersion.version)
+        return self.session.scalar(statement)
+
     def _check_session(self) -> None:
         """Verify that session is active"""
         if self.session is None:
@@ -138,6 +760,261 @@ class ScheduleDatabase:
         """
         self._check_session()
         self.session.add(entry)
+        entries_version: int = self._bump_table_version(ScheduleEntry.__tablename__)
+        if self.known_entry_index is not None:
+            self.known_entry_index.stage([entry.key], entries_version)
+
+    @DB_OPERATION_SECONDS.labels('filter_new_entries').time()
+    def filter_new_entries(
+            self,
+            entries: Iterable[ScheduleEntry | ScheduleEntryRecord]
+    ) -> list[ScheduleEntry | ScheduleEntryRecord]:
+        """
+        Return the entries that are not in the database yet, in their original order and without
+        duplicates, resolving the whole batch in a few key lookups.
+
+        With a known entry index the database is not read at all, unless the index was invalidated and
+        reads the version of schedule_entries, or has to be (re)loaded.
+
+        Raises:
+            SessionNotActiveError: If called outside of context manager
+        """
+        self._check_session()
+
+        entries_by_key: dict[ScheduleEntryKey, ScheduleEntry | ScheduleEntryRecord] = {}
+        for entry in entries:
+            entries_by_key.setdefault(entry.key, entry)
+
+        if self.known_entry_index is not None:
+            if not self.known_entry_index.verified:
+                entries_version: int = self.get_table_version(ScheduleEntry.__tablename__)
+                if self.known_entry_index.is_stale(entries_version):
+                    self.known_entry_index.load(self.session, entries_version)
+                self.known_entry_index.verified = True
+            self.known_entry_index.prune()
+            return [entry for key, entry in entries_by_key.items() if key not in self.known_entry_index]
+
+        keys: list[ScheduleEntryKey] = list(entries_by_key)
+        existing_keys: set[ScheduleEntryKey] = set()
+        for batch_start in range(0, len(keys), KEY_LOOKUP_BATCH_SIZE):
+            existing_keys.update(
+                tuple(row)
+                for row
+                in self.session.execute(
+                    select(
+                        ScheduleEntry.start_datetime,
+                        ScheduleEntry.title,
+                        ScheduleEntry.location
+                    ).where(
+                        tuple_(
+                            ScheduleEntry.start_datetime,
+                            ScheduleEntry.title,
+                            ScheduleEntry.location
+                        ).in_(keys[batch_start:batch_start + KEY_LOOKUP_BATCH_SIZE])
+                    )
+                )
+            )
+
+        return [entry for key, entry in entries_by_key.items() if key not in existing_keys]
+
+    @DB_OPERATION_SECONDS.labels('add_entries').time()
+    def add_entries(
+            self,
+            entries: Iterable[ScheduleEntry | ScheduleEntryRecord]
+    ) -> list[ScheduleEntry | ScheduleEntryRecord]:
+        """
+        Insert schedule entries in bulk, skipping any that already exist. Records are inserted as
+        they are, without creating ORM objects.
+
+        Returns:
+            The entries that were actually inserted, in their original order
+
+        Raises:
+            SessionNotActiveError: If called outside of context manager
+        """
+        self._check_session()
+
+        entries = list(entries)
+        if len(entries) == 0:
+            return []
+
+        inserted_keys: set[ScheduleEntryKey] = set()
+        for batch_start in range(0, len(entries), INSERT_BATCH_SIZE):
+            inserted_keys.update(
+                tuple(row)
+                for row
+                in self.session.execute(
+                    self.insert(ScheduleEntry).values(
+                        [entry.to_values() for entry in entries[batch_start:batch_start + INSERT_BATCH_SIZE]]
+                    ).on_conflict_do_nothing().returning(
+                        ScheduleEntry.start_datetime,
+                        ScheduleEntry.title,
+                        ScheduleEntry.location
+                    )
+                )
+            )
+
+        entries_version: int | None = None
+        if len(inserted_keys) > 0:
+            entries_version = self._bump_table_version(ScheduleEntry.__tablename__)
+        if self.known_entry_index is not None:
+            # Entries that conflicted exist as well, remember them so they are not inserted again
+            self.known_entry_index.stage((entry.key for entry in entries), entries_version)
+
+        return [entry for entry in entries if entry.key in inserted_keys]
+
+    @DB_OPERATION_SECONDS.labels('get_entries').time()
+    def get_entries(self, keys: Iterable[ScheduleEntryKey]) -> dict[ScheduleEntryKey, ScheduleEntry]:
+        """
+        Load the stored entries with the given keys, changes to them are saved on commit.
+
+        Raises:
+            SessionNotActiveError: If called outside of context manager
+        """
+        self._check_session()
+
+        keys = list(keys)
+        entries: dict[ScheduleEntryKey, ScheduleEntry] = {}
+        for batch_start in range(0, len(keys), KEY_LOOKUP_BATCH_SIZE):
+            for entry in self.session.scalars(
+                    select(ScheduleEntry).where(
+                        tuple_(
+                            ScheduleEntry.start_datetime,
+                            ScheduleEntry.title,
+                            ScheduleEntry.location
+                        ).in_(keys[batch_start:batch_start + KEY_LOOKUP_BATCH_SIZE])
+                    )
+            ):
+                entries[entry.key] = entry
+        return entries
+
+    @DB_OPERATION_SECONDS.labels('enqueue_notifications').time()
+    def enqueue_notifications(self, chat_ids: Iterable[str], bodies: Iterable[str]) -> None:
+        """
+        Queue every body for every chat, they are sent by the notification dispatcher after commit.
+
+        Raises:
+            SessionNotActiveError: If called outside of context manager
+        """
+        self._check_session()
+
+        now: datetime = datetime.now()
+        chat_ids = list(chat_ids)
+        notifications: list[OutboxNotification] = [
+            OutboxNotification(
+                chat_id=chat_id,
+                body=body,
+                created_at=now,
+                attempts=0,
+                next_attempt_at=now
+            )
+            for body in bodies
+            for chat_id in chat_ids
+        ]
+        self.session.add_all(notifications)
+        NOTIFICATIONS_QUEUED.inc(len(notifications))
+
+    @DB_OPERATION_SECONDS.labels('get_subscription_rules').time()
+    def get_subscription_rules(self) -> list[SubscriptionRule]:
+        """
+        Raises:
+            SessionNotActiveError: If called outside of context manager
+        """
+        self._check_session()
+        return list(self.session.scalars(select(SubscriptionRule).order_by(SubscriptionRule.id)))
+
+    @DB_OPERATION_SECONDS.labels('get_scraper_snapshot').time()
+    def get_scraper_snapshot(self, scraper: str) -> dict[ScheduleEntryKey, str]:
+        """
+        Fingerprints of the entries a scraper yielded the last time its schedule changed. With a known
+        entry index it is only read once, and then taken from the index until that is invalidated. The
+        returned snapshot must not be modified.
+
+        Raises:
+            SessionNotActiveError: If called outside of context manager
+        """
+        self._check_session()
+        if self.known_entry_index is not None:
+            cached_snapshot: dict[ScheduleEntryKey, str] | None = self.known_entry_index.get_snapshot(scraper)
+            if cached_snapshot is not None:
+                return cached_snapshot
+
+        snapshot: dict[ScheduleEntryKey, str] = {
+            (start_datetime, title, location): fingerprint
+            for start_datetime, title, location, fingerprint
+            in self.session.execute(
+                select(
+                    ScraperSnapshotEntry.start_datetime,
+                    ScraperSnapshotEntry.title,
+                    ScraperSnapshotEntry.location,
+                    ScraperSnapshotEntry.fingerprint
+                ).where(ScraperSnapshotEntry.scraper == scraper)
+            )
+        }
+        if self.known_entry_index is not None:
+            # As stored, like the snapshots the index already holds
+            self.known_entry_index.snapshots[scraper] = snapshot
+        return snapshot
+
+    @DB_OPERATION_SECONDS.labels('update_scraper_snapshot').time()
+    def update_scraper_snapshot(
+            self,
+            scraper: str,
+            removed_keys: Iterable[ScheduleEntryKey],
+            fingerprints: dict[ScheduleEntryKey, str]
+    ) -> None:
+        """
+        Remove keys from a scraper's snapshot and insert or update the fingerprints of others.
+
+        Raises:
+            SessionNotActiveError: If called outside of context manager
+        """
+        self._check_session()
+
+        removed_keys = list(removed_keys)
+        for batch_start in range(0, len(removed_keys), KEY_LOOKUP_BATCH_SIZE):
+            self.session.execute(
+                delete(ScraperSnapshotEntry).where(
+                    ScraperSnapshotEntry.scraper == scraper,
+                    tuple_(
+                        ScraperSnapshotEntry.start_datetime,
+                        ScraperSnapshotEntry.title,
+                        ScraperSnapshotEntry.location
+                    ).in_(removed_keys[batch_start:batch_start + KEY_LOOKUP_BATCH_SIZE])
+                )
+            )
+
+        snapshot_values: list[dict[str, Any]] = [
+            {
+                'scraper': scraper,
+                'start_datetime': start_datetime,
+                'title': title,
+                'location': location,
+                'fingerprint': fingerprint
+            }
+            for (start_datetime, title, location), fingerprint
+            in fingerprints.items()
+        ]
+        for batch_start in range(0, len(snapshot_values), INSERT_BATCH_SIZE):
+            statement = self.insert(ScraperSnapshotEntry).values(
+                snapshot_values[batch_start:batch_start + INSERT_BATCH_SIZE]
+            )
+            self.session.execute(
+                statement.on_conflict_do_update(
+                    index_elements=['scraper', 'start_datetime', 'title', 'location'],
+                    set_={'fingerprint': statement.excluded.fingerprint}
+                )
+            )
+
+        if self.known_entry_index is not None:
+            cached_snapshot: dict[ScheduleEntryKey, str] | None = self.known_entry_index.get_snapshot(scraper)
+            if cached_snapshot is not None:
+                removed_key_set: set[ScheduleEntryKey] = set(removed_keys)
+                updated_snapshot: dict[ScheduleEntryKey, str] = {
+                    key: fingerprint for key, fingerprint in cached_snapshot.items() if key not in removed_key_set
+                }
+                updated_snapshot.update(fingerprints)
+                self.known_entry_index.stage_snapshot(scraper, updated_snapshot)
 
 
 def main():
@@ -194,6 +1071,24 @@ def main():
     if test_db_path.exists():
         test_db_path.unlink()
 
+    # Test bulk operation
+    print("\nTesting bulk operation...")
+    bulk_entries = [
+        ScheduleEntry(
+            start_datetime=now + timedelta(days=day),
+            title="Daily Standup",
+            location="Room C"
+        )
+        for day in range(3)
+    ]
+    with ScheduleDatabase(db_uri=test_db_uri) as db:
+        print(f"Added {db.add_entries(db.filter_new_entries(bulk_entries[:2]))}")
+    with ScheduleDatabase(db_uri=test_db_uri) as db:
+        print(f"New entries: {[entry.key for entry in db.filter_new_entries(bulk_entries)]}")
+        print(f"Inserted duplicates: {db.add_entries(bulk_entries[:1])}")
+    if test_db_path.exists():
+        test_db_path.unlink()
+
     # Test error handling for operation outside context manager
     print("\nTesting error handling...")
     try:
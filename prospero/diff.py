@@ -0,0 +1,144 @@
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Iterable
+
+from loguru import logger
+
+from prospero.db import ScheduleDatabase, ScheduleEntry, ScheduleEntryKey, ScheduleEntryRecord
+
+
+@dataclass
+class ScheduleDiff:
+    """
+    Difference between a scraper's previous snapshot and its current entries, by key and fingerprint.
+    """
+    added: list[ScheduleEntryRecord] = field(default_factory=list)
+    modified: list[ScheduleEntryRecord] = field(default_factory=list)
+    removed: list[ScheduleEntryKey] = field(default_factory=list)
+    # Fingerprints of the added and modified entries
+    fingerprints: dict[ScheduleEntryKey, str] = field(default_factory=dict)
+
+
+@dataclass
+class ScheduleChanges:
+    """
+    Stored entries that are new, changed (with the names of the changed fields) or cancelled.
+    """
+    new: list[ScheduleEntryRecord] = field(default_factory=list)
+    changed: list[tuple[ScheduleEntry, list[str]]] = field(default_factory=list)
+    cancelled: list[ScheduleEntry] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.new) + len(self.changed) + len(self.cancelled)
+
+    def extend(self, other: 'ScheduleChanges') -> None:
+        self.new.extend(other.new)
+        self.changed.extend(other.changed)
+        self.cancelled.extend(other.cancelled)
+
+
+def diff_schedule(previous: dict[ScheduleEntryKey, str], entries: Iterable[ScheduleEntryRecord]) -> ScheduleDiff:
+    schedule_diff: ScheduleDiff = ScheduleDiff()
+
+    current_keys: set[ScheduleEntryKey] = set()
+    for entry in entries:
+        key: ScheduleEntryKey = entry.key
+        if key in current_keys:
+            continue
+        current_keys.add(key)
+
+        fingerprint: str = entry.fingerprint
+        previous_fingerprint: str | None = previous.get(key)
+        if previous_fingerprint is None:
+            schedule_diff.added.append(entry)
+        elif previous_fingerprint != fingerprint:
+            schedule_diff.modified.append(entry)
+        else:
+            continue
+        schedule_diff.fingerprints[key] = fingerprint
+
+    schedule_diff.removed = [key for key in previous if key not in current_keys]
+    return schedule_diff
+
+
+def _update_stored_entry(stored_entry: ScheduleEntry, entry: ScheduleEntryRecord) -> list[str]:
+    """
+    Copy the content fields of a freshly scraped entry onto its stored version.
+
+    Returns:
+        Names of the fields that differed, including 'cancelled' if the stored entry was cancelled
+    """
+    values: dict[str, Any] = entry.to_values()
+
+    changed_fields: list[str] = []
+    for field_name in ScheduleEntry.CONTENT_FIELDS:
+        if getattr(stored_entry, field_name) != values[field_name]:
+            changed_fields.append(field_name)
+            setattr(stored_entry, field_name, values[field_name])
+
+    if stored_entry.cancelled:
+        changed_fields.append('cancelled')
+        stored_entry.cancelled = False
+
+    return changed_fields
+
+
+def apply_scraped_entries(
+        db: ScheduleDatabase,
+        scraper: str,
+        entries: list[ScheduleEntryRecord]
+) -> ScheduleChanges:
+    """
+    Diff a scraper's entries against its previous snapshot, store the differences and save the new snapshot.
+
+    Only entries whose fingerprint changed are compared field by field, and only entries that are
+    in neither the snapshot nor the database are inserted. Entries missing from the scrape are
+    cancelled if they haven't started yet.
+    """
+    schedule_diff: ScheduleDiff = diff_schedule(db.get_scraper_snapshot(scraper), entries)
+    schedule_changes: ScheduleChanges = ScheduleChanges()
+
+    now: datetime = datetime.now()
+    cancelled_keys: list[ScheduleEntryKey] = [key for key in schedule_diff.removed if key[0] >= now]
+    if len(entries) == 0 and len(cancelled_keys) > 0:
+        # A schedule doesn't empty out overnight, the page layout most likely changed
+        logger.warning(f'{scraper} returned no entries, not cancelling {len(cancelled_keys)} upcoming entries')
+        return schedule_changes
+
+    schedule_changes.new = db.add_entries(db.filter_new_entries(schedule_diff.added))
+    new_keys: set[ScheduleEntryKey] = set(entry.key for entry in schedule_changes.new)
+
+    # Added entries that were already stored (first scrape with a snapshot, or a cancelled performance
+    # that is back) are compared field by field just like modified ones
+    compared_entries: list[ScheduleEntryRecord] = schedule_diff.modified + [
+        entry
+        for entry
+        in schedule_diff.added
+        if entry.key not in new_keys
+    ]
+    stored_entries: dict[ScheduleEntryKey, ScheduleEntry] = db.get_entries(
+        entry.key for entry in compared_entries
+    )
+    for entry in compared_entries:
+        stored_entry: ScheduleEntry | None = stored_entries.get(entry.key)
+        if stored_entry is None:
+            continue
+
+        changed_fields: list[str] = _update_stored_entry(stored_entry, entry)
+        if len(changed_fields) > 0:
+            schedule_changes.changed.append((stored_entry, changed_fields))
+
+    if len(cancelled_keys) > 0:
+        for stored_entry in db.get_entries(cancelled_keys).values():
+            if not stored_entry.cancelled:
+                stored_entry.cancelled = True
+                schedule_changes.cancelled.append(stored_entry)
+
+    db.update_scraper_snapshot(scraper, schedule_diff.removed, schedule_diff.fingerprints)
+
+    logger.debug(
+        f'{scraper}: {len(schedule_diff.added)} added, {len(schedule_diff.modified)} modified and '
+        f'{len(schedule_diff.removed)} removed since last scrape, {len(schedule_changes.new)} new, '
+        f'{len(schedule_changes.changed)} changed and {len(schedule_changes.cancelled)} cancelled entries'
+    )
+    return schedule_changes
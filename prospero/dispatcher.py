@@ -0,0 +1,335 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING
+
+from loguru import logger
+from sqlalchemy import ColumnElement, Select, delete, or_, select, update
+
+from prospero.config import (
+    get_telegram_bot_token, REPLICA_ID, NOTIFICATION_RATE, NOTIFICATION_BURST, NOTIFICATION_MAX_ATTEMPTS,
+    NOTIFICATION_RETRY_DELAY, NOTIFICATION_MAX_RETRY_DELAY, NOTIFICATION_CLAIM_SECONDS, NOTIFICATION_RETENTION_DAYS
+)
+from prospero.db import OutboxNotification, ScheduleDatabase
+from prospero.metrics import (
+    NOTIFICATIONS_SENT, NOTIFICATIONS_FAILED, NOTIFICATION_SEND_SECONDS, NOTIFICATION_CLAIMS_LOST
+)
+
+if TYPE_CHECKING:
+    from apprise.apprise import Apprise
+
+# Notifications loaded from the outbox at once per chat
+OUTBOX_BATCH_SIZE: int = 50
+# Seconds between deletions of the notifications sent longer than the retention ago
+OUTBOX_PRUNE_INTERVAL: float = 60 * 60
+
+
+class TokenBucket:
+    """
+    Allows `rate` acquisitions per second on average and up to `burst` in a row.
+    """
+
+    def __init__(self, rate: float = NOTIFICATION_RATE, burst: int = NOTIFICATION_BURST):
+        self.rate: float = rate
+        self.burst: int = burst
+        self.tokens: float = burst
+        self.updated_at: float = time.monotonic()
+
+    def _refill(self) -> None:
+        now: float = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self) -> None:
+        self._refill()
+        while self.tokens < 1:
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+            self._refill()
+        self.tokens -= 1
+
+
+class NotificationDispatcher:
+    """
+    Sends the notifications queued in the outbox table, one worker per chat so chats are served in
+    parallel while each chat is rate limited by its own token bucket.
+
+    Failed sends are retried with exponential backoff, up to NOTIFICATION_MAX_ATTEMPTS attempts.
+    Call wake() after queueing notifications so idle workers pick them up right away. Notifications
+    sent more than retention_days ago are deleted. The outbox is read and written from worker threads,
+    so a slow database never blocks the event loop.
+
+    Notifications are claimed before they are sent, so dispatchers of several replicas sharing the outbox
+    never send the same one. A replica that stops after sending a notification but before marking it
+    sent leaves it to be sent again once its claim expires. Rate limits are per replica. Workers of
+    replicas are not woken by the others, with a poll_interval they look for new notifications at
+    least that often.
+    """
+
+    def __init__(
+            self,
+            db: ScheduleDatabase,
+            chat_ids: list[str],
+            replica_id: str = REPLICA_ID,
+            claim_seconds: float = NOTIFICATION_CLAIM_SECONDS,
+            poll_interval: float | None = None,
+            retention_days: float = NOTIFICATION_RETENTION_DAYS
+    ):
+        self.db: ScheduleDatabase = db
+        self.chat_ids: list[str] = chat_ids
+        self.replica_id: str = replica_id
+        self.claim_duration: timedelta = timedelta(seconds=claim_seconds)
+        self.poll_interval: float | None = poll_interval
+        self.retention: timedelta = timedelta(days=retention_days)
+        self.wakeup_events: dict[str, asyncio.Event] = {chat_id: asyncio.Event() for chat_id in chat_ids}
+
+    def wake(self) -> None:
+        for wakeup_event in self.wakeup_events.values():
+            wakeup_event.set()
+
+    @staticmethod
+    def _get_retry_delay(attempts: int) -> timedelta:
+        return timedelta(seconds=min(NOTIFICATION_RETRY_DELAY * 2 ** (attempts - 1), NOTIFICATION_MAX_RETRY_DELAY))
+
+    @staticmethod
+    def _get_due_conditions(chat_id: str, now: datetime) -> tuple[ColumnElement, ...]:
+        return (
+            OutboxNotification.chat_id == chat_id,
+            OutboxNotification.sent_at.is_(None),
+            OutboxNotification.next_attempt_at <= now,
+            or_(OutboxNotification.claimed_until.is_(None), OutboxNotification.claimed_until <= now)
+        )
+
+    def _claim_due_notifications(self, chat_id: str) -> list[tuple[int, str, int]]:
+        """
+        Claim the due notifications of a chat that no replica holds an unexpired claim on, in a single
+        UPDATE so two replicas never claim the same notification.
+
+        Returns:
+            Id, body and attempts of the claimed notifications, ordered by id
+        """
+        now: datetime = datetime.now()
+        due_ids: Select = select(OutboxNotification.id).where(
+            *self._get_due_conditions(chat_id, now)
+        ).order_by(OutboxNotification.id).limit(OUTBOX_BATCH_SIZE)
+        if self.db.engine.dialect.name == 'postgresql':
+            # Concurrent claims skip the rows another one is claiming instead of waiting for it
+            due_ids = due_ids.with_for_update(skip_locked=True)
+
+        with self.db.Session() as session, session.begin():
+            return sorted(
+                tuple(row)
+                for row
+                in session.execute(
+                    update(OutboxNotification).where(
+                        OutboxNotification.id.in_(due_ids),
+                        # Checked again on the rows themselves, for databases that let claims run concurrently
+                        *self._get_due_conditions(chat_id, now)
+                    ).values(
+                        claimed_by=self.replica_id,
+                        claimed_until=now + self.claim_duration
+                    ).returning(
+                        OutboxNotification.id,
+                        OutboxNotification.body,
+                        OutboxNotification.attempts
+                    ).execution_options(synchronize_session=False)
+                )
+            )
+
+    def _get_next_attempt_at(self, chat_id: str) -> datetime | None:
+        """
+        Returns:
+            When the next notification of a chat becomes due, or its claim by another replica expires
+        """
+        now: datetime = datetime.now()
+        pending: tuple[ColumnElement, ...] = (
+            OutboxNotification.chat_id == chat_id,
+            OutboxNotification.sent_at.is_(None),
+            OutboxNotification.next_attempt_at.is_not(None)
+        )
+        with self.db.Session() as session:
+            next_attempt_at: datetime | None = session.scalar(
+                select(OutboxNotification.next_attempt_at).where(
+                    *pending,
+                    or_(OutboxNotification.claimed_until.is_(None), OutboxNotification.claimed_until <= now)
+                ).order_by(OutboxNotification.next_attempt_at).limit(1)
+            )
+            claim_expires_at: datetime | None = session.scalar(
+                select(OutboxNotification.claimed_until).where(
+                    *pending,
+                    OutboxNotification.claimed_until > now
+                ).order_by(OutboxNotification.claimed_until).limit(1)
+            )
+        return min((at for at in (next_attempt_at, claim_expires_at) if at is not None), default=None)
+
+    def _update_claimed(self, notification_id: int, **values) -> None:
+        """
+        Update a notification claimed by this replica and end the claim, unless another replica claimed
+        it after the claim expired.
+        """
+        with self.db.Session() as session, session.begin():
+            updated_count: int = session.execute(
+                update(OutboxNotification).where(
+                    OutboxNotification.id == notification_id,
+                    OutboxNotification.claimed_by == self.replica_id
+                ).values(claimed_until=None, **values).execution_options(synchronize_session=False)
+            ).rowcount
+        if updated_count == 0:
+            logger.warning(f'Claim of notification {notification_id} expired and was taken by another replica')
+            NOTIFICATION_CLAIMS_LOST.inc()
+
+    def _release_claims(self, notification_ids: list[int]) -> None:
+        with self.db.Session() as session, session.begin():
+            session.execute(
+                update(OutboxNotification).where(
+                    OutboxNotification.id.in_(notification_ids),
+                    OutboxNotification.claimed_by == self.replica_id
+                ).values(claimed_until=None).execution_options(synchronize_session=False)
+            )
+
+    def _delete_sent_notifications(self) -> int:
+        """
+        Returns:
+            Number of deleted notifications, those sent more than the retention ago
+        """
+        with self.db.Session() as session, session.begin():
+            return session.execute(
+                delete(OutboxNotification).where(
+                    OutboxNotification.sent_at < datetime.now() - self.retention
+                ).execution_options(synchronize_session=False)
+            ).rowcount
+
+    async def _prune_sent_notifications(self) -> None:
+        pruned_count: int = await asyncio.to_thread(self._delete_sent_notifications)
+        if pruned_count > 0:
+            logger.info(f'Deleted {pruned_count} notifications sent more than {self.retention.days} days ago')
+
+    def _mark_sent(self, notification_id: int, attempts: int) -> None:
+        self._update_claimed(notification_id, attempts=attempts, sent_at=datetime.now(), next_attempt_at=None)
+
+    def _mark_failed(self, notification_id: int, attempts: int, error: str) -> None:
+        next_attempt_at: datetime | None = None
+        if attempts < NOTIFICATION_MAX_ATTEMPTS:
+            next_attempt_at = datetime.now() + self._get_retry_delay(attempts)
+            logger.warning(f'Sending notification {notification_id} failed ({error}), retrying at {next_attempt_at}')
+        else:
+            logger.error(f'Sending notification {notification_id} failed ({error}), giving up after {attempts} attempts')
+
+        self._update_claimed(notification_id, attempts=attempts, next_attempt_at=next_attempt_at, last_error=error)
+
+    async def _send(self, apprise: 'Apprise', body: str) -> str | None:
+        """
+        Returns:
+            None if the notification was sent, otherwise a description of the error
+        """
+        try:
+            if await apprise.async_notify(body=body):
+                return None
+            return 'notification service rejected the message'
+        except Exception as e:
+            logger.exception('Exception occurred while sending notification', e)
+            return repr(e)
+
+    @staticmethod
+    def _get_apprise(chat_id: str) -> 'Apprise':
+        # Importing apprise loads all of its plugins, only pay for it once there is something to send
+        from apprise.apprise import Apprise
+        return Apprise(servers=[f'tgram://{get_telegram_bot_token()}/{chat_id}/?format=markdown'])
+
+    async def _run_chat(self, chat_id: str) -> None:
+        apprise: 'Apprise' = self._get_apprise(chat_id)
+        token_bucket: TokenBucket = TokenBucket()
+        wakeup_event: asyncio.Event = self.wakeup_events[chat_id]
+
+        while True:
+            try:
+                await self._dispatch_due_notifications(chat_id, apprise, token_bucket, wakeup_event)
+            except Exception as e:
+                logger.exception(f'Exception occurred while dispatching notifications to {chat_id}', e)
+                await asyncio.sleep(NOTIFICATION_RETRY_DELAY)
+
+    async def _dispatch_due_notifications(
+            self,
+            chat_id: str,
+            apprise: 'Apprise',
+            token_bucket: TokenBucket,
+            wakeup_event: asyncio.Event
+    ) -> None:
+        """
+        Send the due notifications of a chat, or wait for new ones if there are none.
+        """
+        wakeup_event.clear()
+        due_notifications: list[tuple[int, str, int]] = await asyncio.to_thread(self._claim_due_notifications, chat_id)
+
+        if len(due_notifications) == 0:
+            # Sleep until woken up by new notifications or until the next retry is due
+            next_attempt_at: datetime | None = await asyncio.to_thread(self._get_next_attempt_at, chat_id)
+            timeout: float | None = self.poll_interval
+            if next_attempt_at is not None:
+                timeout = max(0.0, (next_attempt_at - datetime.now()).total_seconds())
+                if self.poll_interval is not None:
+                    timeout = min(timeout, self.poll_interval)
+            try:
+                await asyncio.wait_for(wakeup_event.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            return
+
+        await self._send_notifications(chat_id, apprise, token_bucket, due_notifications)
+
+    async def _send_notifications(
+            self,
+            chat_id: str,
+            apprise: 'Apprise',
+            token_bucket: TokenBucket,
+            notifications: list[tuple[int, str, int]]
+    ) -> None:
+        # Whatever is left of the batch by then is left to a later claim, rather than sent this close to
+        # the claim expiring
+        send_deadline: float = time.monotonic() + self.claim_duration.total_seconds() / 2
+        for index, (notification_id, body, attempts) in enumerate(notifications):
+            await token_bucket.acquire()
+            if time.monotonic() > send_deadline:
+                await asyncio.to_thread(
+                    self._release_claims, [remaining_id for remaining_id, _, _ in notifications[index:]]
+                )
+                return
+            started_at: float = time.monotonic()
+            error: str | None = await self._send(apprise, body)
+            NOTIFICATION_SEND_SECONDS.labels(chat_id).observe(time.monotonic() - started_at)
+            if error is None:
+                await asyncio.to_thread(self._mark_sent, notification_id, attempts + 1)
+                NOTIFICATIONS_SENT.labels(chat_id).inc()
+            else:
+                await asyncio.to_thread(self._mark_failed, notification_id, attempts + 1, error)
+                NOTIFICATIONS_FAILED.labels(chat_id).inc()
+
+    async def _send_due_chat(self, chat_id: str) -> None:
+        due_notifications: list[tuple[int, str, int]] = await asyncio.to_thread(self._claim_due_notifications, chat_id)
+        if len(due_notifications) == 0:
+            return
+
+        apprise: 'Apprise' = self._get_apprise(chat_id)
+        token_bucket: TokenBucket = TokenBucket()
+        # Failed notifications are due again only after their retry delay, so this ends
+        while len(due_notifications) > 0:
+            await self._send_notifications(chat_id, apprise, token_bucket, due_notifications)
+            due_notifications = await asyncio.to_thread(self._claim_due_notifications, chat_id)
+
+    async def _run_pruning(self) -> None:
+        while True:
+            try:
+                await self._prune_sent_notifications()
+            except Exception as e:
+                logger.exception('Exception occurred while deleting sent notifications', e)
+            await asyncio.sleep(OUTBOX_PRUNE_INTERVAL)
+
+    async def run(self) -> None:
+        await asyncio.gather(self._run_pruning(), *(self._run_chat(chat_id) for chat_id in self.chat_ids))
+
+    async def send_due(self) -> None:
+        """
+        Send the notifications that are due now and return, for one-shot runs.
+        Notifications that fail stay queued until their next attempt.
+        """
+        await asyncio.gather(*(self._send_due_chat(chat_id) for chat_id in self.chat_ids))
+        await self._prune_sent_notifications()
@@ -0,0 +1,321 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Iterable
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import select
+
+from prospero.config import FEED_TIMEZONE, FEED_CACHE_SIZE
+from prospero.db import ScheduleDatabase, ScheduleEntry
+
+# Content types of the supported feed formats
+FEED_CONTENT_TYPES: dict[str, str] = {
+    'ics': 'text/calendar; charset=utf-8',
+    'json': 'application/json; charset=utf-8',
+}
+
+# Longest ICS content line in octets, longer lines are folded
+ICS_LINE_LENGTH: int = 75
+
+
+@dataclass(frozen=True)
+class FeedFilter:
+    """
+    Selection of upcoming entries in a feed, also the key its rendering is cached under.
+    """
+    format: str
+    # Exact location, None for every location
+    location: str | None = None
+    # First and last day of the feed, inclusive
+    start_date: date | None = None
+    end_date: date | None = None
+
+    def __post_init__(self):
+        if self.format not in FEED_CONTENT_TYPES:
+            raise ValueError(f'Unknown feed format {self.format!r}')
+        if self.start_date is not None and self.end_date is not None and self.start_date > self.end_date:
+            raise ValueError(f'Feed starts on {self.start_date}, after it ends on {self.end_date}')
+
+    def matches_location(self, locations: Iterable[str]) -> bool:
+        return self.location is None or self.location in locations
+
+
+@dataclass(frozen=True)
+class RenderedFeed:
+    body: bytes
+    etag: str
+    content_type: str
+    # The feed is stale from then on because its first entry is no longer upcoming, None if it has no entries
+    expires_at: datetime | None
+
+
+def _escape_ics_text(value: str) -> str:
+    return (
+        value
+        .replace('\\', '\\\\')
+        .replace(';', '\\;')
+        .replace(',', '\\,')
+        .replace('\r\n', '\\n')
+        .replace('\n', '\\n')
+    )
+
+
+def _fold_ics_line(line: str) -> str:
+    """
+    Fold a content line into lines of at most ICS_LINE_LENGTH octets, without splitting a UTF-8 sequence.
+    """
+    encoded: bytes = line.encode('utf-8')
+    if len(encoded) <= ICS_LINE_LENGTH:
+        return line
+
+    parts: list[str] = []
+    part_start: int = 0
+    # Continuation lines start with a space, which counts towards their length
+    part_length: int = ICS_LINE_LENGTH
+    while len(encoded) - part_start > part_length:
+        part_end: int = part_start + part_length
+        while (encoded[part_end] & 0xC0) == 0x80:
+            part_end -= 1
+        parts.append(encoded[part_start:part_end].decode('utf-8'))
+        part_start = part_end
+        part_length = ICS_LINE_LENGTH - 1
+    parts.append(encoded[part_start:].decode('utf-8'))
+    return '\r\n '.join(parts)
+
+
+def _format_ics_datetime(value: datetime) -> str:
+    """
+    Format a datetime local to FEED_TIMEZONE as a UTC time, so the feed needs no VTIMEZONE component.
+    """
+    return value.replace(tzinfo=ZoneInfo(FEED_TIMEZONE)).astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def _get_entry_uid(entry: ScheduleEntry) -> str:
+    key: str = '\x1f'.join((entry.start_datetime.isoformat(), entry.title, entry.location))
+    return f'{hashlib.blake2b(key.encode(), digest_size=16).hexdigest()}@prospero'
+
+
+def render_ics_event(entry: ScheduleEntry) -> tuple[str, str]:
+    """
+    Render entry as a folded VEVENT, without its DTSTAMP line which depends on when the feed is rendered.
+
+    Returns:
+        The lines before and after DTSTAMP
+    """
+    description: list[str] = []
+    if entry.note:
+        description.append(entry.note)
+    if entry.includes_break:
+        description.append('Includes a break')
+    if entry.buy_tickets_url:
+        description.append(f'Tickets: {entry.buy_tickets_url}')
+
+    lines: list[str] = [
+        f'DTSTART:{_format_ics_datetime(entry.start_datetime)}',
+    ]
+    if entry.duration:
+        lines.append(f'DTEND:{_format_ics_datetime(entry.start_datetime + timedelta(minutes=entry.duration))}')
+    lines += [
+        f'SUMMARY:{_escape_ics_text(entry.title)}',
+        f'LOCATION:{_escape_ics_text(entry.location)}',
+        f'STATUS:{"CANCELLED" if entry.cancelled else "CONFIRMED"}',
+    ]
+    if len(description) > 0:
+        lines.append(f'DESCRIPTION:{_escape_ics_text(chr(10).join(description))}')
+    if entry.buy_tickets_url:
+        lines.append(f'URL:{entry.buy_tickets_url}')
+    lines.append('END:VEVENT')
+
+    return (
+        f'BEGIN:VEVENT\r\nUID:{_get_entry_uid(entry)}',
+        '\r\n'.join(_fold_ics_line(line) for line in lines)
+    )
+
+
+def render_ics(
+        entries: Iterable[ScheduleEntry],
+        generated_at: datetime,
+        render_event: Callable[[ScheduleEntry], tuple[str, str]] = render_ics_event
+) -> bytes:
+    """
+    Render entries as an iCalendar feed, times are in UTC and X-WR-TIMEZONE suggests FEED_TIMEZONE for display.
+    Cancelled entries are kept with STATUS:CANCELLED so calendar clients remove them.
+    """
+    lines: list[str] = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//prospero//schedule feed//EN',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        'X-WR-CALNAME:Prospero',
+        _fold_ics_line(f'X-WR-TIMEZONE:{FEED_TIMEZONE}'),
+    ]
+    dtstamp: str = f'DTSTAMP:{generated_at.strftime("%Y%m%dT%H%M%SZ")}'
+    for entry in entries:
+        event_start, event_end = render_event(entry)
+        lines += [event_start, dtstamp, event_end]
+    lines.append('END:VCALENDAR')
+
+    return ('\r\n'.join(lines) + '\r\n').encode('utf-8')
+
+
+def get_entry_json(entry: ScheduleEntry) -> dict[str, Any]:
+    return {
+        'start_datetime': entry.start_datetime.isoformat(),
+        'title': entry.title,
+        'location': entry.location,
+        'note': entry.note,
+        'duration': entry.duration,
+        'includes_break': entry.includes_break,
+        'buy_tickets_url': entry.buy_tickets_url,
+        'cancelled': entry.cancelled,
+    }
+
+
+def render_json_entry(entry: ScheduleEntry) -> str:
+    return json.dumps(get_entry_json(entry), ensure_ascii=False)
+
+
+def render_json(
+        entries: Iterable[ScheduleEntry],
+        generated_at: datetime,
+        render_entry: Callable[[ScheduleEntry], str] = render_json_entry
+) -> bytes:
+    """
+    Render entries as a JSON feed, times are local to FEED_TIMEZONE.
+    """
+    # Laid out like json.dumps, with the entries spliced in as rendered
+    return (
+        f'{{"generated_at": {json.dumps(generated_at.isoformat(timespec="seconds"))}, '
+        f'"timezone": {json.dumps(FEED_TIMEZONE, ensure_ascii=False)}, '
+        f'"entries": [{", ".join(render_entry(entry) for entry in entries)}]}}'
+    ).encode('utf-8')
+
+
+class FeedCache:
+    """
+    Rendered feeds of upcoming entries, one per FeedFilter.
+
+    A feed is rendered on its first request and served from memory until a check changes an entry at
+    one of its locations (see invalidate) or its first entry starts. Its ETag is a hash of the body, so
+    a client polling an unchanged feed gets 304 Not Modified. At most cache_size feeds are kept, the
+    least recently requested is dropped first. Changes stored by other replicas are not seen by
+    invalidate, with a max_age feeds are rendered again at least that often.
+
+    Every entry is rendered once per format and kept by id together with the values it was rendered
+    from, rendering a feed again only renders the entries whose values changed since and splices in the
+    others.
+
+    Feeds are requested from the API server threads and invalidated from the event loop, all access
+    goes through a lock.
+    """
+
+    def __init__(self, db: ScheduleDatabase, cache_size: int = FEED_CACHE_SIZE, max_age: float | None = None):
+        self.db: ScheduleDatabase = db
+        self.cache_size: int = cache_size
+        self.max_age: timedelta | None = timedelta(seconds=max_age) if max_age is not None else None
+        self.feeds: OrderedDict[FeedFilter, RenderedFeed] = OrderedDict()
+        self.lock: threading.Lock = threading.Lock()
+        self.renders: int = 0
+        # Rendered entries by format and id, with the column values they were rendered from
+        self.rendered_entries: dict[tuple[str, int], tuple[dict[str, Any], Any]] = {}
+        self.entry_renders: int = 0
+
+    def _get_entries(self, feed_filter: FeedFilter, now: datetime) -> list[ScheduleEntry]:
+        start: datetime = now
+        if feed_filter.start_date is not None:
+            start = max(start, datetime.combine(feed_filter.start_date, datetime.min.time()))
+
+        # The unique key starts with start_datetime, the range is an index scan
+        statement = (
+            select(ScheduleEntry)
+            .where(ScheduleEntry.start_datetime >= start)
+            .order_by(ScheduleEntry.start_datetime, ScheduleEntry.location, ScheduleEntry.title)
+        )
+        if feed_filter.end_date is not None:
+            statement = statement.where(
+                ScheduleEntry.start_datetime <
+                datetime.combine(feed_filter.end_date + timedelta(days=1), datetime.min.time())
+            )
+        if feed_filter.location is not None:
+            statement = statement.where(ScheduleEntry.location == feed_filter.location)
+
+        with self.db.Session() as session:
+            entries: list[ScheduleEntry] = list(session.scalars(statement))
+            session.expunge_all()
+        return entries
+
+    def _get_rendered_entry(
+            self,
+            feed_format: str,
+            render_entry: Callable[[ScheduleEntry], Any],
+            entry: ScheduleEntry
+    ) -> Any:
+        values: dict[str, Any] = entry.to_values()
+        rendered_entry: tuple[dict[str, Any], Any] | None = self.rendered_entries.get((feed_format, entry.id))
+        if rendered_entry is not None and rendered_entry[0] == values:
+            return rendered_entry[1]
+
+        rendered: Any = render_entry(entry)
+        self.rendered_entries[(feed_format, entry.id)] = (values, rendered)
+        self.entry_renders += 1
+        return rendered
+
+    def _render(self, feed_filter: FeedFilter) -> RenderedFeed:
+        now: datetime = datetime.now()
+        entries: list[ScheduleEntry] = self._get_entries(feed_filter, now)
+        if feed_filter.format == 'ics':
+            body: bytes = render_ics(
+                entries,
+                datetime.now(timezone.utc),
+                lambda entry: self._get_rendered_entry('ics', render_ics_event, entry)
+            )
+        else:
+            body = render_json(entries, now, lambda entry: self._get_rendered_entry('json', render_json_entry, entry))
+        self.renders += 1
+        expires_at: datetime | None = entries[0].start_datetime if len(entries) > 0 else None
+        if self.max_age is not None:
+            expires_at = min(expires_at or datetime.max, now + self.max_age)
+        return RenderedFeed(
+            body=body,
+            etag=f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"',
+            content_type=FEED_CONTENT_TYPES[feed_filter.format],
+            expires_at=expires_at
+        )
+
+    def get(self, feed_filter: FeedFilter) -> RenderedFeed:
+        """
+        Get the feed of feed_filter, rendering it if it is not cached or stale.
+        """
+        with self.lock:
+            feed: RenderedFeed | None = self.feeds.get(feed_filter)
+            if feed is not None and (feed.expires_at is None or feed.expires_at > datetime.now()):
+                self.feeds.move_to_end(feed_filter)
+                return feed
+
+            feed = self._render(feed_filter)
+            self.feeds[feed_filter] = feed
+            self.feeds.move_to_end(feed_filter)
+            while len(self.feeds) > self.cache_size:
+                self.feeds.popitem(last=False)
+            return feed
+
+    def invalidate(self, locations: Iterable[str]) -> None:
+        """
+        Drop the cached feeds that include entries at locations, call after a check stored changes there.
+        Rendered entries that are no longer upcoming are dropped as well.
+        """
+        locations = set(locations)
+        with self.lock:
+            now: datetime = datetime.now()
+            for key in [key for key, (values, _) in self.rendered_entries.items() if values['start_datetime'] < now]:
+                del self.rendered_entries[key]
+            if len(locations) == 0:
+                return
+
+            for feed_filter in [feed_filter for feed_filter in self.feeds if feed_filter.matches_location(locations)]:
+                del self.feeds[feed_filter]
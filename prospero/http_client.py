@@ -0,0 +1,83 @@
+import asyncio
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import httpx
+
+from prospero.config import (
+    SCRAPER_TIMEOUT, HTTP_MAX_CONNECTIONS, HTTP_MAX_CONNECTIONS_PER_HOST, HTTP_KEEPALIVE_EXPIRY
+)
+
+USER_AGENT: str = 'prospero (+https://github.com/Nicba1010/prospero)'
+
+_client: httpx.Client | None = None
+
+
+def _get_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+    )
+
+
+def get_client() -> httpx.Client:
+    """
+    Get the process-wide pooled synchronous HTTP client, creating it on first use.
+    """
+    global _client
+    if _client is None:
+        _client = httpx.Client(
+            headers={'User-Agent': USER_AGENT},
+            timeout=SCRAPER_TIMEOUT,
+            limits=_get_limits(),
+            follow_redirects=True
+        )
+    return _client
+
+
+class AsyncHttpClient:
+    """
+    Long-lived pooled asynchronous HTTP client that keeps connections alive across checks
+    and limits the number of concurrent requests made to a single host.
+
+    Use as an async context manager, the connection pool is closed on exit. A transport replaces the
+    network, e.g. an httpx.MockTransport serving synthetic pages.
+    """
+
+    def __init__(
+            self,
+            max_connections_per_host: int = HTTP_MAX_CONNECTIONS_PER_HOST,
+            transport: httpx.AsyncBaseTransport | None = None
+    ):
+        self.client = httpx.AsyncClient(
+            headers={'User-Agent': USER_AGENT},
+            timeout=SCRAPER_TIMEOUT,
+            limits=_get_limits(),
+            follow_redirects=True,
+            transport=transport
+        )
+        self._host_semaphores: defaultdict[str, asyncio.Semaphore] = defaultdict(
+            lambda: asyncio.Semaphore(max_connections_per_host)
+        )
+
+    async def __aenter__(self) -> 'AsyncHttpClient':
+        await self.client.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.client.__aexit__(exc_type, exc_val, exc_tb)
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        async with self._host_semaphores[httpx.URL(url).host]:
+            return await self.client.request(method, url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        """
+        Send a request whose response body is read as it arrives, within the context.
+        """
+        async with self._host_semaphores[httpx.URL(url).host]:
+            async with self.client.stream(method, url, **kwargs) as response:
+                yield response
@@ -0,0 +1,80 @@
+from loguru import logger
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+from prospero.config import METRICS_PORT, METRICS_ADDRESS
+
+# Buckets of the latency histograms in seconds, from a cached lookup to a slow venue site
+LATENCY_BUCKETS: tuple[float, ...] = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'prospero_http_request_seconds', 'Time to fetch a schedule page', ['scraper'], buckets=LATENCY_BUCKETS
+)
+HTTP_RESPONSE_BYTES = Counter(
+    'prospero_http_response_bytes', 'Bytes of schedule page bodies received', ['scraper']
+)
+HTTP_RESPONSES = Counter(
+    'prospero_http_responses', 'Schedule page responses by status code', ['scraper', 'status_code']
+)
+RESPONSE_CACHE_LOOKUPS = Counter(
+    'prospero_response_cache_lookups', 'Response cache lookups by result (not_modified, same_content, miss)',
+    ['result']
+)
+PARSE_SECONDS = Histogram(
+    'prospero_parse_seconds', 'Time to parse a schedule page into entries', ['scraper'], buckets=LATENCY_BUCKETS
+)
+PARSED_ENTRIES = Counter(
+    'prospero_parsed_entries', 'Entries yielded by the scrapers', ['scraper']
+)
+SCRAPER_CHECKS = Counter(
+    'prospero_scraper_checks', 'Scraper checks by outcome (changed, unchanged, failed)', ['scraper', 'outcome']
+)
+DB_OPERATION_SECONDS = Histogram(
+    'prospero_db_operation_seconds', 'Time spent in database operations', ['operation'], buckets=LATENCY_BUCKETS
+)
+DB_TRANSACTIONS = Counter(
+    'prospero_db_transactions', 'Database transactions by outcome (commit, rollback)', ['outcome']
+)
+SCHEDULE_CHANGES = Counter(
+    'prospero_schedule_changes', 'Stored entries by kind of change (new, changed, cancelled)', ['scraper', 'kind']
+)
+CHECK_SECONDS = Histogram(
+    'prospero_check_seconds', 'Duration of a schedule check, from fetching to queueing notifications',
+    buckets=LATENCY_BUCKETS
+)
+NOTIFICATIONS_QUEUED = Counter(
+    'prospero_notifications_queued', 'Notifications added to the outbox'
+)
+NOTIFICATIONS_SENT = Counter(
+    'prospero_notifications_sent', 'Notifications delivered', ['chat_id']
+)
+NOTIFICATIONS_FAILED = Counter(
+    'prospero_notifications_failed', 'Failed notification send attempts', ['chat_id']
+)
+NOTIFICATION_SEND_SECONDS = Histogram(
+    'prospero_notification_send_seconds', 'Time to send a notification', ['chat_id'], buckets=LATENCY_BUCKETS
+)
+CHECK_INTERVAL_SECONDS = Gauge(
+    'prospero_check_interval_seconds', 'Current adaptive check interval of a scraper', ['scraper']
+)
+CIRCUIT_OPEN = Gauge(
+    'prospero_circuit_open', 'Whether the circuit of a scraper is open (1) or half open (0.5)', ['scraper']
+)
+LEASES_HELD = Gauge(
+    'prospero_leases_held', 'Scraper leases held by this replica'
+)
+LEASES_LOST = Counter(
+    'prospero_leases_lost', 'Scraper leases taken over by another replica while held by this one'
+)
+NOTIFICATION_CLAIMS_LOST = Counter(
+    'prospero_notification_claims_lost', 'Notifications claimed by another replica before this one marked them'
+)
+
+
+def start_metrics_server() -> None:
+    """
+    Serve /metrics on METRICS_ADDRESS:METRICS_PORT from a background thread, unless METRICS_PORT is empty.
+    """
+    if METRICS_PORT is None:
+        return
+    start_http_server(METRICS_PORT, addr=METRICS_ADDRESS)
+    logger.info(f'Serving metrics on http://{METRICS_ADDRESS}:{METRICS_PORT}/metrics')
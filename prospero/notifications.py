@@ -0,0 +1,125 @@
+from itertools import groupby
+
+from prospero.config import NOTIFICATION_DIGEST_ENABLED, NOTIFICATION_DIGEST_THRESHOLD
+from prospero.db import ScheduleEntry, ScheduleEntryRecord
+from prospero.diff import ScheduleChanges
+
+# Maximum length of a Telegram message
+TELEGRAM_MESSAGE_LIMIT: int = 4096
+
+DIGEST_HEADER: str = "🆕 *New performances*\n\n"
+
+CHANGED_FIELD_LABELS: dict[str, str] = {
+    'note': 'note',
+    'duration': 'duration',
+    'includes_break': 'break',
+    'buy_tickets_url': 'tickets',
+    'cancelled': 'no longer cancelled',
+}
+
+
+def format_new_entry(entry: ScheduleEntryRecord) -> str:
+    return entry.to_markdown()
+
+
+def format_changed_entry(entry: ScheduleEntry, changed_fields: list[str]) -> str:
+    changes: str = ', '.join(CHANGED_FIELD_LABELS.get(field, field) for field in changed_fields)
+    return f"✏️ *Changed:* {changes}\n\n{entry.to_markdown()}"
+
+
+def format_cancelled_entry(entry: ScheduleEntry) -> str:
+    return f"❌ *Cancelled*\n\n{entry.to_markdown()}"
+
+
+def _format_digest_line(entry: ScheduleEntryRecord, max_length: int) -> str:
+    """
+    Shorten a line that would be longer than max_length: the note is cut off, and the ticket link is
+    left out if even the date does not fit next to it, a cut link would break the markdown.
+    """
+    line: str = f"📅 {entry.start_datetime.strftime('%d. %B %Y (%A) %H:%M')}"
+    link: str = f" [🎫]({entry.buy_tickets_url})" if entry.buy_tickets_url else ''
+    if len(line) + len(link) > max_length:
+        link = ''
+    if entry.note:
+        note: str = f" 📝 {entry.note}"
+        note_length: int = max_length - len(line) - len(link)
+        if len(note) > note_length:
+            note = f"{note[:note_length - 1]}…" if note_length > len(" 📝 …") else ''
+        line += note
+    return line + link
+
+
+def _format_digest_blocks(entries: list[ScheduleEntryRecord], message_limit: int) -> list[str]:
+    """
+    One block per venue and title listing all of its dates, split into several blocks with the
+    same header if the dates don't fit into a single message.
+    """
+    blocks: list[str] = []
+    for (location, title), group_entries in groupby(
+            sorted(entries, key=lambda e: (e.location, e.title, e.start_datetime)),
+            key=lambda e: (e.location, e.title)
+    ):
+        header: str = f"📍 {location}\n🎭*{title}*🎭"
+        block: str = header
+        for entry in group_entries:
+            # Every line fits into a block of its own
+            line: str = _format_digest_line(entry, message_limit - len(header) - 1)
+            if len(block) + 1 + len(line) > message_limit:
+                blocks.append(block)
+                block = header
+            block += f"\n{line}"
+        blocks.append(block)
+    return blocks
+
+
+def format_new_entries_digest(
+        entries: list[ScheduleEntryRecord],
+        message_limit: int = TELEGRAM_MESSAGE_LIMIT
+) -> list[str]:
+    """
+    Collapse new entries into as few messages as possible, with repeat performances of a show
+    listed under a single venue and title heading.
+    """
+    body_limit: int = message_limit - len(DIGEST_HEADER)
+    blocks: list[str] = _format_digest_blocks(entries, body_limit)
+
+    messages: list[str] = []
+    message: str = ''
+    for block in blocks:
+        if len(message) > 0 and len(message) + 2 + len(block) > body_limit:
+            messages.append(message)
+            message = ''
+        message = f"{message}\n\n{block}" if len(message) > 0 else block
+    if len(message) > 0:
+        messages.append(message)
+
+    return [f"{DIGEST_HEADER}{message}" for message in messages]
+
+
+def format_new_entries(entries: list[ScheduleEntryRecord]) -> list[str]:
+    """
+    One message per new entry, or digests if digests are enabled and there are more than
+    NOTIFICATION_DIGEST_THRESHOLD new entries.
+    """
+    if NOTIFICATION_DIGEST_ENABLED and len(entries) > NOTIFICATION_DIGEST_THRESHOLD:
+        return format_new_entries_digest(entries)
+    return [format_new_entry(entry) for entry in sorted(entries, key=lambda e: e.start_datetime)]
+
+
+def format_schedule_changes(schedule_changes: ScheduleChanges) -> list[str]:
+    """
+    Messages about the new, changed and cancelled entries, in that order.
+    """
+    return (
+        format_new_entries(schedule_changes.new) +
+        [
+            format_changed_entry(entry, changed_fields)
+            for entry, changed_fields
+            in sorted(schedule_changes.changed, key=lambda change: change[0].start_datetime)
+        ] +
+        [
+            format_cancelled_entry(entry)
+            for entry
+            in sorted(schedule_changes.cancelled, key=lambda e: e.start_datetime)
+        ]
+    )
@@ -0,0 +1,75 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import TYPE_CHECKING
+
+import httpx
+from httpx import Response
+from loguru import logger
+
+from prospero.config import PARSE_PROCESSES
+from prospero.db import ScheduleEntryRecord
+
+if TYPE_CHECKING:
+    from prospero.schedule_scraper.base import BaseScheduleScraper
+
+_parse_pool: ProcessPoolExecutor | None = None
+
+
+def get_parse_pool() -> ProcessPoolExecutor | None:
+    """
+    Get the process-wide pool of PARSE_PROCESSES parse workers, creating it on first use.
+    None if PARSE_PROCESSES is 0.
+    """
+    global _parse_pool
+    if _parse_pool is None and PARSE_PROCESSES > 0:
+        # Forking a process that runs threads (HTTP client, metrics server) is unsafe, start workers fresh
+        _parse_pool = ProcessPoolExecutor(
+            max_workers=PARSE_PROCESSES,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+        logger.info(f'Parsing schedules in {PARSE_PROCESSES} worker processes')
+    return _parse_pool
+
+
+def _parse_schedule_records(
+        schedule_scraper: type['BaseScheduleScraper'],
+        method: str,
+        url: str,
+        content: bytes,
+        encoding: str | None
+) -> list[ScheduleEntryRecord]:
+    # Runs in a worker process, only the body goes in and only plain records come out
+    response: Response = Response(200, content=content, request=httpx.Request(method, url))
+    response.encoding = encoding
+    return schedule_scraper._parse_schedule_records(response)
+
+
+async def parse_in_pool(
+        parse_pool: ProcessPoolExecutor,
+        schedule_scraper: type['BaseScheduleScraper'],
+        response: Response
+) -> list[ScheduleEntryRecord]:
+    """
+    Parse a successful schedule response in a worker process of parse_pool.
+
+    A pool whose worker died is discarded so the next parse starts a new one.
+    """
+    try:
+        return await asyncio.get_running_loop().run_in_executor(
+            parse_pool,
+            _parse_schedule_records,
+            schedule_scraper,
+            response.request.method,
+            str(response.request.url),
+            response.content,
+            response.encoding
+        )
+    except BrokenProcessPool:
+        global _parse_pool
+        if _parse_pool is parse_pool:
+            logger.error('A parse worker process died, starting a new pool')
+            _parse_pool = None
+            parse_pool.shutdown(wait=False)
+        raise
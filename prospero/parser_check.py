@@ -0,0 +1,112 @@
+"""
+Check that a scraper produces the same schedule entries with another HTML parser as with html5lib.
+
+Usage:
+    python -m prospero.parser_check gavella --parser lxml [--file saved_schedule.html]
+
+Without --file the schedule is fetched live. Exits with status 1 if the entries differ.
+"""
+import argparse
+import sys
+from datetime import datetime
+from typing import Any
+
+import httpx
+from httpx import Response
+
+from prospero.db import ScheduleEntryRecord
+from prospero.schedule_scraper import SCHEDULE_SCRAPERS, load_schedule_scraper
+from prospero.schedule_scraper.base import BaseScheduleScraper
+
+REFERENCE_HTML_PARSER: str = 'html5lib'
+
+EntryFields = tuple[datetime, str, str | None, str, int | None, bool | None, str | None]
+
+
+def get_scraper_name(schedule_scraper: type[BaseScheduleScraper]) -> str:
+    return schedule_scraper.__module__.rsplit('.', 1)[-1]
+
+
+def entry_fields(entry: ScheduleEntryRecord) -> EntryFields:
+    return (
+        entry.start_datetime,
+        entry.title,
+        entry.note,
+        entry.location,
+        entry.duration,
+        entry.includes_break,
+        entry.buy_tickets_url
+    )
+
+
+def entry_sort_key(fields: EntryFields) -> tuple[tuple[bool, Any], ...]:
+    # Missing fields sort last, None does not compare with the values of other entries
+    return tuple((value is None, value) for value in fields)
+
+
+def parse_entry_fields(
+        schedule_scraper: type[BaseScheduleScraper],
+        response: Response,
+        html_parser: str
+) -> set[EntryFields]:
+    return set(
+        entry_fields(entry)
+        for entry
+        in schedule_scraper._parse_schedule_entries(schedule_scraper._parse_schedule_soup(response, html_parser))
+    )
+
+
+def compare_parsers(
+        schedule_scraper: type[BaseScheduleScraper],
+        response: Response,
+        html_parser: str
+) -> tuple[set[EntryFields], set[EntryFields]]:
+    """
+    Parse the same response with html5lib and html_parser.
+
+    Returns:
+        Entries only found with html5lib and entries only found with html_parser
+    """
+    reference: set[EntryFields] = parse_entry_fields(schedule_scraper, response, REFERENCE_HTML_PARSER)
+    candidate: set[EntryFields] = parse_entry_fields(schedule_scraper, response, html_parser)
+    return reference - candidate, candidate - reference
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('scraper', choices=sorted(SCHEDULE_SCRAPERS))
+    parser.add_argument('--parser', default='lxml', help='HTML parser to compare against html5lib')
+    parser.add_argument('--file', help='Saved schedule response to parse instead of fetching it')
+    parser.add_argument('--encoding', default=None, help='Encoding of --file, detected if omitted')
+    args = parser.parse_args()
+
+    schedule_scraper: type[BaseScheduleScraper] = load_schedule_scraper(args.scraper)
+
+    response: Response
+    if args.file is not None:
+        with open(args.file, 'rb') as f:
+            response = Response(
+                200,
+                content=f.read(),
+                request=httpx.Request('GET', args.file)
+            )
+        response.encoding = args.encoding
+    else:
+        response = schedule_scraper._get_schedule_response()
+
+    missing, unexpected = compare_parsers(schedule_scraper, response, args.parser)
+
+    for fields in sorted(missing, key=entry_sort_key):
+        print(f'Only with {REFERENCE_HTML_PARSER}: {fields}')
+    for fields in sorted(unexpected, key=entry_sort_key):
+        print(f'Only with {args.parser}: {fields}')
+
+    if missing or unexpected:
+        print(f'{schedule_scraper.__name__}: {args.parser} differs from {REFERENCE_HTML_PARSER}')
+        sys.exit(1)
+
+    print(f'{schedule_scraper.__name__}: {args.parser} matches {REFERENCE_HTML_PARSER}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+import asyncio
+import base64
+import gzip
+import hashlib
+import itertools
+import json
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator
+
+import httpx
+from httpx import Response
+from loguru import logger
+
+from prospero.config import RECORD_DIR, REPLAY_DIR, REPLAY_TIMING
+
+ARCHIVE_SUFFIX: str = '.json.gz'
+REPLAY_TIMINGS: tuple[str, ...] = ('fast', 'recorded')
+
+# The body is stored decoded, these headers would describe the encoded one
+_DROPPED_HEADERS: set[str] = {'content-encoding', 'content-length', 'transfer-encoding'}
+
+_recorder: 'ResponseRecorder | None' = None
+_replayer: 'ResponseReplayer | None' = None
+
+
+class ReplayError(Exception):
+    """Raised when there is no recorded response to replay for a scraper"""
+    pass
+
+
+@dataclass
+class RecordedResponse:
+    scraper: str
+    recorded_at: datetime
+    # Seconds the request took when it was recorded
+    elapsed: float
+    method: str
+    url: str
+    status_code: int
+    headers: list[tuple[str, str]]
+    encoding: str | None
+    content: bytes
+
+    @classmethod
+    def from_response(cls, scraper: str, response: Response) -> 'RecordedResponse':
+        try:
+            elapsed: float = response.elapsed.total_seconds()
+        except RuntimeError:
+            elapsed = 0.0
+
+        return cls(
+            scraper=scraper,
+            recorded_at=datetime.now(),
+            elapsed=elapsed,
+            method=response.request.method,
+            url=str(response.request.url),
+            status_code=response.status_code,
+            headers=[
+                (name, value)
+                for name, value
+                in response.headers.multi_items()
+                if name.lower() not in _DROPPED_HEADERS
+            ],
+            encoding=response.encoding,
+            content=response.content
+        )
+
+    def to_response(self) -> Response:
+        response: Response = Response(
+            self.status_code,
+            headers=self.headers,
+            content=self.content,
+            request=httpx.Request(self.method, self.url)
+        )
+        response.encoding = self.encoding
+        return response
+
+    def save(self, directory: Path) -> Path:
+        path: Path = directory / self.scraper / f'{self.recorded_at:%Y%m%dT%H%M%S%f}{ARCHIVE_SUFFIX}'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            json.dump({
+                'scraper': self.scraper,
+                'recorded_at': self.recorded_at.isoformat(),
+                'elapsed': self.elapsed,
+                'method': self.method,
+                'url': self.url,
+                'status_code': self.status_code,
+                'headers': self.headers,
+                'encoding': self.encoding,
+                'content': base64.b64encode(self.content).decode('ascii'),
+            }, f)
+        return path
+
+    @classmethod
+    def load(cls, path: Path) -> 'RecordedResponse':
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            archive: dict = json.load(f)
+        return cls(
+            scraper=archive['scraper'],
+            recorded_at=datetime.fromisoformat(archive['recorded_at']),
+            elapsed=archive['elapsed'],
+            method=archive['method'],
+            url=archive['url'],
+            status_code=archive['status_code'],
+            headers=[(name, value) for name, value in archive['headers']],
+            encoding=archive['encoding'],
+            content=base64.b64decode(archive['content'])
+        )
+
+
+def get_archive_paths(directory: Path, scraper: str) -> list[Path]:
+    """
+    Returns:
+        Archives recorded for scraper, oldest first
+    """
+    return sorted((directory / scraper).glob(f'*{ARCHIVE_SUFFIX}'))
+
+
+class ResponseRecorder:
+    """
+    Saves the schedule responses of every scraper under directory.
+
+    304 Not Modified responses and responses with the same body as the one last recorded for the
+    scraper are skipped, so only schedules worth replaying are stored.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory: Path = directory
+        self.content_hashes: dict[str, str] = {}
+
+    def record(self, scraper: str, response: Response) -> None:
+        if response.status_code == 304:
+            return
+
+        content_hash: str = hashlib.sha256(response.content).hexdigest()
+        if self.content_hashes.get(scraper) == content_hash:
+            return
+
+        try:
+            path: Path = RecordedResponse.from_response(scraper, response).save(self.directory)
+        except OSError as e:
+            logger.exception(f'Could not record the response of {scraper}', e)
+            return
+        self.content_hashes[scraper] = content_hash
+        logger.debug(f'Recorded the response of {scraper} to {path}')
+
+
+class ResponseReplayer:
+    """
+    Answers schedule requests with the responses recorded under directory, every scraper going through
+    its own archives in the order they were recorded and starting over once it reaches the end.
+
+    With the 'recorded' timing every response takes as long as the recorded request did, with 'fast'
+    responses are returned right away.
+    """
+
+    def __init__(self, directory: Path, timing: str = REPLAY_TIMING):
+        if timing not in REPLAY_TIMINGS:
+            raise ValueError(f'Unknown replay timing {timing}, expected one of {", ".join(REPLAY_TIMINGS)}')
+
+        self.directory: Path = directory
+        self.timing: str = timing
+        self.archive_paths: dict[str, Iterator[Path]] = {}
+
+    def _next_recorded_response(self, scraper: str) -> RecordedResponse:
+        archive_paths: Iterator[Path] | None = self.archive_paths.get(scraper)
+        if archive_paths is None:
+            paths: list[Path] = get_archive_paths(self.directory, scraper)
+            if len(paths) == 0:
+                raise ReplayError(f'No recorded responses of {scraper} in {self.directory}')
+            archive_paths = self.archive_paths[scraper] = itertools.cycle(paths)
+
+        path: Path = next(archive_paths)
+        logger.debug(f'Replaying {path} for {scraper}')
+        return RecordedResponse.load(path)
+
+    def _get_delay(self, recorded_response: RecordedResponse) -> float:
+        return recorded_response.elapsed if self.timing == 'recorded' else 0.0
+
+    def replay(self, scraper: str) -> Response:
+        recorded_response: RecordedResponse = self._next_recorded_response(scraper)
+        time.sleep(self._get_delay(recorded_response))
+        return recorded_response.to_response()
+
+    async def replay_async(self, scraper: str) -> Response:
+        recorded_response: RecordedResponse = await asyncio.to_thread(self._next_recorded_response, scraper)
+        await asyncio.sleep(self._get_delay(recorded_response))
+        return recorded_response.to_response()
+
+
+def get_response_recorder() -> ResponseRecorder | None:
+    """
+    Get the process-wide response recorder, None unless RECORD_DIR is set.
+    """
+    global _recorder
+    if _recorder is None and RECORD_DIR is not None:
+        _recorder = ResponseRecorder(RECORD_DIR)
+    return _recorder
+
+
+def get_response_replayer() -> ResponseReplayer | None:
+    """
+    Get the process-wide response replayer, None unless REPLAY_DIR is set.
+    """
+    global _replayer
+    if _replayer is None and REPLAY_DIR is not None:
+        _replayer = ResponseReplayer(REPLAY_DIR)
+    return _replayer
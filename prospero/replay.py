@@ -0,0 +1,62 @@
+"""
+Parse recorded schedule responses (see RECORD_DIR) offline, e.g. to reproduce a parse failure or to profile a scraper.
+
+Usage:
+    python -m prospero.replay recordings/ [--scraper gavella ...] [--parser lxml]
+    python -m cProfile -s cumulative -m prospero.replay recordings/ --scraper kerempuh
+
+Every archive of the given scrapers (all by default) is parsed in the order it was recorded, printing
+the number of entries and the parse time, or the traceback if parsing failed. Exits with status 1 if
+any archive could not be parsed.
+"""
+import argparse
+import sys
+import time
+import traceback
+from pathlib import Path
+
+from httpx import Response
+
+from prospero.db import ScheduleEntryRecord
+from prospero.recording import RecordedResponse, get_archive_paths
+from prospero.schedule_scraper import SCHEDULE_SCRAPERS, load_schedule_scraper
+from prospero.schedule_scraper.base import BaseScheduleScraper
+
+
+def replay_archive(
+        schedule_scraper: type[BaseScheduleScraper],
+        path: Path,
+        html_parser: str | None = None
+) -> list[ScheduleEntryRecord]:
+    response: Response = RecordedResponse.load(path).to_response()
+    return list(schedule_scraper._parse_schedule_entries(schedule_scraper._parse_schedule_soup(response, html_parser)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('directory', type=Path, help='RECORD_DIR the responses were recorded to')
+    parser.add_argument('--scraper', nargs='+', choices=sorted(SCHEDULE_SCRAPERS), default=sorted(SCHEDULE_SCRAPERS))
+    parser.add_argument('--parser', default=None, help='HTML parser to use instead of the configured one')
+    args = parser.parse_args()
+
+    failures: int = 0
+    for scraper_name in args.scraper:
+        schedule_scraper: type[BaseScheduleScraper] = load_schedule_scraper(scraper_name)
+        for path in get_archive_paths(args.directory, schedule_scraper.__name__):
+            started_at: float = time.perf_counter()
+            try:
+                entries: list[ScheduleEntryRecord] = replay_archive(schedule_scraper, path, args.parser)
+            except Exception:
+                failures += 1
+                print(f'{path}: failed')
+                traceback.print_exc()
+                continue
+            print(f'{path}: {len(entries)} entries in {time.perf_counter() - started_at:.3f} seconds')
+
+    if failures > 0:
+        print(f'{failures} recorded responses could not be parsed')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
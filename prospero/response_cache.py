@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+from dataclasses import dataclass, asdict
+from pathlib import Path
+
+from httpx import Response
+from loguru import logger
+
+from prospero.config import RESPONSE_CACHE_PATH
+from prospero.metrics import RESPONSE_CACHE_LOOKUPS
+
+
+@dataclass
+class CachedResponse:
+    etag: str | None = None
+    last_modified: str | None = None
+    content_hash: str | None = None
+
+
+class ResponseCache:
+    """
+    Per-scraper validators (ETag, Last-Modified and a hash of the body) of the last processed
+    schedule response, persisted as JSON so they survive restarts.
+
+    Validators of a response are only staged when it is seen, and written out by commit() once the
+    entries parsed from it have been stored. A failed check therefore never marks a schedule as seen.
+    """
+
+    def __init__(self, path: Path = RESPONSE_CACHE_PATH):
+        self.path: Path = path
+        self.entries: dict[str, CachedResponse] = {}
+        self.staged: dict[str, CachedResponse] = {}
+
+        self.not_modified_hits: int = 0
+        self.content_hash_hits: int = 0
+        self.misses: int = 0
+
+        if self.path.exists():
+            try:
+                self.entries = {
+                    key: CachedResponse(**value)
+                    for key, value
+                    in json.loads(self.path.read_text()).items()
+                }
+            except (ValueError, TypeError) as e:
+                logger.exception(f'Could not read response cache {self.path}, starting empty', e)
+
+    @property
+    def hits(self) -> int:
+        return self.not_modified_hits + self.content_hash_hits
+
+    @staticmethod
+    def get_content_hasher() -> 'hashlib._Hash':
+        """
+        Hasher of response bodies, for hashing a streamed body chunk by chunk.
+        """
+        return hashlib.sha256()
+
+    @classmethod
+    def _hash_content(cls, content: bytes) -> str:
+        content_hasher = cls.get_content_hasher()
+        content_hasher.update(content)
+        return content_hasher.hexdigest()
+
+    def get_conditional_headers(self, key: str) -> dict[str, str]:
+        cached_response: CachedResponse | None = self.entries.get(key)
+        if cached_response is None:
+            return {}
+
+        headers: dict[str, str] = {}
+        if cached_response.etag is not None:
+            headers['If-None-Match'] = cached_response.etag
+        if cached_response.last_modified is not None:
+            headers['If-Modified-Since'] = cached_response.last_modified
+        return headers
+
+    def is_unchanged(self, key: str, response: Response, content_hash: str | None = None) -> bool:
+        """
+        Check whether the response carries the same schedule that was last processed for key,
+        either because the server answered 304 Not Modified or because the body hashes the same.
+        Pass the content_hash of a streamed response, its body is not kept.
+
+        A changed response is staged and will be remembered on the next commit().
+        """
+        cached_response: CachedResponse | None = self.entries.get(key)
+
+        if response.status_code == 304 and cached_response is not None:
+            self.not_modified_hits += 1
+            RESPONSE_CACHE_LOOKUPS.labels('not_modified').inc()
+            return True
+
+        if not response.is_success:
+            # Leave error responses to the caller
+            return False
+
+        if content_hash is None:
+            content_hash = self._hash_content(response.content)
+        if cached_response is not None and cached_response.content_hash == content_hash:
+            self.content_hash_hits += 1
+            RESPONSE_CACHE_LOOKUPS.labels('same_content').inc()
+            return True
+
+        self.misses += 1
+        RESPONSE_CACHE_LOOKUPS.labels('miss').inc()
+        self.staged[key] = CachedResponse(
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified'),
+            content_hash=content_hash
+        )
+        return False
+
+    def discard(self, key: str) -> None:
+        """
+        Forget the staged validators for key, e.g. when its response could not be parsed.
+        """
+        self.staged.pop(key, None)
+
+    def forget(self, key: str) -> None:
+        """
+        Forget everything known about key, so its next response is processed even if it looks unchanged.
+        Needed when the schedule may have been processed elsewhere in the meantime, e.g. by another replica.
+        """
+        self.entries.pop(key, None)
+        self.staged.pop(key, None)
+
+    def rollback(self) -> None:
+        """
+        Forget all staged validators, e.g. when storing the entries of a check failed.
+        """
+        self.staged.clear()
+
+    def commit(self) -> None:
+        if len(self.staged) == 0:
+            return
+
+        self.entries.update(self.staged)
+        self.staged.clear()
+
+        temporary_path: Path = self.path.with_suffix(f'{self.path.suffix}.tmp')
+        temporary_path.write_text(json.dumps(
+            {key: asdict(value) for key, value in self.entries.items()},
+            indent=2
+        ))
+        os.replace(temporary_path, self.path)
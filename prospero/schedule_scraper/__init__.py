@@ -0,0 +1,34 @@
+import importlib
+from typing import TYPE_CHECKING, Iterable
+
+if TYPE_CHECKING:
+    from prospero.schedule_scraper.base import BaseScheduleScraper
+
+# Every scraper by name, as module:class so a scraper's module is only imported when it is loaded
+SCHEDULE_SCRAPERS: dict[str, str] = {
+    'kerempuh': 'prospero.schedule_scraper.kerempuh:KerempuhScheduleScraper',
+    'komedija': 'prospero.schedule_scraper.komedija:KomedijaScheduleScraper',
+    'gavella': 'prospero.schedule_scraper.gavella:GavellaScheduleScraper',
+    'luda_kuca': 'prospero.schedule_scraper.luda_kuca:LudaKucaScheduleScraper',
+    'teatar_exit': 'prospero.schedule_scraper.teatar_exit:TeatarExitScheduleScraper',
+    # Add new scrapers here
+}
+
+
+def load_schedule_scraper(name: str) -> type['BaseScheduleScraper']:
+    """
+    Raises:
+        KeyError: If there is no scraper called name
+    """
+    module_name, class_name = SCHEDULE_SCRAPERS[name].split(':')
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def load_schedule_scrapers(names: Iterable[str] | None = None) -> list[type['BaseScheduleScraper']]:
+    """
+    Load the scrapers called names, every scraper if names is None.
+
+    Raises:
+        KeyError: If there is no scraper called one of names
+    """
+    return [load_schedule_scraper(name) for name in (SCHEDULE_SCRAPERS if names is None else names)]
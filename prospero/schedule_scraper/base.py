@@ -1,15 +1,50 @@
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
-from typing import Generator
+from typing import Any, Generator
 
-import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer, Tag
+from httpx import Response
 from loguru import logger
-from requests import Response
+from lxml import etree
 
-from prospero.db import ScheduleEntry
+from prospero.config import HTML_PARSER, STREAM_PARSING
+from prospero.db import ScheduleEntryRecord
+from prospero.http_client import AsyncHttpClient, get_client
+from prospero.metrics import HTTP_REQUEST_SECONDS, HTTP_RESPONSES, HTTP_RESPONSE_BYTES, PARSE_SECONDS, PARSED_ENTRIES
+from prospero.parse_pool import get_parse_pool, parse_in_pool
+from prospero.recording import ResponseRecorder, ResponseReplayer, get_response_recorder, get_response_replayer
+from prospero.response_cache import ResponseCache
+from prospero.schedule_scraper.streaming import (
+    STREAM_CHUNK_SIZE, TABLE_HEADER_TAG, ElementSpec, ScheduleRowStream, to_tag
+)
+
+
+class ScheduleNotModified(Exception):
+    """Raised when a schedule has not changed since it was last processed"""
+    pass
 
 
 class BaseScheduleScraper(object):
+    # BeautifulSoup tree builder for this scraper, None uses the globally configured HTML_PARSER
+    HTML_PARSER: str | None = None
+    # Tree builders this scraper's parsing has been checked against (see prospero.parser_check),
+    # any other builder falls back to html5lib as it is the one every scraper was written for
+    VALIDATED_HTML_PARSERS: tuple[str, ...] = ('html5lib',)
+    # Bounds of this scraper's adaptive check interval in seconds, None uses the global bounds
+    MIN_CHECK_INTERVAL: float | None = None
+    MAX_CHECK_INTERVAL: float | None = None
+    # Rows of the schedule page, each one parsed into an entry by _parse_schedule_row. Scrapers that set
+    # it and are validated against lxml can parse their page while it downloads, see STREAM_PARSING
+    SCHEDULE_ROW: ElementSpec | None = None
+    # First element the rows are in, None takes rows from the whole page
+    SCHEDULE_ROW_CONTAINER: ElementSpec | None = None
+    # Rows at the start of the container that are not entries, e.g. a header row outside of a thead
+    SCHEDULE_HEADER_ROWS: int = 0
+
+    _unvalidated_html_parser_warned: bool = False
+
     @classmethod
     def _assign_year(cls, entry_datetime: datetime) -> datetime:
         # Get current date
@@ -45,27 +80,297 @@ class BaseScheduleScraper(object):
     def _get_schedule_url(cls) -> str:
         raise NotImplementedError
 
+    @classmethod
+    def _get_schedule_request(cls) -> dict[str, Any]:
+        """
+        Keyword arguments describing the schedule request, shared by the sync and async clients.
+        """
+        return {
+            'method': 'GET',
+            'url': cls._get_schedule_url()
+        }
+
     @classmethod
     def _get_schedule_response(cls) -> Response:
-        return requests.get(cls._get_schedule_url())
+        """
+        Fetch the schedule, or replay a recorded response if REPLAY_DIR is set. Fetched responses are
+        recorded if RECORD_DIR is set.
+        """
+        replayer: ResponseReplayer | None = get_response_replayer()
+        if replayer is not None:
+            return replayer.replay(cls.__name__)
+
+        response: Response = get_client().request(**cls._get_schedule_request())
+        recorder: ResponseRecorder | None = get_response_recorder()
+        if recorder is not None:
+            recorder.record(cls.__name__, response)
+        return response
 
     @classmethod
-    def _get_schedule_soup(cls) -> BeautifulSoup:
-        response: Response = cls._get_schedule_response()
+    async def _get_schedule_response_async(
+            cls,
+            client: AsyncHttpClient,
+            headers: dict[str, str] | None = None
+    ) -> Response:
+        """
+        Same as _get_schedule_response, without blocking the event loop.
+        """
+        replayer: ResponseReplayer | None = get_response_replayer()
+        if replayer is not None:
+            return await replayer.replay_async(cls.__name__)
+
+        request: dict[str, Any] = cls._get_schedule_request()
+        if headers:
+            request['headers'] = {**request.get('headers', {}), **headers}
+        with HTTP_REQUEST_SECONDS.labels(cls.__name__).time():
+            response: Response = await client.request(**request)
+        HTTP_RESPONSES.labels(cls.__name__, response.status_code).inc()
+        HTTP_RESPONSE_BYTES.labels(cls.__name__).inc(len(response.content))
+
+        recorder: ResponseRecorder | None = get_response_recorder()
+        if recorder is not None:
+            await asyncio.to_thread(recorder.record, cls.__name__, response)
+        return response
+
+    @classmethod
+    def _get_html_parser(cls) -> str:
+        html_parser: str = cls.HTML_PARSER or HTML_PARSER
+        if html_parser not in cls.VALIDATED_HTML_PARSERS:
+            if not cls._unvalidated_html_parser_warned:
+                logger.warning(
+                    f'{cls.__name__} has not been validated against the {html_parser} parser, using html5lib'
+                )
+                cls._unvalidated_html_parser_warned = True
+            html_parser = 'html5lib'
+        return html_parser
+
+    @classmethod
+    def _get_schedule_strainer(cls) -> SoupStrainer | None:
+        """
+        The part of the schedule page this scraper reads, only that part is built into the soup.
+        None builds the whole page.
+        """
+        return None
+
+    @classmethod
+    def _parse_schedule_soup(cls, response: Response, html_parser: str | None = None) -> BeautifulSoup:
         response.raise_for_status()
+        html_parser = html_parser or cls._get_html_parser()
         return BeautifulSoup(
             response.content,
-            features='html5lib',
-            from_encoding=response.encoding
+            features=html_parser,
+            from_encoding=response.encoding,
+            # html5lib always builds the whole tree and warns about parse_only
+            parse_only=cls._get_schedule_strainer() if html_parser != 'html5lib' else None
         )
 
     @classmethod
-    def get_active_schedule_entries(cls) -> Generator[ScheduleEntry, None, None]:
+    def _get_schedule_soup(cls) -> BeautifulSoup:
+        return cls._parse_schedule_soup(cls._get_schedule_response())
+
+    @staticmethod
+    def _get_element_attrs(element_spec: ElementSpec) -> dict[str, str]:
+        _, css_class = element_spec
+        return {'class': css_class} if css_class is not None else {}
+
+    @classmethod
+    def _find_schedule_rows(cls, schedule_soup: BeautifulSoup) -> list[Tag]:
+        row_scope: Tag = schedule_soup
+        if cls.SCHEDULE_ROW_CONTAINER is not None:
+            row_scope = schedule_soup.find(
+                cls.SCHEDULE_ROW_CONTAINER[0],
+                cls._get_element_attrs(cls.SCHEDULE_ROW_CONTAINER)
+            )
+        rows: list[Tag] = [
+            row
+            for row
+            in row_scope.find_all(cls.SCHEDULE_ROW[0], cls._get_element_attrs(cls.SCHEDULE_ROW))
+            if row.find_parent(TABLE_HEADER_TAG) is None
+        ]
+        return rows[cls.SCHEDULE_HEADER_ROWS:]
+
+    @classmethod
+    def _parse_schedule_row(cls, row: Tag) -> ScheduleEntryRecord:
         raise NotImplementedError
 
     @classmethod
-    def try_get_active_schedule_entries(cls) ->  Generator[ScheduleEntry, None, None]:
+    def _parse_schedule_entries(cls, schedule_soup: BeautifulSoup) -> Generator[ScheduleEntryRecord, None, None]:
+        for row in cls._find_schedule_rows(schedule_soup):
+            yield cls._parse_schedule_row(row)
+
+    @classmethod
+    def _parse_schedule_records(cls, response: Response) -> list[ScheduleEntryRecord]:
+        return list(cls._parse_schedule_entries(cls._parse_schedule_soup(response)))
+
+    @classmethod
+    def _can_stream(cls) -> bool:
+        """
+        Whether the schedule is parsed while it downloads. Recorded and replayed responses are always
+        read whole.
+        """
+        return (
+            STREAM_PARSING and
+            cls.SCHEDULE_ROW is not None and
+            'lxml' in cls.VALIDATED_HTML_PARSERS and
+            get_response_replayer() is None and
+            get_response_recorder() is None
+        )
+
+    @classmethod
+    def _parse_schedule_element(cls, row: etree._Element) -> ScheduleEntryRecord:
+        """
+        Parse a streamed row, re-parsed into a Tag for _parse_schedule_row unless a scraper reads lxml elements.
+        """
+        return cls._parse_schedule_row(to_tag(row))
+
+    @classmethod
+    def _get_row_stream(cls, encoding: str | None) -> ScheduleRowStream:
+        return ScheduleRowStream(
+            cls.SCHEDULE_ROW,
+            cls.SCHEDULE_ROW_CONTAINER,
+            cls.SCHEDULE_HEADER_ROWS,
+            encoding,
+            parse_row=cls._parse_schedule_element
+        )
+
+    @classmethod
+    def _stream_schedule_entries(cls) -> Generator[ScheduleEntryRecord, None, None]:
+        with get_client().stream(**cls._get_schedule_request()) as response:
+            response.raise_for_status()
+            row_stream: ScheduleRowStream = cls._get_row_stream(response.encoding)
+            for chunk in response.iter_bytes(STREAM_CHUNK_SIZE):
+                yield from row_stream.feed(chunk)
+            yield from row_stream.close()
+
+    @classmethod
+    def get_active_schedule_entries(cls) -> Generator[ScheduleEntryRecord, None, None]:
+        """
+        Entries of the schedule, yielded while it downloads if it is streamed.
+        """
+        if cls._can_stream():
+            yield from cls._stream_schedule_entries()
+        else:
+            yield from cls._parse_schedule_entries(cls._get_schedule_soup())
+
+    @classmethod
+    def try_get_active_schedule_entries(cls) ->  Generator[ScheduleEntryRecord, None, None]:
         try:
             yield from cls.get_active_schedule_entries()
         except Exception as e:
             logger.exception(f'Exception occurred while running {cls}', e)
+
+    @classmethod
+    async def get_active_schedule_entries_async(
+            cls,
+            client: AsyncHttpClient,
+            response_cache: ResponseCache | None = None
+    ) -> list[ScheduleEntryRecord]:
+        """
+        Fetch and parse the schedule without blocking the event loop, in a worker process if
+        PARSE_PROCESSES is set.
+
+        Raises:
+            ScheduleNotModified: If response_cache shows the schedule is the same as last processed
+        """
+        cache_key: str = cls.__name__
+        headers: dict[str, str] | None = None
+        # Conditional headers are only meaningful for plain GET schedule pages
+        if response_cache is not None and cls._get_schedule_request()['method'] == 'GET':
+            headers = response_cache.get_conditional_headers(cache_key)
+
+        if cls._can_stream():
+            return await cls._stream_schedule_records_async(client, response_cache, headers)
+
+        response: Response = await cls._get_schedule_response_async(client, headers)
+        if response_cache is not None and response_cache.is_unchanged(cache_key, response):
+            raise ScheduleNotModified
+
+        try:
+            # Parsing is CPU bound, keep it off the event loop so other fetches can progress
+            with PARSE_SECONDS.labels(cls.__name__).time():
+                entries: list[ScheduleEntryRecord]
+                parse_pool: ProcessPoolExecutor | None = get_parse_pool()
+                if parse_pool is None:
+                    entries = await asyncio.to_thread(cls._parse_schedule_records, response)
+                else:
+                    response.raise_for_status()
+                    entries = await parse_in_pool(parse_pool, cls, response)
+            PARSED_ENTRIES.labels(cls.__name__).inc(len(entries))
+            return entries
+        except BaseException:
+            if response_cache is not None:
+                response_cache.discard(cache_key)
+            raise
+
+    @classmethod
+    async def _stream_schedule_records_async(
+            cls,
+            client: AsyncHttpClient,
+            response_cache: ResponseCache | None,
+            headers: dict[str, str] | None
+    ) -> list[ScheduleEntryRecord]:
+        """
+        Parse the schedule chunk by chunk while it downloads, the body is never held in memory whole.
+
+        The body is hashed as it streams, so an unchanged body is only detected once it has been parsed.
+        Parsing is timed as PARSE_SECONDS, the rest of the time the stream took as HTTP_REQUEST_SECONDS.
+
+        Raises:
+            ScheduleNotModified: If response_cache shows the schedule is the same as last processed
+        """
+        request: dict[str, Any] = cls._get_schedule_request()
+        if headers:
+            request['headers'] = {**request.get('headers', {}), **headers}
+
+        entries: list[ScheduleEntryRecord] = []
+        parse_seconds: float = 0.0
+        # Parsing holds up the stream, its time including the hand-off to the parse thread is not request time
+        parse_wait_seconds: float = 0.0
+
+        def parse_chunk(row_stream: ScheduleRowStream, chunk: bytes | None) -> None:
+            nonlocal parse_seconds
+            started_at: float = time.perf_counter()
+            entries.extend(row_stream.feed(chunk) if chunk is not None else row_stream.close())
+            parse_seconds += time.perf_counter() - started_at
+
+        async def parse_in_executor(
+                parse_executor: ThreadPoolExecutor,
+                row_stream: ScheduleRowStream,
+                chunk: bytes | None
+        ) -> None:
+            nonlocal parse_wait_seconds
+            started_at: float = time.perf_counter()
+            await asyncio.get_running_loop().run_in_executor(parse_executor, parse_chunk, row_stream, chunk)
+            parse_wait_seconds += time.perf_counter() - started_at
+
+        stream_started_at: float = time.perf_counter()
+        try:
+            async with client.stream(**request) as response:
+                HTTP_RESPONSES.labels(cls.__name__, response.status_code).inc()
+                if response.status_code == 304 and response_cache is not None:
+                    if response_cache.is_unchanged(cls.__name__, response):
+                        raise ScheduleNotModified
+                response.raise_for_status()
+
+                content_hasher = ResponseCache.get_content_hasher()
+                row_stream: ScheduleRowStream = cls._get_row_stream(response.encoding)
+                # Parsing is CPU bound, keep it off the event loop so other fetches can progress. An lxml
+                # parser must stay on the thread it started on, so each stream gets a thread of its own
+                with ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'{cls.__name__}-parse') as parse_executor:
+                    async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+                        content_hasher.update(chunk)
+                        HTTP_RESPONSE_BYTES.labels(cls.__name__).inc(len(chunk))
+                        await parse_in_executor(parse_executor, row_stream, chunk)
+                    await parse_in_executor(parse_executor, row_stream, None)
+        finally:
+            HTTP_REQUEST_SECONDS.labels(cls.__name__).observe(
+                time.perf_counter() - stream_started_at - parse_wait_seconds
+            )
+
+        PARSE_SECONDS.labels(cls.__name__).observe(parse_seconds)
+        if response_cache is not None and response_cache.is_unchanged(
+                cls.__name__, response, content_hash=content_hasher.hexdigest()
+        ):
+            raise ScheduleNotModified
+        PARSED_ENTRIES.labels(cls.__name__).inc(len(entries))
+        return entries
@@ -0,0 +1,371 @@
+import re
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import cache
+from typing import Any, Callable, Iterator, Mapping
+
+from bs4 import SoupStrainer, Tag
+from lxml import etree
+
+from prospero.db import ScheduleEntryRecord
+from prospero.schedule_scraper.base import BaseScheduleScraper
+from prospero.schedule_scraper.streaming import ElementSpec
+
+# Row values passed on to the ScheduleEntryRecord, any other value only feeds the start or an override
+ENTRY_FIELDS: frozenset[str] = frozenset(
+    ('title', 'note', 'location', 'duration', 'includes_break', 'buy_tickets_url')
+)
+
+# strptime directives a DateTimeFormat supports, as the datetime argument and pattern they match
+_DATETIME_DIRECTIVES: dict[str, tuple[str, str]] = {
+    'd': ('day', r'\d{1,2}'),
+    'm': ('month', r'\d{1,2}'),
+    'Y': ('year', r'\d{4}'),
+    'H': ('hour', r'\d{1,2}'),
+    'M': ('minute', r'\d{1,2}'),
+}
+# tag, tag.class.class or either with [n], the n-th match counting from 0
+_SELECTOR_STEP_PATTERN: re.Pattern = re.compile(r'(?P<tag>[\w-]+)(?P<classes>(?:\.[\w-]+)*)(?:\[(?P<index>\d+)])?')
+
+# An element spec and which of its matches, in document order, is taken
+SelectorStep = tuple[ElementSpec, int]
+# Text inside these elements is not part of the text of their parents, same as BeautifulSoup
+NON_TEXT_TAGS: frozenset[str] = frozenset(('script', 'style', 'template'))
+
+
+class DateTimeFormat:
+    """
+    A strptime format compiled once into a regular expression, parsing with it skips the format lookup
+    and locale checks strptime does on every call. Supports %d, %m, %Y, %H, %M and %%.
+    """
+
+    def __init__(self, datetime_format: str):
+        self.format: str = datetime_format
+        pattern: list[str] = []
+        position: int = 0
+        while position < len(datetime_format):
+            character: str = datetime_format[position]
+            if character == '%':
+                directive: str = datetime_format[position + 1:position + 2]
+                if directive == '%':
+                    pattern.append('%')
+                elif directive in _DATETIME_DIRECTIVES:
+                    name, directive_pattern = _DATETIME_DIRECTIVES[directive]
+                    pattern.append(f'(?P<{name}>{directive_pattern})')
+                else:
+                    raise ValueError(f'Unsupported directive %{directive} in {datetime_format!r}')
+                position += 2
+            elif character.isspace():
+                # Same as strptime, whitespace in the format matches any run of whitespace
+                pattern.append(r'\s+')
+                while position < len(datetime_format) and datetime_format[position].isspace():
+                    position += 1
+            else:
+                pattern.append(re.escape(character))
+                position += 1
+
+        try:
+            self.pattern: re.Pattern = re.compile(''.join(pattern), re.IGNORECASE)
+        except re.error as e:
+            raise ValueError(f'Invalid format {datetime_format!r}: {e}') from e
+        self.has_year: bool = 'year' in self.pattern.groupindex
+
+    def parse(self, value: str) -> datetime:
+        """
+        Raises:
+            ValueError: If value does not match the format or is not a valid datetime
+        """
+        match: re.Match | None = self.pattern.fullmatch(value)
+        if match is None:
+            raise ValueError(f'{value!r} does not match format {self.format!r}')
+        return datetime(**{'year': 1900, 'month': 1, 'day': 1, **{
+            name: int(number) for name, number in match.groupdict().items()
+        }})
+
+
+@cache
+def get_datetime_format(datetime_format: str) -> DateTimeFormat:
+    return DateTimeFormat(datetime_format)
+
+
+def none_if_empty(value: str) -> str | None:
+    return value if len(value) > 0 else None
+
+
+@dataclass(frozen=True, slots=True)
+class MonthNames:
+    """
+    Transform of a month name into its number, names are matched by their first prefix_length letters
+    after lowercasing them and applying replacements.
+    """
+    numbers: Mapping[str, int]
+    prefix_length: int = 3
+    replacements: Mapping[str, str] = field(default_factory=dict)
+
+    def __call__(self, name: str) -> int:
+        normalized_name: str = name.lower()
+        for old, new in self.replacements.items():
+            normalized_name = normalized_name.replace(old, new)
+        return self.numbers[normalized_name[:self.prefix_length]]
+
+
+@dataclass(frozen=True, slots=True)
+class ScheduleField:
+    """
+    Where and how a value is read from a schedule row.
+
+    The selector is a space separated chain of steps, each finding the first tag.class.class inside
+    the previous step's element, or its n-th match counting from 0 with tag[n]. A None selector reads
+    the row itself. The value is the element's stripped text, the list of its stripped strings if
+    strings is set or the value of attribute, passed through transform if there is one.
+    """
+    selector: str | None
+    attribute: str | None = None
+    strings: bool = False
+    transform: Callable[[Any], Any] | None = None
+    # Missing optional values are default, missing required ones fail the row
+    optional: bool = False
+    default: Any = None
+
+
+def _parse_selector(selector: str | None) -> tuple[SelectorStep, ...]:
+    """
+    Raises:
+        ValueError: If selector is not a chain of tag.class[n] steps
+    """
+    if selector is None:
+        return ()
+    steps: list[SelectorStep] = []
+    for step in selector.split():
+        match: re.Match | None = _SELECTOR_STEP_PATTERN.fullmatch(step)
+        if match is None:
+            raise ValueError(f'Invalid step {step!r} in selector {selector!r}')
+        css_class: str = ' '.join(match['classes'].split('.')[1:])
+        steps.append(((match['tag'], css_class or None), int(match['index'] or 0)))
+    return tuple(steps)
+
+
+def _has_class(element: Tag | etree._Element, css_class: str) -> bool:
+    # Same as BeautifulSoup: the class matches one of the element's classes or its whole class attribute
+    element_classes: list[str] | str | None = element.get('class')
+    if element_classes is None:
+        return False
+    if isinstance(element_classes, str):
+        element_classes = element_classes.split()
+    return css_class in element_classes or ' '.join(element_classes) == css_class
+
+
+class _TagReader:
+    """
+    How an ExtractionPlan reads a BeautifulSoup Tag.
+    """
+
+    @staticmethod
+    def iter_descendants(element: Tag) -> Iterator[Tag]:
+        return (descendant for descendant in element.descendants if isinstance(descendant, Tag))
+
+    @staticmethod
+    def get_tag(element: Tag) -> str:
+        return element.name
+
+    @staticmethod
+    def get_text(element: Tag) -> str:
+        return element.text
+
+    @staticmethod
+    def get_stripped_strings(element: Tag) -> list[str]:
+        return list(element.stripped_strings)
+
+
+class _ElementReader:
+    """
+    How an ExtractionPlan reads an lxml element, with the same results as _TagReader for the same HTML.
+    """
+
+    @staticmethod
+    def iter_descendants(element: etree._Element) -> Iterator[etree._Element]:
+        # Leaves out comments and processing instructions
+        return element.iterdescendants(etree.Element)
+
+    @staticmethod
+    def get_tag(element: etree._Element) -> str:
+        return element.tag
+
+    @classmethod
+    def iter_strings(cls, element: etree._Element) -> Iterator[str]:
+        if element.text:
+            yield element.text
+        for child in element:
+            if isinstance(child.tag, str) and child.tag not in NON_TEXT_TAGS:
+                yield from cls.iter_strings(child)
+            if child.tail:
+                yield child.tail
+
+    @classmethod
+    def get_text(cls, element: etree._Element) -> str:
+        return ''.join(cls.iter_strings(element))
+
+    @classmethod
+    def get_stripped_strings(cls, element: etree._Element) -> list[str]:
+        return [stripped for stripped in (string.strip() for string in cls.iter_strings(element)) if stripped]
+
+
+# Reader of the kind of rows being extracted
+_RowReader = type[_TagReader] | type[_ElementReader]
+
+
+class _PlanNode:
+    def __init__(self, step: SelectorStep | None):
+        self.step: SelectorStep | None = step
+        self.fields: list[tuple[str, ScheduleField]] = []
+        self.children: dict[SelectorStep, _PlanNode] = {}
+        # Children by tag, so every descendant is only checked against steps it could match
+        self.children_by_tag: dict[str, list[_PlanNode]] = {}
+
+    def add_child(self, step: SelectorStep) -> '_PlanNode':
+        if step not in self.children:
+            self.children[step] = _PlanNode(step)
+            self.children_by_tag.setdefault(step[0][0], []).append(self.children[step])
+        return self.children[step]
+
+
+class ExtractionPlan:
+    """
+    The fields of a scraper compiled into a tree of selector steps. Fields sharing a selector prefix
+    share its steps, and the steps inside an element are all found in a single walk of its descendants,
+    so no part of a row is searched twice. Rows are BeautifulSoup Tags or, when streamed, lxml elements.
+    """
+
+    def __init__(self, fields: Mapping[str, ScheduleField]):
+        """
+        Raises:
+            ValueError: If the selector of one of fields is invalid
+        """
+        self.root: _PlanNode = _PlanNode(None)
+        for name, schedule_field in fields.items():
+            node: _PlanNode = self.root
+            for step in _parse_selector(schedule_field.selector):
+                node = node.add_child(step)
+            node.fields.append((name, schedule_field))
+
+    @staticmethod
+    def _find_children(node: _PlanNode, element: Any, reader: _RowReader) -> dict[_PlanNode, Any]:
+        found: dict[_PlanNode, Any] = {}
+        match_counts: dict[_PlanNode, int] = {}
+        for descendant in reader.iter_descendants(element):
+            for child in node.children_by_tag.get(reader.get_tag(descendant), ()):
+                if child in found:
+                    continue
+                (_, css_class), index = child.step
+                if css_class is not None and not _has_class(descendant, css_class):
+                    continue
+                match_count: int = match_counts.get(child, 0)
+                if match_count == index:
+                    found[child] = descendant
+                    if len(found) == len(node.children):
+                        return found
+                else:
+                    match_counts[child] = match_count + 1
+        return found
+
+    @staticmethod
+    def _get_missing(name: str, schedule_field: ScheduleField) -> Any:
+        if not schedule_field.optional:
+            raise ValueError(f'Schedule row has no {name} ({schedule_field.selector})')
+        return schedule_field.default
+
+    @classmethod
+    def _read(cls, element: Any, reader: _RowReader, name: str, schedule_field: ScheduleField) -> Any:
+        value: Any
+        if schedule_field.attribute is not None:
+            value = element.get(schedule_field.attribute)
+            if value is None:
+                return cls._get_missing(name, schedule_field)
+        elif schedule_field.strings:
+            value = reader.get_stripped_strings(element)
+        else:
+            value = reader.get_text(element).strip()
+        return schedule_field.transform(value) if schedule_field.transform is not None else value
+
+    @classmethod
+    def _set_missing(cls, node: _PlanNode, values: dict[str, Any]) -> None:
+        for name, schedule_field in node.fields:
+            values[name] = cls._get_missing(name, schedule_field)
+        for child in node.children.values():
+            cls._set_missing(child, values)
+
+    @classmethod
+    def _extract(cls, node: _PlanNode, element: Any, reader: _RowReader, values: dict[str, Any]) -> None:
+        for name, schedule_field in node.fields:
+            values[name] = cls._read(element, reader, name, schedule_field)
+        if len(node.children) == 0:
+            return
+        found: dict[_PlanNode, Any] = cls._find_children(node, element, reader)
+        for child in node.children.values():
+            if child in found:
+                cls._extract(child, found[child], reader, values)
+            else:
+                cls._set_missing(child, values)
+
+    def extract(self, row: Tag | etree._Element) -> dict[str, Any]:
+        """
+        Raises:
+            ValueError: If a required field is missing from row
+        """
+        values: dict[str, Any] = {}
+        self._extract(self.root, row, _TagReader if isinstance(row, Tag) else _ElementReader, values)
+        return values
+
+
+class DeclarativeScheduleScraper(BaseScheduleScraper):
+    """
+    A scraper described by the rows of its schedule and the fields read from each of them, compiled
+    once into an ExtractionPlan when the class is defined.
+
+    Fields named after ScheduleEntryRecord fields are passed to the entry, the start is parsed from
+    the SCHEDULE_START_FIELDS joined with spaces. Overriding _build_schedule_entry allows values
+    derived from several fields.
+    """
+    # Values read from every schedule row by name
+    SCHEDULE_FIELDS: dict[str, ScheduleField] = {}
+    # Values joined with spaces into the start of the entry, and their format. Without %Y the year
+    # is assigned by _assign_year
+    SCHEDULE_START_FIELDS: tuple[str, ...] = ('date', 'time')
+    SCHEDULE_START_FORMAT: str = '%d.%m. %H:%M'
+    # Location of every entry, for venues whose rows do not name one
+    SCHEDULE_LOCATION: str | None = None
+
+    _extraction_plan: ExtractionPlan
+    _start_format: DateTimeFormat
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._extraction_plan = ExtractionPlan(cls.SCHEDULE_FIELDS)
+        cls._start_format = get_datetime_format(cls.SCHEDULE_START_FORMAT)
+
+    @classmethod
+    def _get_schedule_strainer(cls) -> SoupStrainer | None:
+        element_spec: ElementSpec | None = cls.SCHEDULE_ROW_CONTAINER or cls.SCHEDULE_ROW
+        if element_spec is None:
+            return None
+        return SoupStrainer(element_spec[0], cls._get_element_attrs(element_spec))
+
+    @classmethod
+    def _build_schedule_entry(cls, values: dict[str, Any]) -> ScheduleEntryRecord:
+        start_datetime: datetime = cls._start_format.parse(
+            ' '.join(str(values[name]) for name in cls.SCHEDULE_START_FIELDS)
+        )
+        if not cls._start_format.has_year:
+            start_datetime = cls._assign_year(start_datetime)
+        entry_values: dict[str, Any] = {name: value for name, value in values.items() if name in ENTRY_FIELDS}
+        entry_values.setdefault('location', cls.SCHEDULE_LOCATION)
+        return ScheduleEntryRecord(start_datetime=start_datetime, **entry_values)
+
+    @classmethod
+    def _parse_schedule_row(cls, row: Tag) -> ScheduleEntryRecord:
+        return cls._build_schedule_entry(cls._extraction_plan.extract(row))
+
+    @classmethod
+    def _parse_schedule_element(cls, row: etree._Element) -> ScheduleEntryRecord:
+        # The plan reads the streamed element as it is, without re-parsing it into a Tag
+        return cls._build_schedule_entry(cls._extraction_plan.extract(row))
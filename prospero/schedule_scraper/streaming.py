@@ -0,0 +1,120 @@
+from typing import Any, Callable
+
+from bs4 import BeautifulSoup, Tag
+from lxml import etree
+
+# (tag, class) of an element, a None class matches any element with that tag
+ElementSpec = tuple[str, str | None]
+
+# Bytes of the response body fed to the parser at once
+STREAM_CHUNK_SIZE: int = 64 * 1024
+# Rows inside this element are table headers, never entries
+TABLE_HEADER_TAG: str = 'thead'
+
+
+def _matches(element: etree._Element, element_spec: ElementSpec) -> bool:
+    tag, css_class = element_spec
+    if element.tag != tag:
+        return False
+    if css_class is None:
+        return True
+    # Same as BeautifulSoup: the class matches one of the element's classes or its whole class attribute
+    element_class: str = element.get('class', '')
+    return css_class == element_class or css_class in element_class.split()
+
+
+def to_tag(element: etree._Element) -> Tag:
+    """
+    Re-parse a row into a BeautifulSoup Tag, for parsers that only read Tags.
+    """
+    # Rows are small, re-parsing one is cheaper than keeping the whole page as a soup
+    row_html: str = etree.tostring(element, encoding='unicode', method='html', with_tail=False)
+    return BeautifulSoup(row_html, 'lxml').find(element.tag)
+
+
+def _drop(element: etree._Element) -> None:
+    element.clear(keep_tail=False)
+    # The element itself may still be referenced by the parser, drop its finished siblings instead
+    while element.getprevious() is not None:
+        del element.getparent()[0]
+
+
+class ScheduleRowStream:
+    """
+    Parses a schedule page chunk by chunk with lxml, passing every row to parse_row as soon as its
+    closing tag has been parsed. parse_row gets the lxml element, which is dropped once it returns.
+
+    Rows are taken from the first container element if there is one, otherwise from the whole page.
+    Rows in a thead and the first header_rows of the others are skipped. Finished rows and everything
+    outside of rows are dropped from the tree right away, memory stays flat however long the page is.
+    """
+
+    def __init__(
+            self,
+            row: ElementSpec,
+            container: ElementSpec | None = None,
+            header_rows: int = 0,
+            encoding: str | None = None,
+            parse_row: Callable[[etree._Element], Any] = to_tag
+    ):
+        self.row: ElementSpec = row
+        self.container: ElementSpec | None = container
+        self.header_rows: int = header_rows
+        self.parse_row: Callable[[etree._Element], Any] = parse_row
+        self.parser: etree.HTMLPullParser = etree.HTMLPullParser(events=('start', 'end'), encoding=encoding)
+
+        self.container_element: etree._Element | None = None
+        self.container_closed: bool = False
+        self.open_rows: list[etree._Element] = []
+        self.open_table_headers: int = 0
+        self.row_count: int = 0
+
+    def _in_scope(self) -> bool:
+        return (self.container is None or self.container_element is not None) and self.open_table_headers == 0
+
+    def _read_rows(self) -> list[Any]:
+        rows: list[Any] = []
+        for event, element in self.parser.read_events():
+            if element.tag == TABLE_HEADER_TAG:
+                self.open_table_headers += 1 if event == 'start' else -1
+
+            if event == 'start':
+                if (
+                        self.container is not None and
+                        self.container_element is None and
+                        not self.container_closed and
+                        _matches(element, self.container)
+                ):
+                    self.container_element = element
+                elif self._in_scope() and _matches(element, self.row):
+                    self.open_rows.append(element)
+                continue
+
+            if len(self.open_rows) > 0 and element is self.open_rows[-1]:
+                self.open_rows.pop()
+                self.row_count += 1
+                if self.row_count > self.header_rows:
+                    rows.append(self.parse_row(element))
+            elif element is self.container_element:
+                self.container_element = None
+                self.container_closed = True
+
+            if len(self.open_rows) == 0:
+                _drop(element)
+        return rows
+
+    def feed(self, chunk: bytes) -> list[Any]:
+        """
+        Returns:
+            Parsed rows completed by chunk
+        """
+        self.parser.feed(chunk)
+        return self._read_rows()
+
+    def close(self) -> list[Any]:
+        """
+        Returns:
+            Parsed rows completed by the end of the page
+        """
+        self.parser.close()
+        return self._read_rows()
@@ -0,0 +1,112 @@
+import random
+import time
+from dataclasses import dataclass
+from enum import Enum
+
+from loguru import logger
+
+from prospero.config import (
+    SCHEDULE_CHECK_INTERVAL, SCHEDULE_CHECK_MIN_INTERVAL, SCHEDULE_CHECK_MAX_INTERVAL, SCHEDULE_CHECK_INTERVAL_BOUNDS,
+    SCHEDULE_CHECK_SPEEDUP, SCHEDULE_CHECK_SLOWDOWN, SCHEDULE_CHECK_JITTER, SCHEDULE_CHECK_RETRY_DELAY
+)
+from prospero.metrics import CHECK_INTERVAL_SECONDS
+from prospero.schedule_scraper.base import BaseScheduleScraper
+
+
+class CheckOutcome(Enum):
+    CHANGED = 'changed'
+    UNCHANGED = 'unchanged'
+    FAILED = 'failed'
+
+
+@dataclass
+class ScraperCheckState:
+    min_interval: float
+    max_interval: float
+    # Delay between successful checks, learned from how often the schedule changes
+    interval: float
+    next_check_at: float = 0.0
+    consecutive_failures: int = 0
+
+
+class CheckScheduler:
+    """
+    Decides when each scraper is checked next.
+
+    Every scraper has its own interval, halved (SCHEDULE_CHECK_SPEEDUP) after a check that found new,
+    changed or cancelled entries and grown (SCHEDULE_CHECK_SLOWDOWN) after one that didn't, so busy
+    venues are checked often and quiet ones rarely. Failed checks are retried with exponential
+    backoff from SCHEDULE_CHECK_RETRY_DELAY without touching the learned interval. All delays are
+    kept within the scraper's bounds and spread by SCHEDULE_CHECK_JITTER.
+    """
+
+    def __init__(self, schedule_scrapers: list[type[BaseScheduleScraper]]):
+        now: float = time.monotonic()
+        self.states: dict[type[BaseScheduleScraper], ScraperCheckState] = {}
+        for schedule_scraper in schedule_scrapers:
+            min_interval, max_interval = self.get_interval_bounds(schedule_scraper)
+            self.states[schedule_scraper] = ScraperCheckState(
+                min_interval=min_interval,
+                max_interval=max_interval,
+                interval=min(max(SCHEDULE_CHECK_INTERVAL, min_interval), max_interval),
+                # Everything is checked right away on startup
+                next_check_at=now
+            )
+
+    @staticmethod
+    def get_interval_bounds(schedule_scraper: type[BaseScheduleScraper]) -> tuple[float, float]:
+        """
+        Returns:
+            Minimum and maximum check interval of the scraper, from SCHEDULE_CHECK_INTERVAL_BOUNDS,
+            the scraper's class attributes or the global bounds, in that order
+        """
+        bounds: tuple[float, float] | None = SCHEDULE_CHECK_INTERVAL_BOUNDS.get(schedule_scraper.__name__)
+        if bounds is not None:
+            return bounds
+
+        min_interval: float = schedule_scraper.MIN_CHECK_INTERVAL or SCHEDULE_CHECK_MIN_INTERVAL
+        max_interval: float = schedule_scraper.MAX_CHECK_INTERVAL or SCHEDULE_CHECK_MAX_INTERVAL
+        return min_interval, max(min_interval, max_interval)
+
+    @staticmethod
+    def _jitter(delay: float) -> float:
+        return delay * random.uniform(1 - SCHEDULE_CHECK_JITTER, 1 + SCHEDULE_CHECK_JITTER)
+
+    def get_due_scrapers(self) -> list[type[BaseScheduleScraper]]:
+        now: float = time.monotonic()
+        return [
+            schedule_scraper
+            for schedule_scraper, state
+            in self.states.items()
+            if state.next_check_at <= now
+        ]
+
+    def get_seconds_until_next_check(self) -> float:
+        return max(0.0, min(state.next_check_at for state in self.states.values()) - time.monotonic())
+
+    def postpone(self, schedule_scraper: type[BaseScheduleScraper], delay: float) -> None:
+        """
+        Skip checks of schedule_scraper for delay seconds without counting it as a check.
+        """
+        self.states[schedule_scraper].next_check_at = time.monotonic() + delay
+
+    def record(self, schedule_scraper: type[BaseScheduleScraper], outcome: CheckOutcome) -> None:
+        state: ScraperCheckState = self.states[schedule_scraper]
+
+        delay: float
+        if outcome is CheckOutcome.FAILED:
+            state.consecutive_failures += 1
+            delay = min(SCHEDULE_CHECK_RETRY_DELAY * 2 ** (state.consecutive_failures - 1), state.max_interval)
+        else:
+            state.consecutive_failures = 0
+            state.interval *= SCHEDULE_CHECK_SPEEDUP if outcome is CheckOutcome.CHANGED else SCHEDULE_CHECK_SLOWDOWN
+            state.interval = min(max(state.interval, state.min_interval), state.max_interval)
+            delay = state.interval
+
+        delay = self._jitter(delay)
+        state.next_check_at = time.monotonic() + delay
+        CHECK_INTERVAL_SECONDS.labels(schedule_scraper.__name__).set(state.interval)
+        logger.debug(
+            f'{schedule_scraper.__name__} check {outcome.value}, next check in {delay:.0f} seconds '
+            f'(interval {state.interval:.0f} seconds, {state.consecutive_failures} consecutive failures)'
+        )
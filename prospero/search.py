@@ -0,0 +1,200 @@
+"""
+Search the schedule history by text, venue and date range.
+
+Usage:
+    python -m prospero.search [TEXT] [--location "Gavella (Velika scena)"] [--from 2024-10-01] [--to 2024-10-31]
+        [--limit 20] [--cursor CURSOR] [--json]
+    python -m prospero.search --rebuild
+
+Every word of TEXT has to appear in the title, note or location of an entry, as a word or the start of
+one, ignoring case and diacritics. Results are ordered by start, a page that is followed by more
+results prints the --cursor of the next one.
+"""
+import argparse
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Any
+
+from sqlalchemy import Select, literal_column, select, text, tuple_
+
+from prospero.db import SEARCH_INDEX_TABLE, ScheduleDatabase, ScheduleEntry, ScheduleEntryKey
+from prospero.feeds import get_entry_json
+from prospero.metrics import DB_OPERATION_SECONDS
+from prospero.subscriptions import WORD_PATTERN
+
+# Results per page unless a limit is given, and the highest limit allowed
+SEARCH_PAGE_SIZE: int = 20
+MAX_SEARCH_PAGE_SIZE: int = 200
+
+
+def get_match_query(text: str) -> str:
+    """
+    Turn free text into an FTS5 query matching entries that contain every word, or a word starting with
+    it. Quoting the words keeps FTS5 operators and punctuation in text from being interpreted.
+
+    Raises:
+        ValueError: If text has no words
+    """
+    words: list[str] = WORD_PATTERN.findall(text)
+    if len(words) == 0:
+        raise ValueError(f'No words to search for in {text!r}')
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def encode_cursor(key: ScheduleEntryKey) -> str:
+    start_datetime, title, location = key
+    return base64.urlsafe_b64encode(
+        json.dumps([start_datetime.isoformat(), title, location], ensure_ascii=False).encode('utf-8')
+    ).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> ScheduleEntryKey:
+    """
+    Raises:
+        ValueError: If cursor was not made by encode_cursor
+    """
+    try:
+        start_datetime, title, location = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(start_datetime), str(title), str(location)
+    except (binascii.Error, UnicodeError, TypeError, ValueError) as e:
+        raise ValueError(f'Invalid cursor {cursor!r}') from e
+
+
+@dataclass(frozen=True)
+class SearchQuery:
+    # Free text, see get_match_query
+    text: str | None = None
+    # Exact location
+    location: str | None = None
+    # First and last day of the results, inclusive
+    start_date: date | None = None
+    end_date: date | None = None
+    limit: int = SEARCH_PAGE_SIZE
+    # Where the page starts, the next_cursor of the previous page
+    cursor: str | None = None
+
+    def __post_init__(self):
+        if not 1 <= self.limit <= MAX_SEARCH_PAGE_SIZE:
+            raise ValueError(f'Limit has to be between 1 and {MAX_SEARCH_PAGE_SIZE}, not {self.limit}')
+        if self.start_date is not None and self.end_date is not None and self.start_date > self.end_date:
+            raise ValueError(f'Search starts on {self.start_date}, after it ends on {self.end_date}')
+        if self.text is not None:
+            get_match_query(self.text)
+        if self.cursor is not None:
+            decode_cursor(self.cursor)
+
+
+@dataclass(frozen=True)
+class SearchPage:
+    entries: list[ScheduleEntry]
+    # Cursor of the next page, None if this is the last one
+    next_cursor: str | None
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            'entries': [get_entry_json(entry) for entry in self.entries],
+            'next_cursor': self.next_cursor,
+        }
+
+
+def _get_search_statement(db: ScheduleDatabase, query: SearchQuery) -> Select:
+    """
+    Raises:
+        NotImplementedError: If query has text and the database has no search index
+    """
+    statement: Select = select(ScheduleEntry).order_by(
+        ScheduleEntry.start_datetime, ScheduleEntry.title, ScheduleEntry.location
+    )
+    if query.text is not None:
+        if not db.has_search_index:
+            raise NotImplementedError(f'Searching text needs SQLite, not {db.engine.dialect.name}')
+        statement = statement.where(
+            ScheduleEntry.id.in_(
+                select(literal_column('rowid'))
+                .select_from(text(SEARCH_INDEX_TABLE))
+                .where(text(f'{SEARCH_INDEX_TABLE} MATCH :match_query'))
+            )
+        ).params(match_query=get_match_query(query.text))
+    if query.location is not None:
+        statement = statement.where(ScheduleEntry.location == query.location)
+    if query.start_date is not None:
+        statement = statement.where(ScheduleEntry.start_datetime >= datetime.combine(query.start_date, time.min))
+    if query.end_date is not None:
+        statement = statement.where(
+            ScheduleEntry.start_datetime < datetime.combine(query.end_date + timedelta(days=1), time.min)
+        )
+    if query.cursor is not None:
+        statement = statement.where(
+            tuple_(ScheduleEntry.start_datetime, ScheduleEntry.title, ScheduleEntry.location) >
+            tuple_(*decode_cursor(query.cursor))
+        )
+    # One more than asked for tells whether there is a next page
+    return statement.limit(query.limit + 1)
+
+
+@DB_OPERATION_SECONDS.labels('search').time()
+def search(db: ScheduleDatabase, query: SearchQuery) -> SearchPage:
+    """
+    Get a page of the entries matching query, ordered by start.
+
+    Text is matched through the full-text index, venue and date range through the indexes of
+    schedule_entries, and a page continues after the last key of the previous one, so no query scans
+    the history however long it gets. Runs in a session of its own, so it can be called from any thread.
+
+    Raises:
+        NotImplementedError: If query has text and the database has no search index
+    """
+    with db.Session() as session:
+        entries: list[ScheduleEntry] = list(session.scalars(_get_search_statement(db, query)))
+        session.expunge_all()
+
+    if len(entries) > query.limit:
+        entries = entries[:query.limit]
+        return SearchPage(entries=entries, next_cursor=encode_cursor(entries[-1].key))
+    return SearchPage(entries=entries, next_cursor=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('text', nargs='?', help='Words to search the title, note and location for')
+    parser.add_argument('--location', help='Exact location, e.g. "Gavella (Velika scena)"')
+    parser.add_argument('--from', dest='start_date', type=date.fromisoformat, help='First day, YYYY-MM-DD')
+    parser.add_argument('--to', dest='end_date', type=date.fromisoformat, help='Last day, YYYY-MM-DD')
+    parser.add_argument('--limit', type=int, default=SEARCH_PAGE_SIZE)
+    parser.add_argument('--cursor', help='Cursor of the page to show, as printed after the previous one')
+    parser.add_argument('--json', action='store_true', help='Print the page as JSON')
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild the search index from the entries')
+    args = parser.parse_args()
+
+    if args.rebuild:
+        ScheduleDatabase().rebuild_search_index()
+        return
+
+    try:
+        query: SearchQuery = SearchQuery(
+            text=args.text,
+            location=args.location,
+            start_date=args.start_date,
+            end_date=args.end_date,
+            limit=args.limit,
+            cursor=args.cursor
+        )
+    except ValueError as e:
+        parser.error(str(e))
+
+    page: SearchPage = search(ScheduleDatabase(), query)
+    if args.json:
+        print(json.dumps(page.to_json(), ensure_ascii=False, indent=2))
+        return
+    for entry in page.entries:
+        cancelled: str = ' (cancelled)' if entry.cancelled else ''
+        print(f'{entry.start_datetime:%Y-%m-%d %H:%M}  {entry.location}  {entry.title}{cancelled}')
+    if page.next_cursor is not None:
+        print(f'More results: --cursor {page.next_cursor}')
+
+
+if __name__ == '__main__':
+    main()
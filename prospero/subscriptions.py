@@ -0,0 +1,329 @@
+"""
+Manage the subscription rules that decide which chats are notified of which entries.
+
+Usage:
+    python -m prospero.subscriptions list [--chat CHAT_ID]
+    python -m prospero.subscriptions add --chat CHAT_ID [--location Gavella] [--keyword "ivo vojnović"]
+        [--title-pattern REGEX] [--weekdays sat,sun] [--earliest-start 18:00] [--latest-start 23:00]
+        [--min-duration 60] [--max-duration 150]
+    python -m prospero.subscriptions remove RULE_ID [RULE_ID ...]
+
+A chat receives the entries matching any of its rules, and every entry while it has no rules.
+"""
+import argparse
+import re
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, time
+from itertools import chain
+from typing import Iterable, Protocol
+
+from loguru import logger
+from sqlalchemy import delete, select
+
+from prospero.config import get_telegram_chat_ids
+from prospero.db import ScheduleDatabase, SubscriptionRule
+from prospero.diff import ScheduleChanges
+
+WEEKDAY_NAMES: tuple[str, ...] = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+WORD_PATTERN: re.Pattern = re.compile(r'\w+')
+
+
+class MatchableEntry(Protocol):
+    start_datetime: datetime
+    title: str
+    location: str
+    duration: int | None
+
+
+def get_words(text: str) -> frozenset[str]:
+    return frozenset(WORD_PATTERN.findall(text.casefold()))
+
+
+def parse_weekdays(value: str) -> frozenset[int]:
+    """
+    Parse comma separated weekday names (mon, tue, ...) or numbers (0 is Monday).
+
+    Raises:
+        ValueError: If a weekday is unknown
+    """
+    weekdays: set[int] = set()
+    for weekday in value.split(','):
+        weekday = weekday.strip().lower()
+        if weekday.isdigit() and int(weekday) < len(WEEKDAY_NAMES):
+            weekdays.add(int(weekday))
+        elif weekday[:3] in WEEKDAY_NAMES:
+            weekdays.add(WEEKDAY_NAMES.index(weekday[:3]))
+        else:
+            raise ValueError(f'Unknown weekday {weekday!r}')
+    return frozenset(weekdays)
+
+
+@dataclass(frozen=True, slots=True)
+class CompiledRule:
+    """
+    SubscriptionRule with its conditions parsed, ready to be matched against entries.
+    """
+    rule_id: int | None
+    chat_id: str
+    location: str | None
+    keyword_words: frozenset[str]
+    title_pattern: re.Pattern | None
+    weekdays: frozenset[int] | None
+    earliest_start: time | None
+    latest_start: time | None
+    min_duration: int | None
+    max_duration: int | None
+
+    @classmethod
+    def from_rule(cls, rule: SubscriptionRule) -> 'CompiledRule':
+        """
+        Raises:
+            ValueError: If a condition of rule is invalid
+        """
+        try:
+            title_pattern: re.Pattern | None = (
+                re.compile(rule.title_pattern, re.IGNORECASE) if rule.title_pattern else None
+            )
+        except re.error as e:
+            raise ValueError(f'Invalid title pattern {rule.title_pattern!r}: {e}') from e
+
+        keyword_words: frozenset[str] = get_words(rule.title_keyword) if rule.title_keyword else frozenset()
+        if rule.title_keyword and len(keyword_words) == 0:
+            raise ValueError(f'Keyword {rule.title_keyword!r} contains no words')
+
+        return cls(
+            rule_id=rule.id,
+            chat_id=rule.chat_id,
+            location=rule.location or None,
+            keyword_words=keyword_words,
+            title_pattern=title_pattern,
+            weekdays=parse_weekdays(rule.weekdays) if rule.weekdays else None,
+            earliest_start=time.fromisoformat(rule.earliest_start) if rule.earliest_start else None,
+            latest_start=time.fromisoformat(rule.latest_start) if rule.latest_start else None,
+            min_duration=rule.min_duration,
+            max_duration=rule.max_duration
+        )
+
+    def _matches_start_time(self, start_time: time) -> bool:
+        if self.earliest_start is None:
+            return self.latest_start is None or start_time <= self.latest_start
+        if self.latest_start is None:
+            return start_time >= self.earliest_start
+        if self.earliest_start <= self.latest_start:
+            return self.earliest_start <= start_time <= self.latest_start
+        # The window wraps past midnight
+        return start_time >= self.earliest_start or start_time <= self.latest_start
+
+    def matches(self, entry: MatchableEntry, title_words: frozenset[str]) -> bool:
+        if self.location is not None and entry.location != self.location:
+            return False
+        if not self.keyword_words <= title_words:
+            return False
+        if self.weekdays is not None and entry.start_datetime.weekday() not in self.weekdays:
+            return False
+        if not self._matches_start_time(entry.start_datetime.time()):
+            return False
+        if self.min_duration is not None or self.max_duration is not None:
+            if entry.duration is None:
+                return False
+            if self.min_duration is not None and entry.duration < self.min_duration:
+                return False
+            if self.max_duration is not None and entry.duration > self.max_duration:
+                return False
+        if self.title_pattern is not None and self.title_pattern.search(entry.title) is None:
+            return False
+        return True
+
+
+class SubscriptionIndex:
+    """
+    Routes entries to the chats whose subscription rules they match.
+
+    Every rule is indexed once: by its location if it has one, otherwise by the longest word of its
+    keyword. Only rules with neither (e.g. only a weekday or a title pattern) are checked against every
+    entry. Matching an entry therefore costs a lookup per title word plus the rules indexed under its
+    location and words, not a pass over every rule of every chat.
+    """
+
+    def __init__(self, rules: Iterable[SubscriptionRule], chat_ids: Iterable[str]):
+        self.chat_ids: list[str] = list(chat_ids)
+        self.location_rules: dict[str, list[CompiledRule]] = defaultdict(list)
+        self.keyword_rules: dict[str, list[CompiledRule]] = defaultdict(list)
+        self.scanned_rules: list[CompiledRule] = []
+
+        filtered_chat_ids: set[str] = set()
+        for rule in rules:
+            if rule.chat_id not in self.chat_ids:
+                logger.debug(f'Ignoring {rule}, its chat is not in TELEGRAM_CHAT_IDS')
+                continue
+            # A chat whose rules are all invalid receives nothing rather than everything
+            filtered_chat_ids.add(rule.chat_id)
+
+            try:
+                compiled_rule: CompiledRule = CompiledRule.from_rule(rule)
+            except ValueError as e:
+                logger.error(f'Ignoring invalid {rule}: {e}')
+                continue
+
+            if compiled_rule.location is not None:
+                self.location_rules[compiled_rule.location].append(compiled_rule)
+            elif len(compiled_rule.keyword_words) > 0:
+                self.keyword_rules[max(sorted(compiled_rule.keyword_words), key=len)].append(compiled_rule)
+            else:
+                self.scanned_rules.append(compiled_rule)
+
+        # Chats without rules receive everything and are never matched
+        self.unfiltered_chat_ids: list[str] = [
+            chat_id for chat_id in self.chat_ids if chat_id not in filtered_chat_ids
+        ]
+
+    @classmethod
+    def load(cls, db: ScheduleDatabase, chat_ids: Iterable[str] | None = None) -> 'SubscriptionIndex':
+        """
+        Load the rules of chat_ids, TELEGRAM_CHAT_IDS if None.
+
+        Raises:
+            SessionNotActiveError: If called outside of the context manager of db
+        """
+        return cls(db.get_subscription_rules(), get_telegram_chat_ids() if chat_ids is None else chat_ids)
+
+    def get_matching_chat_ids(self, entry: MatchableEntry) -> set[str]:
+        """
+        Chats with rules that entry matches, the unfiltered chats are not included.
+        """
+        title_words: frozenset[str] = get_words(entry.title)
+        candidate_rules: Iterable[CompiledRule] = chain(
+            self.location_rules.get(entry.location, ()),
+            chain.from_iterable(self.keyword_rules.get(word, ()) for word in title_words),
+            self.scanned_rules
+        )
+
+        chat_ids: set[str] = set()
+        for rule in candidate_rules:
+            if rule.chat_id not in chat_ids and rule.matches(entry, title_words):
+                chat_ids.add(rule.chat_id)
+        return chat_ids
+
+    def route_changes(self, schedule_changes: ScheduleChanges) -> list[tuple[list[str], ScheduleChanges]]:
+        """
+        Split schedule_changes by the chats they are for.
+
+        Returns:
+            Chats and their changes, chats receiving the same changes are grouped so they are formatted once
+        """
+        entries: list[MatchableEntry] = [
+            *schedule_changes.new,
+            *(entry for entry, _ in schedule_changes.changed),
+            *schedule_changes.cancelled
+        ]
+        all_indexes: tuple[int, ...] = tuple(range(len(entries)))
+
+        chat_indexes: dict[str, list[int]] = defaultdict(list)
+        for index, entry in enumerate(entries):
+            for chat_id in self.get_matching_chat_ids(entry):
+                chat_indexes[chat_id].append(index)
+
+        groups: dict[tuple[int, ...], list[str]] = {}
+        if len(self.unfiltered_chat_ids) > 0:
+            groups[all_indexes] = list(self.unfiltered_chat_ids)
+        for chat_id, indexes in chat_indexes.items():
+            groups.setdefault(tuple(indexes), []).append(chat_id)
+
+        changed_start: int = len(schedule_changes.new)
+        cancelled_start: int = changed_start + len(schedule_changes.changed)
+        routed_changes: list[tuple[list[str], ScheduleChanges]] = []
+        for indexes, chat_ids in groups.items():
+            if len(indexes) == 0:
+                continue
+            if indexes == all_indexes:
+                routed_changes.append((chat_ids, schedule_changes))
+                continue
+            routed_changes.append((chat_ids, ScheduleChanges(
+                new=[schedule_changes.new[i] for i in indexes if i < changed_start],
+                changed=[
+                    schedule_changes.changed[i - changed_start]
+                    for i in indexes
+                    if changed_start <= i < cancelled_start
+                ],
+                cancelled=[schedule_changes.cancelled[i - cancelled_start] for i in indexes if i >= cancelled_start]
+            )))
+        return routed_changes
+
+
+def _get_rule(args: argparse.Namespace) -> SubscriptionRule:
+    """
+    Raises:
+        ValueError: If a condition given in args is invalid
+    """
+    rule: SubscriptionRule = SubscriptionRule(
+        chat_id=args.chat,
+        location=args.location,
+        title_keyword=args.keyword,
+        title_pattern=args.title_pattern,
+        weekdays=(
+            ','.join(str(weekday) for weekday in sorted(parse_weekdays(args.weekdays)))
+            if args.weekdays else None
+        ),
+        earliest_start=args.earliest_start,
+        latest_start=args.latest_start,
+        min_duration=args.min_duration,
+        max_duration=args.max_duration,
+        created_at=datetime.now()
+    )
+    CompiledRule.from_rule(rule)
+    return rule
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    list_parser = commands.add_parser('list', help='List the rules')
+    list_parser.add_argument('--chat', help='Only list the rules of this chat')
+
+    add_parser = commands.add_parser('add', help='Add a rule')
+    add_parser.add_argument('--chat', required=True)
+    add_parser.add_argument('--location', help='Exact location, e.g. "Gavella (Velika scena)"')
+    add_parser.add_argument('--keyword', help='Words that must all appear in the title')
+    add_parser.add_argument('--title-pattern', help='Regular expression searched in the title')
+    add_parser.add_argument('--weekdays', help='Comma separated weekdays, e.g. fri,sat,sun')
+    add_parser.add_argument('--earliest-start', help='HH:MM')
+    add_parser.add_argument('--latest-start', help='HH:MM')
+    add_parser.add_argument('--min-duration', type=int, help='Minutes')
+    add_parser.add_argument('--max-duration', type=int, help='Minutes')
+
+    remove_parser = commands.add_parser('remove', help='Remove rules')
+    remove_parser.add_argument('rule_ids', nargs='+', type=int)
+
+    args = parser.parse_args()
+
+    if args.command == 'add':
+        try:
+            new_rule: SubscriptionRule = _get_rule(args)
+        except ValueError as e:
+            parser.error(str(e))
+
+    with ScheduleDatabase() as db:
+        if args.command == 'list':
+            statement = select(SubscriptionRule).order_by(SubscriptionRule.chat_id, SubscriptionRule.id)
+            if args.chat is not None:
+                statement = statement.where(SubscriptionRule.chat_id == args.chat)
+            for rule in db.session.scalars(statement):
+                print(rule)
+        elif args.command == 'add':
+            if args.chat not in get_telegram_chat_ids():
+                logger.warning(f'Chat {args.chat} is not in TELEGRAM_CHAT_IDS, the rule has no effect until it is')
+            db.session.add(new_rule)
+            db.session.flush()
+            print(new_rule)
+        elif args.command == 'remove':
+            removed: int = db.session.execute(
+                delete(SubscriptionRule).where(SubscriptionRule.id.in_(args.rule_ids))
+            ).rowcount
+            print(f'Removed {removed} rules')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from sqlalchemy import create_engine, event, inspect, select, text
+
+os.environ.setdefault('TELEGRAM_CHAT_IDS', '1')
+
+from prospero.circuit_breaker import CircuitBreaker  # noqa: E402
+from prospero.db import (  # noqa: E402
+    UNKEYED_SCHEDULE_ENTRIES_TABLE, KnownEntryIndex, ScheduleDatabase, ScheduleEntry, ScheduleEntryRecord,
+    ScraperSnapshotEntry
+)
+from prospero.search import SearchQuery, search  # noqa: E402
+
+
+# Entries of the tests are upcoming, the known entry index only keeps those
+START: datetime = datetime.now().replace(microsecond=0)
+
+
+def _record(days: int) -> ScheduleEntryRecord:
+    return ScheduleEntryRecord(start_datetime=START + timedelta(days=days), title='Hamlet', location='Velika scena')
+
+
+def test_known_entry_index_reads_the_database_only_once_invalidated(
+        tmp_path: Path,
+        monkeypatch: pytest.MonkeyPatch
+):
+    db_uri: str = f'sqlite:///{tmp_path / "schedule.db"}'
+    index: KnownEntryIndex = KnownEntryIndex()
+    db: ScheduleDatabase = ScheduleDatabase(db_uri, known_entry_index=index)
+    other_db: ScheduleDatabase = ScheduleDatabase(db_uri)
+
+    loads: list[int] = []
+    load = index.load
+    version_reads: list[str] = []
+    get_table_version = db.get_table_version
+
+    def record_load(session, entries_version: int) -> None:
+        loads.append(entries_version)
+        load(session, entries_version)
+
+    def record_version_read(name: str) -> int:
+        version_reads.append(name)
+        return get_table_version(name)
+
+    monkeypatch.setattr(index, 'load', record_load)
+    monkeypatch.setattr(db, 'get_table_version', record_version_read)
+
+    with db:
+        db.add_entries(db.filter_new_entries([_record(1)]))
+    assert (len(loads), len(version_reads)) == (1, 1)
+
+    # Its own inserts and writes to other tables neither make the index stale nor read the version
+    with db:
+        db.add_entries(db.filter_new_entries([_record(2)]))
+    CircuitBreaker(db).record_failure('kerempuh', 'timeout')
+    with db:
+        assert db.filter_new_entries([_record(1), _record(2)]) == []
+    assert (len(loads), len(version_reads)) == (1, 1)
+
+    # An insert by another process is only noticed once the index is invalidated, e.g. by a lease change
+    with other_db:
+        other_db.add_entries([_record(3)])
+    with db:
+        assert db.filter_new_entries([_record(3)]) == [_record(3)]
+    index.invalidate()
+    with db:
+        assert db.filter_new_entries([_record(3), _record(4)]) == [_record(4)]
+    assert (len(loads), len(version_reads)) == (2, 2)
+
+    # As is one that bumped the version past an insert of its own
+    with other_db:
+        other_db.add_entries([_record(5)])
+    with db:
+        db.add_entries(db.filter_new_entries([_record(4)]))
+    with db:
+        assert db.filter_new_entries([_record(5), _record(6)]) == [_record(6)]
+    assert (len(loads), len(version_reads)) == (3, 3)
+
+
+def test_scraper_snapshots_are_read_once_per_invalidation(tmp_path: Path):
+    index: KnownEntryIndex = KnownEntryIndex()
+    db: ScheduleDatabase = ScheduleDatabase(f'sqlite:///{tmp_path / "schedule.db"}', known_entry_index=index)
+    snapshot_reads: list[str] = []
+
+    @event.listens_for(db.engine, 'before_cursor_execute')
+    def record_snapshot_read(connection, cursor, statement: str, parameters, context, executemany) -> None:
+        if statement.startswith('SELECT') and ScraperSnapshotEntry.__tablename__ in statement:
+            snapshot_reads.append(statement)
+
+    with db:
+        assert db.get_scraper_snapshot('kerempuh') == {}
+        db.update_scraper_snapshot('kerempuh', [], {_record(1).key: 'a', _record(2).key: 'b'})
+    with db:
+        db.update_scraper_snapshot('kerempuh', [_record(1).key], {_record(2).key: 'c'})
+        assert db.get_scraper_snapshot('kerempuh') == {_record(2).key: 'c'}
+    assert len(snapshot_reads) == 1
+
+    # A failed transaction leaves nothing of its update behind, the snapshot is read again
+    with pytest.raises(RuntimeError), db:
+        db.update_scraper_snapshot('kerempuh', [_record(2).key], {})
+        raise RuntimeError
+    with db:
+        assert db.get_scraper_snapshot('kerempuh') == {_record(2).key: 'c'}
+        assert db.get_scraper_snapshot('kerempuh') == {_record(2).key: 'c'}
+    assert len(snapshot_reads) == 2
+
+
+def test_schedule_entries_without_ids_are_moved(tmp_path: Path):
+    db_uri: str = f'sqlite:///{tmp_path / "schedule.db"}'
+    engine = create_engine(db_uri)
+    with engine.begin() as connection:
+        # schedule_entries as created before it had ids, and a move of it that was interrupted
+        connection.execute(text(
+            f'CREATE TABLE {UNKEYED_SCHEDULE_ENTRIES_TABLE} ('
+            'start_datetime DATETIME NOT NULL, title VARCHAR NOT NULL, note VARCHAR, location VARCHAR NOT NULL, '
+            'duration INTEGER, includes_break BOOLEAN, buy_tickets_url VARCHAR, '
+            'CONSTRAINT schedule_entry_pk PRIMARY KEY (start_datetime, title, location))'
+        ))
+        for days in range(3):
+            connection.execute(
+                text(
+                    f'INSERT INTO {UNKEYED_SCHEDULE_ENTRIES_TABLE} (start_datetime, title, location) '
+                    'VALUES (:start_datetime, :title, :location)'
+                ),
+                {'start_datetime': START + timedelta(days=days), 'title': f'Kuća {days}', 'location': 'Velika scena'}
+            )
+    engine.dispose()
+
+    db: ScheduleDatabase = ScheduleDatabase(db_uri)
+    with db.Session() as session:
+        entries: list[ScheduleEntry] = list(session.scalars(select(ScheduleEntry).order_by(ScheduleEntry.id)))
+    assert [(entry.id, entry.title, entry.cancelled) for entry in entries] == [
+        (1, 'Kuća 0', False), (2, 'Kuća 1', False), (3, 'Kuća 2', False)
+    ]
+    assert UNKEYED_SCHEDULE_ENTRIES_TABLE not in inspect(db.engine).get_table_names()
+
+    # The search index refers to the ids, which VACUUM keeps
+    with db.engine.connect() as connection:
+        connection.execute(text(f"DELETE FROM {ScheduleEntry.__tablename__} WHERE title = 'Kuća 0'"))
+        connection.commit()
+        connection.execute(text('VACUUM'))
+    assert [entry.title for entry in search(db, SearchQuery(text='kuca 2')).entries] == ['Kuća 2']
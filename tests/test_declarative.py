@@ -0,0 +1,34 @@
+from bs4 import BeautifulSoup
+from lxml import etree
+
+from prospero.schedule_scraper.declarative import ExtractionPlan, ScheduleField
+
+ROW_HTML: str = (
+    '<div class="row  event"><div class="date"> 12.10. <!-- sub --></div>'
+    '<div class="info"><a href="/ulaznice">Kuća&nbsp;</a><script>track()</script> 90 min <b>s pauzom</b></div>'
+    '<span>prva</span><span>druga</span></div>'
+)
+
+
+def test_plan_reads_tags_and_lxml_elements_alike():
+    plan: ExtractionPlan = ExtractionPlan({
+        'row': ScheduleField(None),
+        'date': ScheduleField('div.date'),
+        'title': ScheduleField('div.info a'),
+        'url': ScheduleField('div.info a', attribute='href'),
+        'strings': ScheduleField('div.info', strings=True),
+        'second': ScheduleField('span[1]'),
+        'missing': ScheduleField('div.note', optional=True, default='none'),
+    })
+    tag = BeautifulSoup(ROW_HTML, 'lxml').find('div')
+    element = etree.fromstring(ROW_HTML, etree.HTMLParser()).find('.//div')
+
+    assert plan.extract(element) == plan.extract(tag) == {
+        'row': '12.10. Kuća\xa0 90 min s pauzomprvadruga',
+        'date': '12.10.',
+        'title': 'Kuća',
+        'url': '/ulaznice',
+        'strings': ['Kuća', '90 min', 's pauzom'],
+        'second': 'druga',
+        'missing': 'none',
+    }
@@ -0,0 +1,43 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from sqlalchemy import select, update
+
+os.environ.setdefault('TELEGRAM_CHAT_IDS', '1')
+
+from prospero.db import OutboxNotification, ScheduleDatabase  # noqa: E402
+from prospero.dispatcher import NotificationDispatcher  # noqa: E402
+
+
+def test_send_due_sends_and_prunes_sent_notifications(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    db: ScheduleDatabase = ScheduleDatabase(f'sqlite:///{tmp_path / "schedule.db"}')
+    with db:
+        db.enqueue_notifications(['1'], ['sent long ago', 'sent recently', 'due'])
+    with db.Session() as session, session.begin():
+        for body, sent_at in (
+                ('sent long ago', datetime.now() - timedelta(days=31)),
+                ('sent recently', datetime.now() - timedelta(days=29))
+        ):
+            session.execute(
+                update(OutboxNotification).where(OutboxNotification.body == body).values(sent_at=sent_at)
+            )
+
+    sent_bodies: list[str] = []
+
+    async def send(apprise, body: str) -> None:
+        sent_bodies.append(body)
+
+    dispatcher: NotificationDispatcher = NotificationDispatcher(db, ['1'], 'replica', retention_days=30)
+    monkeypatch.setattr(dispatcher, '_get_apprise', lambda chat_id: None)
+    monkeypatch.setattr(dispatcher, '_send', send)
+    asyncio.run(dispatcher.send_due())
+
+    assert sent_bodies == ['due']
+    with db.Session() as session:
+        assert sorted(session.scalars(select(OutboxNotification.body))) == ['due', 'sent recently']
+        assert session.scalar(
+            select(OutboxNotification.sent_at).where(OutboxNotification.body == 'due')
+        ) is not None
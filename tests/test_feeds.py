@@ -0,0 +1,41 @@
+import json
+import os
+import re
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from sqlalchemy import select, update
+
+os.environ.setdefault('TELEGRAM_CHAT_IDS', '1')
+
+from prospero.db import ScheduleDatabase, ScheduleEntry, ScheduleEntryRecord  # noqa: E402
+from prospero.feeds import FeedCache, FeedFilter, render_ics, render_json  # noqa: E402
+
+START: datetime = datetime.now().replace(microsecond=0) + timedelta(days=1)
+
+
+def test_feeds_render_again_only_the_changed_entries(tmp_path: Path):
+    db: ScheduleDatabase = ScheduleDatabase(f'sqlite:///{tmp_path / "schedule.db"}')
+    with db:
+        db.add_entries([
+            ScheduleEntryRecord(start_datetime=START + timedelta(days=days), title=f'Kuća {days}', location='Kerempuh')
+            for days in range(3)
+        ])
+    feed_cache: FeedCache = FeedCache(db)
+    feed_cache.get(FeedFilter('json'))
+    feed_cache.get(FeedFilter('ics'))
+    assert feed_cache.entry_renders == 6
+
+    with db.Session() as session, session.begin():
+        session.execute(update(ScheduleEntry).where(ScheduleEntry.title == 'Kuća 1').values(note='Premijera'))
+    feed_cache.invalidate(['Kerempuh'])
+    json_body: bytes = feed_cache.get(FeedFilter('json')).body
+    ics_body: bytes = feed_cache.get(FeedFilter('ics')).body
+    assert feed_cache.entry_renders == 8
+
+    with db.Session() as session:
+        entries: list[ScheduleEntry] = list(session.scalars(select(ScheduleEntry).order_by(ScheduleEntry.id)))
+    assert json.loads(json_body)['entries'] == json.loads(render_json(entries, START))['entries']
+    assert [entry['note'] for entry in json.loads(json_body)['entries']] == [None, 'Premijera', None]
+    # Only the DTSTAMP lines differ, they are when the feed was rendered
+    assert re.sub(rb'DTSTAMP:\w+', b'', ics_body) == re.sub(rb'DTSTAMP:\w+', b'', render_ics(entries, START))
@@ -0,0 +1,43 @@
+import os
+from datetime import datetime, timedelta
+
+os.environ.setdefault('TELEGRAM_CHAT_IDS', '1')
+
+from prospero.db import ScheduleEntryRecord  # noqa: E402
+from prospero.notifications import TELEGRAM_MESSAGE_LIMIT, format_new_entries_digest  # noqa: E402
+
+START: datetime = datetime(2026, 11, 1, 19, 30)
+
+
+def test_digest_shortens_lines_longer_than_a_message():
+    entries: list[ScheduleEntryRecord] = [
+        ScheduleEntryRecord(
+            start_datetime=START,
+            title='Hamlet',
+            location='Velika scena',
+            note='Premijera. ' * 1000,
+            buy_tickets_url='https://ulaznice.hr/hamlet'
+        ),
+        ScheduleEntryRecord(
+            start_datetime=START + timedelta(days=1),
+            title='Hamlet',
+            location='Velika scena',
+            buy_tickets_url='https://ulaznice.hr/' + 'hamlet' * 1000
+        ),
+        ScheduleEntryRecord(
+            start_datetime=START + timedelta(days=2),
+            title='Hamlet',
+            location='Velika scena',
+            note='Repriza'
+        ),
+    ]
+
+    messages: list[str] = format_new_entries_digest(entries)
+
+    assert all(len(message) <= TELEGRAM_MESSAGE_LIMIT for message in messages)
+    lines: list[str] = [line for message in messages for line in message.splitlines() if line.startswith('📅')]
+    assert len(lines) == 3
+    # The note is cut off but the ticket link kept, a link that would not fit is left out
+    assert lines[0].endswith('… [🎫](https://ulaznice.hr/hamlet)')
+    assert lines[1] == f"📅 {(START + timedelta(days=1)).strftime('%d. %B %Y (%A) %H:%M')}"
+    assert lines[2].endswith(' 📝 Repriza')
@@ -0,0 +1,57 @@
+import asyncio
+import os
+from pathlib import Path
+
+import httpx
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+os.environ.setdefault('TELEGRAM_CHAT_IDS', '1')
+
+from benchmarks.fixtures import kerempuh  # noqa: E402
+from prospero.__main__ import schedule_check  # noqa: E402
+from prospero.circuit_breaker import CircuitBreaker  # noqa: E402
+from prospero.db import ScheduleDatabase, ScheduleEntry  # noqa: E402
+from prospero.http_client import AsyncHttpClient  # noqa: E402
+from prospero.response_cache import ResponseCache  # noqa: E402
+from prospero.scheduler import CheckOutcome  # noqa: E402
+from prospero.schedule_scraper.kerempuh import KerempuhScheduleScraper  # noqa: E402
+
+ROWS: int = 5
+
+
+def _check(db: ScheduleDatabase, response_cache: ResponseCache, circuit_breaker: CircuitBreaker) -> dict:
+    async def check() -> dict:
+        transport: httpx.MockTransport = httpx.MockTransport(
+            lambda request: httpx.Response(200, content=kerempuh(ROWS).encode())
+        )
+        async with AsyncHttpClient(transport=transport) as client:
+            return await schedule_check(client, response_cache, db, [KerempuhScheduleScraper], circuit_breaker)
+
+    return asyncio.run(check())
+
+
+def test_failed_commit_does_not_mark_the_check_done(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    db: ScheduleDatabase = ScheduleDatabase(f'sqlite:///{tmp_path / "schedule.db"}')
+    response_cache: ResponseCache = ResponseCache(tmp_path / 'response_cache.json')
+    circuit_breaker: CircuitBreaker = CircuitBreaker(db)
+    circuit_breaker.record_failure(KerempuhScheduleScraper.__name__, 'timeout')
+
+    def fail_commit(session: Session) -> None:
+        raise RuntimeError('disk I/O error')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(Session, 'commit', fail_commit)
+        with pytest.raises(RuntimeError):
+            _check(db, response_cache, circuit_breaker)
+
+    assert response_cache.entries == {}
+    assert not response_cache.path.exists()
+    assert circuit_breaker.circuits[KerempuhScheduleScraper.__name__].failure_count == 1
+
+    # The same page is processed again once storing works
+    assert _check(db, response_cache, circuit_breaker) == {KerempuhScheduleScraper: CheckOutcome.CHANGED}
+    assert circuit_breaker.circuits[KerempuhScheduleScraper.__name__].failure_count == 0
+    with db.Session() as session:
+        assert session.scalar(select(func.count()).select_from(ScheduleEntry)) == ROWS